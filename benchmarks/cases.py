@@ -0,0 +1,225 @@
+import main
+from src import utils, normalise
+
+
+# Address pools of the generated interfaces, weighted to cover every VRF, unassigned and ignored ranges
+ADDRESS_POOLS = [
+    ('10.{}.{}.{}', (192, 218)),        # SCA VRFs
+    ('10.{}.{}.{}', (1, 191)),          # No VRF
+    ('192.168.{}.{}', None),            # Ignored
+    ('172.16.{}.{}', None)              # Ignored
+]
+ADDRESS_WEIGHTS = [70, 20, 5, 5]
+
+MASKS = ['255.255.255.0', '255.255.255.128', '255.255.255.192', '255.255.255.252', '255.255.254.0', '255.255.255.255']
+
+HOSTNAME_PREFIXES = ['SE-MUN-PAPER-SW', 'SE-OBB-RT', 'SE-SUN-FW', 'SE-OST-SW', 'DE-MAN-RT']
+
+CHECKPOINT_TYPES = ['simple-gateway', 'cluster-member', 'checkpoint-host']
+
+INTERFACES_PER_DEVICE = 8
+DUPLICATE_SHARE = 0.2   # Share of interfaces in the calculate_diff case reporting an address of another interface
+
+
+def random_ip(rng):
+    """Returns a random address from ADDRESS_POOLS"""
+    pattern, second_octet = rng.choices(ADDRESS_POOLS, ADDRESS_WEIGHTS)[0]
+    if second_octet is None:
+        return pattern.format(rng.randint(0, 255), rng.randint(1, 254))
+    return pattern.format(rng.randint(*second_octet), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def random_hostname(rng):
+    """Returns a random hostname, some of which have a site specific owner"""
+    return f'{rng.choice(HOSTNAME_PREFIXES)}{rng.randint(1, 9999):04}'
+
+
+def random_mac(rng):
+    """Returns a random mac address"""
+    return ':'.join(f'{rng.randint(0, 255):02x}' for _ in range(6))
+
+
+def random_interface(rng):
+    """Returns an interface in the standardized convention of the sources"""
+    return {
+        'interface-name': f'eth{rng.randint(0, 48)}',
+        'description': rng.choice(['', 'Uplink', 'Server VLAN', 'Printers', None]),
+        'ipv4Address': random_ip(rng),
+        'ipv4Mask': rng.choice(MASKS),
+        'subnet-name': '',
+        'subnet-description': '',
+        'is-gateway': rng.choice([None, 0, 1]),
+        'mac': random_mac(rng),
+        'vlan-id': rng.randint(1, 4094)
+    }
+
+
+def random_devices(rng, interfaces):
+    """Returns devices in the standardized convention with a total number of interfaces"""
+    devices = []
+    while interfaces > 0:
+        hostname = random_hostname(rng)
+        count = min(INTERFACES_PER_DEVICE, interfaces)
+        devices.append({
+            'hostname': hostname,
+            'type': 'Switches and Hubs',
+            'organisation': '',
+            'owner': utils.calc_owner(hostname),
+            'serial': f'FOC{rng.randint(0, 10**8):08}',
+            'interfaces': [random_interface(rng) for _ in range(count)]
+        })
+        interfaces -= count
+    return devices
+
+
+def random_checkpoint_object(rng, interfaces):
+    """Returns a listed Check Point device and the raw object requested for it"""
+    object_type = rng.choice(CHECKPOINT_TYPES)
+    name = random_hostname(rng)
+    raw_interfaces = []
+    for i in range(interfaces):
+        address = random_ip(rng)
+        mask = rng.choice(MASKS)
+        if object_type == 'checkpoint-host':
+            raw_interfaces.append({'name': f'eth{i}', 'subnet4': address, 'subnet-mask': mask, 'mask-length4': 24})
+        else:
+            raw_interfaces.append({'name': f'eth{i}', 'ipv4-address': address, 'ipv4-network-mask': mask, 'ipv4-mask-length': 24})
+    device = {'name': name, 'type': object_type, 'uid': f'uid-{rng.getrandbits(64):x}', 'domain': None}
+    raw_object = {'name': name, 'type': object_type, 'comments': rng.choice(['', 'Firewall']), 'interfaces': raw_interfaces}
+    return device, raw_object
+
+
+def random_address_response(rng, device, interface):
+    """Returns an IPAM address search response matching the interface, with a field changed in half of them"""
+    address = {
+        'id': str(rng.randint(1, 10**6)),
+        'hostname': device['hostname'],
+        'description': interface['description'],
+        'is_gateway': interface['is-gateway'],
+        'owner': device['owner'],
+        'mac': interface['mac'],
+        'custom_Device_Serial': device['serial']
+    }
+    if rng.random() < 0.5:
+        field = rng.choice(['hostname', 'description', 'owner', 'mac', 'custom_Device_Serial'])
+        address[field] = 'changed'
+    return {'success': True, 'data': [address]}
+
+
+class MissingAddressIpam:
+    """IPAM view in which no address or subnet exists yet, so calculate_diff compiles and deduplicates a change for every interface"""
+
+    def get_address(self, ip_address):
+        """Returns False, as for an address not found in IPAM"""
+        return False
+
+    def get_subnet_id(self, network_address):
+        """Returns None, as for a subnet not found in IPAM"""
+        return None
+
+    def get_master_subnet(self, possible_master_subnets):
+        """Returns None, as if no master subnet exists"""
+        return None
+
+
+#---------- Cases ----------
+# Each case returns the generated input for a number of items, and the function running the benchmarked code over all of them
+
+
+def case_calc_subnet(rng, size):
+    """utils.calc_subnet per interface address and mask"""
+    items = [(random_ip(rng), rng.choice(MASKS)) for _ in range(size)]
+
+    def run(items):
+        for ip_address, subnet_mask in items:
+            utils.calc_subnet(ip_address, subnet_mask)
+    return items, run
+
+
+def case_calc_master_subnets(rng, size):
+    """utils.calc_master_subnets per subnet"""
+    items = [utils.calc_subnet(random_ip(rng), rng.choice(MASKS))['network_address_full'] for _ in range(size)]
+
+    def run(items):
+        for subnet in items:
+            utils.calc_master_subnets(subnet)
+    return items, run
+
+
+def case_check_ip_in_ignored(rng, size):
+    """utils.check_ip_in_ignored per interface address"""
+    items = [random_ip(rng) for _ in range(size)]
+
+    def run(items):
+        for ip_address in items:
+            utils.check_ip_in_ignored(ip_address)
+    return items, run
+
+
+def case_calc_vrf(rng, size):
+    """utils.calc_vrf per subnet"""
+    items = [utils.calc_subnet(random_ip(rng), rng.choice(MASKS))['network_address_full'] for _ in range(size)]
+
+    def run(items):
+        for subnet in items:
+            utils.calc_vrf(subnet)
+    return items, run
+
+
+def case_calc_owner(rng, size):
+    """utils.calc_owner per hostname"""
+    items = [random_hostname(rng) for _ in range(size)]
+
+    def run(items):
+        for hostname in items:
+            utils.calc_owner(hostname)
+    return items, run
+
+
+def case_select_checkpoint_data(rng, size):
+    """select_checkpoint_data without the request of the object: normalising it and compiling the device, items are interfaces"""
+    items = [random_checkpoint_object(rng, min(INTERFACES_PER_DEVICE, size - i)) for i in range(0, size, INTERFACES_PER_DEVICE)]
+
+    def run(items):
+        for device, raw_object in items:
+            result = normalise.normalise_batch('checkpoint', [(raw_object['type'], raw_object)])[0]
+            main.compile_checkpoint_device(device, raw_object, result)
+    return items, run
+
+
+def case_calc_addr_update_data(rng, size):
+    """calc_addr_update_data per interface with an existing address"""
+    items = []
+    for device in random_devices(rng, size):
+        for interface in device['interfaces']:
+            items.append((device, interface, random_address_response(rng, device, interface)))
+
+    def run(items):
+        for device, interface, address_response in items:
+            main.calc_addr_update_data(device, interface, address_response)
+    return items, run
+
+
+def case_calculate_diff_dedupe(rng, size):
+    """calculate_diff of interfaces missing in IPAM, where addresses reported by several interfaces are added once"""
+    devices = random_devices(rng, size)
+    interfaces = [interface for device in devices for interface in device['interfaces']]
+    for interface in rng.sample(interfaces, int(len(interfaces) * DUPLICATE_SHARE)):
+        interface['ipv4Address'] = rng.choice(interfaces)['ipv4Address']
+    ipam = MissingAddressIpam()
+
+    def run(devices):
+        main.calculate_diff(devices, ipam)
+    return devices, run
+
+
+CASES = {
+    'calc_subnet': case_calc_subnet,
+    'calc_master_subnets': case_calc_master_subnets,
+    'check_ip_in_ignored': case_check_ip_in_ignored,
+    'calc_vrf': case_calc_vrf,
+    'calc_owner': case_calc_owner,
+    'select_checkpoint_data': case_select_checkpoint_data,
+    'calc_addr_update_data': case_calc_addr_update_data,
+    'calculate_diff_dedupe': case_calculate_diff_dedupe
+}
@@ -0,0 +1,148 @@
+from benchmarks import cases
+from src import cli_utils
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import platform
+import tracemalloc
+from datetime import datetime
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SIZES = '1000,10000,100000'             # Items per benchmark, --sizes 1000,1000000 for up to 1M
+REPEAT = 5                              # Timed runs per benchmark and size, the fastest counts
+THRESHOLD = 0.2                         # Share a result may be slower or allocate more than the baseline before it is flagged
+SEED = 4711                             # Generated inputs are the same on every run
+
+
+def time_run(run, items, repeat):
+    """Returns the fastest of repeat runs in seconds, with the garbage collector disabled like timeit"""
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(items)
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return min(timings)
+
+
+def measure_allocations(run, items):
+    """Returns the peak memory of a run and the memory still allocated after it.\n
+    Measured in a separate run, since tracing slows down every allocation."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        run(items)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Positive differences are memory still held after the run, e.g. by caches or the returned results
+    retained = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+    return {
+        'peak_bytes': peak,
+        'retained_bytes': sum(stat.size_diff for stat in retained)
+    }
+
+
+def run_case(name, size, repeat):
+    """Generates the input of a case and returns its throughput and allocations"""
+    items, run = cases.CASES[name](random.Random(SEED), size)
+    # Warms caches such as the compiled address ranges, as they are warm in a running sync
+    run(items[:100])
+    seconds = time_run(run, items, repeat)
+    allocations = measure_allocations(run, items)
+    return {
+        'ops_per_second': size / seconds,
+        'seconds': seconds,
+        'peak_bytes': allocations['peak_bytes'],
+        'retained_bytes': allocations['retained_bytes']
+    }
+
+
+def load_baseline(path):
+    """Returns the stored baseline, or None if there is none"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    """Stores the results as baseline, keeping stored results of benchmarks and sizes that were not run"""
+    baseline = load_baseline(path) or {'results': {}}
+    baseline['results'].update(results)
+    baseline['python'] = platform.python_version()
+    baseline['machine'] = platform.platform()
+    baseline['date'] = datetime.now().isoformat(timespec='seconds')
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+
+
+def compare(result, baseline_result, threshold):
+    """Returns the change in throughput against the baseline and the regressions beyond the threshold"""
+    change = result['ops_per_second'] / baseline_result['ops_per_second'] - 1
+    regressions = []
+    if change < -threshold:
+        regressions.append(f'{-change:.0%} slower')
+    # Peaks of a few hundred bytes are dominated by noise, e.g. a list growing one step further
+    peak_change = result['peak_bytes'] - baseline_result['peak_bytes']
+    if peak_change > 1024 and peak_change > baseline_result['peak_bytes'] * threshold:
+        regressions.append(f"{peak_change / 1024:,.0f} KB more peak memory")
+    return change, regressions
+
+
+def main():
+    """Runs the benchmarks, compares them with the baseline and exits with status 1 if any regressed"""
+    sizes = [int(size) for size in cli_utils.get_arg_value('--sizes', SIZES).split(',')]
+    repeat = int(cli_utils.get_arg_value('--repeat', REPEAT))
+    threshold = float(cli_utils.get_arg_value('--threshold', THRESHOLD))
+    path = cli_utils.get_arg_value('--baseline', BASELINE_PATH)
+    selected = cli_utils.get_arg_value('--filter')
+    names = [name for name in cases.CASES if selected is None or any(part in name for part in selected.split(','))]
+
+    baseline = load_baseline(path)
+    baseline_results = {} if baseline is None else baseline['results']
+    if baseline is None:
+        print(f'No baseline in {path}, run with --save-baseline to store one\n')
+    else:
+        print(f"Baseline from {baseline['date']}, Python {baseline['python']} on {baseline['machine']}\n")
+
+    print(f"{'Benchmark':<24} {'Items':>9} {'ops/s':>12} {'Peak KB':>10} {'Retained KB':>12} {'Baseline ops/s':>15} {'Change':>8}")
+    results = {}
+    regressed = []
+    for name in names:
+        for size in sizes:
+            key = f'{name}/{size}'
+            result = run_case(name, size, repeat)
+            results[key] = result
+            line = f"{name:<24} {size:>9} {result['ops_per_second']:>12,.0f} {result['peak_bytes'] / 1024:>10,.1f} {result['retained_bytes'] / 1024:>12,.1f}"
+            if key in baseline_results:
+                change, regressions = compare(result, baseline_results[key], threshold)
+                line += f" {baseline_results[key]['ops_per_second']:>15,.0f} {change:>+8.1%}"
+                if regressions:
+                    line += f"  REGRESSION: {', '.join(regressions)}"
+                    regressed.append(key)
+            print(line)
+
+    if '--save-baseline' in sys.argv:
+        save_baseline(path, results)
+        print(f'\nBaseline saved to {path}')
+    if regressed:
+        print(f'\n{len(regressed)} benchmark(s) regressed beyond {threshold:.0%}: {", ".join(regressed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
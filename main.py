@@ -1,135 +1,440 @@
 #!/usr/bin/env python3
 
-from src import ipam_api, dnac_api, checkpoint_api, vmanage_api
+from src import sources, log_utils, progress, filters as source_filters
+from src.errors import DeadlineExceeded
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 from src import utils
 from src import cli_utils
 from src import constants as c
 
-import readline
+import functools
+import itertools
+import threading
+import time
 import sys
+import os
+
+
+# Backends and modules only some commands need are imported on first use, see src/sources.py
+ipam_api = sources.backend('ipam')
+dnac_api = sources.backend('dnac')
+checkpoint_api = sources.backend('checkpoint')
+vmanage_api = sources.backend('vmanage')
+ipam_mirror = sources.lazy('src.ipam_mirror')
+credentials = sources.lazy('src.credentials')
+http_utils = sources.lazy('src.http_utils')
+prefetch = sources.lazy('src.prefetch')
+dnac_events = sources.lazy('src.dnac_events')
+daemon = sources.lazy('src.daemon')
+partition = sources.lazy('src.partition')
+locks = sources.lazy('src.locks')
+reports = sources.lazy('src.reports')
+reconcile = sources.lazy('src.reconcile')
+fixtures = sources.lazy('src.fixtures')
+http_cache = sources.lazy('src.http_cache')
+validate = sources.lazy('src.validate')
+snapshot = sources.lazy('src.snapshot')
+normalise = sources.lazy('src.normalise')
+planner = sources.lazy('src.planner')
+
+log = log_utils.get_logger('main')
+
+# Listing key of the DNA-center interface listing, device families are keyed by name
+INTERFACE_LISTING = ('interfaces',)
+
+
+def get_from_dnac(filters=None):
+    """Returns list from DNA-center with interface data per device.\n
+    Filters are pushed down to the DNA-center query where possible and applied locally before any interfaces are requested.\n
+    The number of devices per family is requested first, then all pages of all families are requested concurrently, DNAC_WORKERS requests at a time.
+    Interfaces are requested per device as soon as its page arrives, or for large inventories from the interface listing, see choose_dnac_strategy."""
+    if filters is None:
+        filters = {}
+    families = filters.get('family', c.DNAC_DEVICE_FAMILIES)
+    filter_params = source_filters.dnac_query_params(filters)
 
-
-def get_from_dnac():
-    """Returns list from DNA-center with interface data per device"""
-    try:
-        token = dnac_api.get_token()
-    except Exception as e:
-        raise e
-
-    retrieved_device_list = []
-    device_data = []
-    
-    offset = 0
     print('Requesting device data from DNA-Center, this may take a while...\n')
-    while True:
-        try:
-            response = dnac_api.get_device_list(token, 'Routers', offset)
-        except Exception as e:
-            raise e
-
-        retrieved_device_list += response
+    source_filters.show_filters(filters)
+
+    # Workers are separate threads, so they are given the deadline of the current run
+    deadline = http_utils.get_deadline()
+    # Per listing, a device family or the interface listing: number of entries, None if unknown, and the size of the first page
+    counts = {}
+    first_pages = {}
+    strategy = None
+    listed_devices = {}
+    interfaces_by_device = {}
+    device_data = {}
+    executor = ThreadPoolExecutor(max_workers=c.DNAC_WORKERS, thread_name_prefix='autoipam-dnac')
+    tasks = {}
+
+    def submit(kind, listing, position, function, *args):
+        tasks[executor.submit(call_with_deadline, deadline, credentials.call, 'dnac', function, *args)] = (kind, listing, position)
+
+    def submit_page(listing, offset):
+        if listing == INTERFACE_LISTING:
+            submit('page', listing, offset, dnac_api.get_interface_list, offset)
+        else:
+            submit('page', listing, offset, dnac_api.get_device_list, listing, offset, filter_params)
 
-        if len(response) == 100:
-            offset+=100
-            continue
-        break
+    def submit_devices(keys):
+        for key in keys:
+            tasks[executor.submit(call_with_deadline, deadline, select_dnac_data, listed_devices[key])] = ('device', None, key)
 
-    offset = 0
-    while True:
+    try:
+        for family in families:
+            # Filtered queries usually fit in a page, and older releases count the whole family, so they are paged sequentially
+            if filter_params:
+                counts[family] = None
+            else:
+                submit('count', family, None, dnac_api.get_device_count, family)
+            submit_page(family, 1)
+
+        while tasks:
+            done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, listing, position = tasks.pop(future)
+                result = future.result()
+                if kind == 'count':
+                    counts[listing] = result
+                elif kind == 'page' and listing == INTERFACE_LISTING:
+                    for interface in result:
+                        if interface.get('ipv4Address') is not None:
+                            interfaces_by_device.setdefault(interface['deviceId'], []).append(interface)
+                elif kind == 'page':
+                    devices = [device for device in result if source_filters.match_dnac_device(device, filters)]
+                    progress.add_total('devices', len(devices))
+                    keys = [(families.index(listing), position + index) for index in range(len(devices))]
+                    listed_devices.update(zip(keys, devices))
+                    if strategy == 'device':
+                        submit_devices(keys)
+                elif kind == 'device':
+                    device_data[position] = result
+                    progress.advance('devices')
+                    progress.advance('interfaces', len(result['interfaces']))
+
+                if kind == 'page' and position > 1 and counts[listing] is None and result and len(result) == first_pages[listing]:
+                    submit_page(listing, position + len(result))
+                if kind == 'page' and position == 1:
+                    first_pages[listing] = len(result)
+                if kind in ('count', 'page') and position in (None, 1) and listing in counts and listing in first_pages:
+                    for offset in get_dnac_page_offsets(counts[listing], first_pages[listing]):
+                        submit_page(listing, offset)
+
+                # The strategy is chosen once the size of every family is known
+                if strategy is None and all(family in counts for family in families):
+                    strategy = choose_dnac_strategy(counts, families, filters)
+                    log.debug(f'Requesting DNA-Center interfaces {"from the interface listing" if strategy == "bulk" else "per device"}')
+                    if strategy == 'bulk':
+                        submit('count', INTERFACE_LISTING, None, dnac_api.get_interface_count)
+                        submit_page(INTERFACE_LISTING, 1)
+                    else:
+                        submit_devices(list(listed_devices))
+    finally:
+        # Pages and devices not requested yet are dropped if the run is aborted
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if strategy == 'bulk':
+        for key, device in listed_devices.items():
+            device_data[key] = select_dnac_data(device, interfaces_by_device.get(device['id'], []))
+            progress.advance('devices')
+            progress.advance('interfaces', len(device_data[key]['interfaces']))
+
+    # Results are kept in family and inventory order, so reports are the same between runs
+    return [device_data[key] for key in sorted(device_data)]
+
+
+def choose_dnac_strategy(counts, families, filters):
+    """Returns how DNA-center interfaces are requested: per device, or in large pages from the interface listing.\n
+    The listing holds the interfaces of every device in DNA-center, so it is only used for unfiltered syncs of at least DNAC_BULK_MIN_DEVICES devices.
+    DNAC_INTERFACE_STRATEGY set to device or bulk overrides the choice."""
+    if c.DNAC_INTERFACE_STRATEGY in ('device', 'bulk'):
+        return c.DNAC_INTERFACE_STRATEGY
+    if filters or any(counts[family] is None for family in families):
+        return 'device'
+    return 'bulk' if sum(counts[family] for family in families) >= c.DNAC_BULK_MIN_DEVICES else 'device'
+
+
+def get_dnac_page_offsets(count, first_page):
+    """Returns the offsets of the pages left to request after the first page of a family.\n
+    A first page shorter than both DNAC_PAGE_SIZE and the count means DNA-center caps the page size, the rest is paged by that size.
+    Without a count pages are requested one after another until a page comes back empty or shorter than the first,
+    a short first page may be capped as well."""
+    if first_page == 0:
+        return []
+    if count is None:
+        return [1 + first_page]
+    return list(range(1 + first_page, count + 1, first_page))
+
+
+def call_with_deadline(deadline, function, *args):
+    """Calls a function in a worker thread with the deadline of the run that started it"""
+    http_utils.set_deadline(None if deadline is None else deadline - time.monotonic())
+    return function(*args)
+
+
+def select_dnac_data(device, retrieved_interfaces=None):
+    """Converts interface data for a DNA-center device to a standardized convention.\n
+    The interfaces are requested for the device unless they were already retrieved from the interface listing."""
+    selected_device_data = {
+        'hostname': device['hostname'],
+        'description': device['description'],
+        'role': device['role'],
+        "serial": device['serialNumber'],
+        'owner': utils.calc_owner(device['hostname']),
+        'organisation': ''
+    }
+    if retrieved_interfaces is None:
         try:
-            response = dnac_api.get_device_list(token, 'Switches and Hubs', offset)
+            retrieved_interfaces = credentials.call('dnac', dnac_api.get_interfaces, device)
         except Exception as e:
             raise e
-
-        retrieved_device_list += response     
-        
-        if len(response) == 100:
-            offset+=100
-            continue
-        break
     
+    device_interfaces = normalise.normalise('dnac', 'device', device, retrieved_interfaces)
+    selected_device_data['interfaces'] = device_interfaces
+    return selected_device_data
 
-    for device in retrieved_device_list:
-        selected_device_data = {
-            'hostname': device['hostname'],
-            'description': device['description'],
-            'role': device['role'],
-            "serial": device['serialNumber'],
-            'owner': utils.calc_owner(device['hostname']),
-            'organisation': ''
-        }
-        try:
-            retrieved_interfaces = dnac_api.get_interfaces(token, device)
-        except Exception as e:
-            raise e
-        
-        device_interfaces = []
-        for interface in retrieved_interfaces:
-            if interface['ipv4Address'] is not None:
-                if utils.check_ip_in_ignored(interface['ipv4Address']):
-                    continue
-                elif interface['adminStatus'] == 'DOWN':
-                    print(f'Interface {interface["portName"]} administratively down, skipping..')
-                    continue
-                selected_interface_data = { 
-                    'description': interface['portName'],
-                    'ipv4Address': interface['ipv4Address'] ,
-                    'ipv4Mask': interface['ipv4Mask'],
-                    'mac': interface['macAddress'],
-                    'vlan-id': interface['vlanId'],
-                    'subnet-name': '',
-                    'subnet-description': '',
-                    'is-gateway': None
-                }
-                device_interfaces.append(selected_interface_data)
-        selected_device_data['interfaces'] = device_interfaces
-        device_data.append(selected_device_data)
 
+def get_from_dnac_by_id(device_ids):
+    """Returns interface data for a list of DNA-center device ids.\n
+    Devices outside the configured device families are skipped."""
+    device_data = []
+    progress.set_total('devices', len(device_ids))
+    for device_id in device_ids:
+        device = credentials.call('dnac', dnac_api.get_device, device_id)
+        if device is None:
+            log.warning(f'Device {device_id} not found in DNA-Center, skipping')
+            progress.error('devices')
+            continue
+        if device['family'] not in c.DNAC_DEVICE_FAMILIES:
+            log.info(f"Device {device['hostname']} is not part of the configured device families, skipping")
+            continue
+        device_data.append(select_dnac_data(device))
+        progress.advance('devices')
+        progress.advance('interfaces', len(device_data[-1]['interfaces']))
     return device_data
 
 
-def get_from_vmanage():
-    print('Not implemented yet.')
-    devices = None
-    return devices
+def fetch_source(source):
+    """Returns all devices from a source without filters"""
+    fetch = {
+        'dnac': get_from_dnac,
+        'checkpoint': get_from_checkpoint_all,
+        'vmanage': get_from_vmanage
+    }[source]
+    return fetch()
 
 
-def get_from_checkpoint_all():
-    """Returns list of devices from Check Point, where each device includes a list of interface data"""
-    print('Requesting data from Checkpoint...')
+def sync_source(source):
+    """Updates IPAM with all devices from a source, used by the sync daemon"""
+    with progress.track(source, interactive=False):
+        devices = fetch_source(source)
+        if devices is None:
+            return None
+        ipam, strategy = open_planned_ipam(devices, max_age=0, workers=c.SYNC_WORKERS)
+        return update_ipam(devices, ipam, strategy)
+
+
+def sync_dnac_devices(device_ids):
+    """Updates IPAM with the current data for a list of DNA-center device ids"""
+    log.info(f'Syncing {len(device_ids)} device(s) from DNA-Center event notifications')
+    with progress.track('dnac events', interactive=False):
+        devices = get_from_dnac_by_id(device_ids)
+        if len(devices) > 0:
+            ipam, strategy = open_planned_ipam(devices, max_age=0, workers=c.SYNC_WORKERS)
+            update_ipam(devices, ipam, strategy)
+
+
+def get_from_vmanage(filters=None):
+    """Returns list from vManage with interface data per WAN edge.\n
+    The inventory is requested page by page and filtered locally, then the interfaces of VMANAGE_WORKERS edges are requested at a time.\n
+    An edge whose interfaces can not be requested is skipped and counted as an error, so one unreachable edge does not stop the sync."""
+    if filters is None:
+        filters = {}
+    print('Requesting device data from vManage, this may take a while...\n')
+    source_filters.show_filters(filters)
     try:
-        sid = checkpoint_api.get_sid()
+        retrieved_device_list = credentials.call('vmanage', vmanage_api.get_device_list)
     except Exception as e:
         raise e
 
+    retrieved_device_list = [device for device in retrieved_device_list if vmanage_api.is_edge(device) and source_filters.match_vmanage_device(device, filters)]
+    progress.set_total('devices', len(retrieved_device_list))
+
+    # Workers are separate threads, so they are given the deadline of the current run
+    deadline = http_utils.get_deadline()
+    device_data = [None] * len(retrieved_device_list)
+    executor = ThreadPoolExecutor(max_workers=c.VMANAGE_WORKERS, thread_name_prefix='autoipam-vmanage')
     try:
-        response = checkpoint_api.get_device_list(sid)
-    except Exception as e:
-        raise e
+        futures = {executor.submit(select_vmanage_data, device, deadline): index for index, device in enumerate(retrieved_device_list)}
+        for future in as_completed(futures):
+            device = retrieved_device_list[futures[future]]
+            try:
+                device_data[futures[future]] = future.result()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                log.warning(f"Requesting interfaces for {device['host-name']} failed: {e}, skipping")
+                progress.error('devices')
+                continue
+            progress.advance('devices')
+            progress.advance('interfaces', len(device_data[futures[future]]['interfaces']))
+    finally:
+        # Edges not requested yet are dropped if the run is aborted
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    devices = []
+    # Results are kept in inventory order, so reports are the same between runs
+    return [device for device in device_data if device is not None]
 
-    for retrieved_device in response:
-        selected_device_data = select_checkpoint_data(sid, retrieved_device)
-        if selected_device_data is False:
-            continue
-        else:
-            devices.append(selected_device_data)
 
-    return devices
+def select_vmanage_data(device, deadline=None):
+    """Requests interface data for a vManage edge and converts it to a standardized convention.\n
+    Interfaces are reported as address/prefix by vEdge and as address and mask by IOS-XE edges, both are converted to a mask."""
+    http_utils.set_deadline(None if deadline is None else deadline - time.monotonic())
+    selected_device_data = {
+        'hostname': device['host-name'],
+        'description': device.get('device-model', ''),
+        'role': device.get('personality', ''),
+        'serial': device.get('board-serial'),
+        'owner': utils.calc_owner(device['host-name']),
+        'organisation': ''
+    }
+    retrieved_interfaces = credentials.call('vmanage', vmanage_api.get_interfaces, device['system-ip'])
+
+    selected_device_data['interfaces'] = normalise.normalise('vmanage', 'edge', device, retrieved_interfaces)
+    return selected_device_data
 
 
-def get_from_checkpoint_single(device):
-    """Returns interface data for a specific device"""
-    print(f"\nRequesting data for {device['name']}")
+def get_checkpoint_domains(filters=None):
+    """Returns the Check Point domains to request devices from, [None] for a single management server.\n
+    CHECKPOINT_DOMAINS set to all lists the domains of the Multi-Domain Server, the domain filter selects some of them."""
+    if c.CHECKPOINT_DOMAINS is None:
+        return [None]
+    if c.CHECKPOINT_DOMAINS == 'all':
+        domains = [domain['name'] for domain in credentials.call('checkpoint', checkpoint_api.get_domains)]
+    else:
+        domains = list(c.CHECKPOINT_DOMAINS)
+    return [domain for domain in domains if source_filters.match_checkpoint_domain(domain, filters or {})]
+
+
+def get_checkpoint_device_list(filters=None):
+    """Returns the Check Point gateway list of all domains limited to the devices matching the filters.\n
+    Domains are requested CHECKPOINT_DOMAIN_WORKERS at a time, each with its own session. Every device records its domain.
+    A domain whose gateway list can not be requested is skipped, so one domain does not stop the sync."""
+    if filters is None:
+        filters = {}
+    domains = get_checkpoint_domains(filters)
+    if domains == [None]:
+        return get_checkpoint_domain_device_list(None, filters)
+
+    deadline = http_utils.get_deadline()
+    device_lists = {}
+    with ThreadPoolExecutor(max_workers=c.CHECKPOINT_DOMAIN_WORKERS, thread_name_prefix='autoipam-checkpoint') as executor:
+        futures = {executor.submit(call_with_deadline, deadline, get_checkpoint_domain_device_list, domain, filters): domain for domain in domains}
+        for future in as_completed(futures):
+            try:
+                device_lists[futures[future]] = future.result()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                log.warning(f'Requesting the gateway list of domain {futures[future]} failed: {e}, skipping')
+                progress.error('devices')
+    # Devices are kept in domain order, so reports are the same between runs
+    return [device for domain in domains for device in device_lists.get(domain, [])]
+
+
+def get_checkpoint_domain_device_list(domain, filters):
+    """Returns the gateway list of a single Check Point domain limited to the devices matching the filters.\n
+    A prefetched list of a single management server is filtered locally, otherwise the hostname filter is pushed down to the Check Point API."""
+    filter_text = source_filters.checkpoint_filter_text(filters)
+    if domain is None and (filter_text is None or prefetch.is_fresh('checkpoint_gateways')):
+        device_list = prefetch.get('checkpoint_gateways')
+    else:
+        device_list = credentials.call(credentials.checkpoint_backend(domain), checkpoint_api.get_device_list, filter_text, domain)
+    return [dict(device, domain=domain) for device in device_list if source_filters.match_checkpoint_device(device, filters)]
+
+
+def get_from_checkpoint_all(filters=None):
+    """Returns list of devices from Check Point, where each device includes a list of interface data.\n
+    Objects of several domains are requested at the same time, CHECKPOINT_DOMAIN_REQUESTS per domain,
+    with requests submitted in turns per domain so every domain makes progress.\n
+    Objects are converted in batches by the normaliser processes while the remaining objects are requested, see normalise.submit."""
+    print('Requesting data from Checkpoint...')
     try:
-        sid = checkpoint_api.get_sid()
+        response = get_checkpoint_device_list(filters)
     except Exception as e:
         raise e
 
+    progress.set_total('devices', len(response))
+
+    # Devices in turns per domain: first device of every domain, then the second, ...
+    per_domain = {}
+    for index, device in enumerate(response):
+        per_domain.setdefault(device['domain'], []).append(index)
+    order = [index for turn in itertools.zip_longest(*per_domain.values()) for index in turn if index is not None]
+    limits = {domain: threading.BoundedSemaphore(c.CHECKPOINT_DOMAIN_REQUESTS) for domain in per_domain}
+
+    deadline = http_utils.get_deadline()
+    device_data = [None] * len(response)
+    workers = min(len(per_domain), c.CHECKPOINT_DOMAIN_WORKERS) * c.CHECKPOINT_DOMAIN_REQUESTS
+    executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='autoipam-checkpoint')
+    tasks = {}
+    # Fetched objects are converted in batches of NORMALISE_BATCH interfaces, the last batch once every object is fetched
+    batch = []
+    batch_interfaces = 0
+    fetching = len(order)
+
+    def add_device(index, retrieved_device_data, result):
+        selected_device_data = compile_checkpoint_device(response[index], retrieved_device_data, result)
+        if selected_device_data is None:
+            # Devices with incomplete interface data are skipped
+            progress.error('devices')
+            return
+        device_data[index] = selected_device_data
+        progress.advance('devices')
+        progress.advance('interfaces', len(selected_device_data['interfaces']))
+
+    try:
+        for index in order:
+            tasks[executor.submit(call_with_deadline, deadline, fetch_checkpoint_object, response[index], limits[response[index]['domain']])] = ('fetch', index)
+
+        while tasks:
+            done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, position = tasks.pop(future)
+                if kind == 'fetch':
+                    fetching -= 1
+                    retrieved_device_data = future.result()
+                    object_type = retrieved_device_data['type']
+                    if not normalise.is_known('checkpoint', object_type):
+                        log.warning(f'Unknown device type: {object_type}', extra={'device': retrieved_device_data})
+                        add_device(position, retrieved_device_data, ([], None))
+                        continue
+                    batch.append((position, retrieved_device_data))
+                    batch_interfaces += normalise.count_interfaces('checkpoint', object_type, retrieved_device_data)
+                else:
+                    for (index, retrieved_device_data), result in zip(position, future.result()):
+                        add_device(index, retrieved_device_data, result)
+
+            if batch and (batch_interfaces >= c.NORMALISE_BATCH or fetching == 0):
+                objects = [(retrieved_device_data['type'], retrieved_device_data) for _, retrieved_device_data in batch]
+                tasks[normalise.submit('checkpoint', objects, batch_interfaces)] = ('normalise', batch)
+                batch = []
+                batch_interfaces = 0
+    finally:
+        # Devices not requested yet are dropped if the run is aborted
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return [device for device in device_data if device is not None]
+
+
+def get_from_checkpoint_single(device):
+    """Returns interface data for a specific device"""
+    log.info(f"Requesting data for {device['name']}")
     devices = []
 
-    selected_device_data = select_checkpoint_data(sid, device)
+    selected_device_data = select_checkpoint_data(device)
     if selected_device_data is False:
         return
     else:
@@ -137,174 +442,24 @@ def get_from_checkpoint_single(device):
         return devices        
 
 
-def select_checkpoint_data(sid, device):
-    """Selects data and converts it to a standardized convention"""
-    device_interfaces = []
+def fetch_checkpoint_object(device, limit=None):
+    """Requests the object of a Check Point device in its domain.\n
+    limit is the semaphore bounding the concurrent requests of that domain."""
+    domain = device.get('domain')
     try:
-        retrieved_device_data = checkpoint_api.get_device_data(sid, device['uid'])
+        with limit if limit is not None else nullcontext():
+            return credentials.call(credentials.checkpoint_backend(domain), checkpoint_api.get_device_data, device['uid'], domain)
     except Exception as e:
         raise e
-    
-    if retrieved_device_data['type'] == 'simple-cluster':                                 # Simple cluster is also called "CpmiGatewayCluster" in some API-endpoints
-        for interface in retrieved_device_data['interfaces']['objects']:
-            if interface['ipv4-address'] != '':
-                if utils.check_ip_in_ignored(interface['ipv4-address']):
-                    continue
-                else:
-                    try:
-                        interface_data = {
-                            'interface-name': interface['name'],
-                            'description': interface['comments'],
-                            'ipv4Address': interface['ipv4-address'],
-                            'ipv4Mask': interface['ipv4-network-mask'],
-                            'cidr': interface['ipv4-mask-length'],
-                            'subnet-name': interface['comments'],
-                            'subnet-description': '',
-                            'is-gateway': 1,
-                            'mac': None,
-                            'vlan-id': None
-                        }
-
-                        # Set address as gateway if the address is same as the cluster management address
-                        #if interface['ipv4-address'] == retrieved_device_data['ipv4-address']:
-                        #    interface_data['is-gateway'] == 1
-
-                        if retrieved_device_data['comments'] == '':
-                            interface_data['description'] = None
-
-                        device_interfaces.append(interface_data)
-
-                    except KeyError as e:
-                        print('KeyError in step 1:')
-                        print(e)
-                        print(retrieved_device_data)
-                        return
-                
-    elif retrieved_device_data['type'] == 'checkpoint-host':
-        for interface in retrieved_device_data['interfaces']:
-            if utils.check_ip_in_ignored(interface['subnet4']):
-                continue
-            else:
-                try:
-                    interface_data = {
-                        'interface-name': interface['name'],
-                        'description': retrieved_device_data['comments'],
-                        'ipv4Address': interface['subnet4'],
-                        'ipv4Mask': interface['subnet-mask'],
-                        'cidr': interface['mask-length4'],
-                        'subnet-name': '',
-                        'subnet-description': '',
-                        'is-gateway': 0,
-                        'mac': None,
-                        'vlan-id': None
-                    }
-
-                    if retrieved_device_data['comments'] == '':
-                        interface_data['description'] = None
-
-                    device_interfaces.append(interface_data)
-
-                except KeyError as e:
-                    print('KeyError in step 1:')
-                    print(e)
-                    print(retrieved_device_data)
-                    return
-                
-    elif retrieved_device_data['type'] == 'cluster-member':
-        for interface in retrieved_device_data['interfaces']:
-            if utils.check_ip_in_ignored(interface['ipv4-address']):
-                continue
-            else:
-                try:
-                    interface_data = {
-                        'interface-name': interface['name'],
-                        'description': retrieved_device_data['comments'],
-                        'ipv4Address': interface['ipv4-address'],
-                        'ipv4Mask': interface['ipv4-network-mask'],
-                        'cidr': interface['ipv4-mask-length'],
-                        'subnet-name': '',
-                        'subnet-description': '',
-                        'is-gateway': 0,
-                        'mac': None,
-                        'vlan-id': None
-                    }
-
-                    if retrieved_device_data['comments'] == '':
-                        interface_data['description'] = None
-
-                    device_interfaces.append(interface_data)
-
-                except KeyError as e:
-                    print('KeyError in step 1:')
-                    print(e)
-                    print(retrieved_device_data)
-                    return
-            
-    elif retrieved_device_data['type'] == 'simple-gateway':
-        for interface in retrieved_device_data['interfaces']:
-            if interface['ipv4-address'] != '':
-                if utils.check_ip_in_ignored(interface['ipv4-address']):
-                    continue
-                else:
-                    try:
-                        interface_data = {
-                            'interface-name': interface['name'],
-                            'description': retrieved_device_data['comments'],
-                            'ipv4Address': interface['ipv4-address'],
-                            'ipv4Mask': interface['ipv4-network-mask'],
-                            'cidr': interface['ipv4-mask-length'],
-                            'subnet-name': '',
-                            'subnet-description': '',
-                            'is-gateway': 0,
-                            'mac': None,
-                            'vlan-id': None
-                        }
-
-                        if retrieved_device_data['comments'] == '':
-                            interface_data['description'] = None
-
-                        device_interfaces.append(interface_data)
-
-                    except KeyError as e:
-                        print('KeyError in step 1:')
-                        print(e)
-                        print(retrieved_device_data)
-                        return
-            
-    elif retrieved_device_data['type'] == 'EthernetInterface':
-        if retrieved_device_data['ipv4-address'] != '':
-            if utils.check_ip_in_ignored(retrieved_device_data['ipv4-address']):
-                return
-            else:
-                try:
-                    interface_data = {
-                        'interface-name': retrieved_device_data['name'],
-                        'description': retrieved_device_data['comments'],
-                        'ipv4Address': retrieved_device_data['ipv4-address'],
-                        'ipv4Mask': retrieved_device_data['ipv4SubnetMask'], 
-                        'cidr': retrieved_device_data['interfaces'][0]['mask-length4'],
-                        'subnet-name': '',
-                        'subnet-description': '',
-                        'is-gateway': 0,
-                        'mac': None,
-                        'vlan-id': None                           
-                    }
-
-                    if retrieved_device_data['comments'] == '':
-                        interface_data['description'] = None
-
-                    device_interfaces.append(interface_data)
-
-                except KeyError as e:
-                    print('KeyError in step 3:')
-                    print(e)
-                    print(retrieved_device_data)
-                    return                
-    
-    else:
-        print(f'Unknown device type: {retrieved_device_data["type"]}')
-        print(retrieved_device_data)
-                
+
+
+def compile_checkpoint_device(device, retrieved_device_data, result):
+    """Combines a listed Check Point device and the normalise_batch result of its object into the standardized convention.\n
+    Returns None for objects with incomplete interface data."""
+    device_interfaces, error = result
+    if error is not None:
+        log.error(f'Incomplete interface data: {error}', extra={'device': retrieved_device_data})
+        return None
 
     selected_device_data = {
         'hostname': device['name'],
@@ -312,6 +467,7 @@ def select_checkpoint_data(sid, device):
         'organisation': '',
         'owner': utils.calc_owner(device['name']),
         'serial': None,
+        'domain': device.get('domain'),
         'interfaces': device_interfaces
     }
 
@@ -321,9 +477,19 @@ def select_checkpoint_data(sid, device):
     return selected_device_data
 
 
+def select_checkpoint_data(device, limit=None):
+    """Requests the object of a Check Point device and converts it to a standardized convention, in the calling thread"""
+    retrieved_device_data = fetch_checkpoint_object(device, limit)
+    if not normalise.is_known('checkpoint', retrieved_device_data['type']):
+        log.warning(f'Unknown device type: {retrieved_device_data["type"]}', extra={'device': retrieved_device_data})
+        return compile_checkpoint_device(device, retrieved_device_data, ([], None))
+    result = normalise.normalise_batch('checkpoint', [(retrieved_device_data['type'], retrieved_device_data)])[0]
+    return compile_checkpoint_device(device, retrieved_device_data, result)
+
+
 def calc_addr_update_data(device:dict, interface:dict, address_response:dict):
     """Calculates data for address update"""
-    print('Comparing data...')
+    log.debug(f"Comparing data for {interface['ipv4Address']}")
 
     updated_address = {}
 
@@ -387,23 +553,29 @@ def compile_new_subnet_data(subnet_id:int, network_address:str, subnet_mask:str,
     return subnet_data
 
 
-def calculate_diff(devices):
-    """Calculates the differencies between the source and the IPAM database"""
+def calculate_diff(devices, ipam=ipam_api, report=None):
+    """Calculates the differencies between the source and the IPAM database.\n
+    Lookups are done through ipam, which is either the live ipam_api or a local IpamMirror.\n
+    Each pending change is written to report as soon as it is found, if a DiffReport is provided, and not kept in memory.
+    Returns the number of pending new and updated subnets and addresses."""
 
-    #Defines a new dictionary including four lists with pending new and updated subnets and addresses
     pending_changes = {
-        'new-subnets': [], 
-        'new-addresses': [],
-        'updated-subnets': [],
-        'updated-addresses': []
+        'new-subnets': 0,
+        'new-addresses': 0,
+        'updated-subnets': 0,
+        'updated-addresses': 0
         }
+    pending_subnets = set()
+    pending_addresses = set()
+    progress.set_total('lookups', sum(len(device['interfaces']) for device in devices))
     
     for device in devices:    
         for interface in device['interfaces']:
             try:
-                address_response = ipam_api.get_address(interface['ipv4Address'])
+                address_response = ipam.get_address(interface['ipv4Address'])
             except Exception as e:
                 raise e
+            progress.advance('lookups')
 
             if address_response is False:
                 subnet = utils.calc_subnet(interface['ipv4Address'], interface['ipv4Mask'])
@@ -411,7 +583,7 @@ def calculate_diff(devices):
                 network_address_full = subnet['network_address_full']
                 subnet_mask = subnet['subnet_mask']
                 cidr = subnet['cidr']
-                subnet_id = ipam_api.get_subnet_id(network_address_full)
+                subnet_id = ipam.get_subnet_id(network_address_full)
                 subnet_name = interface['subnet-name']
                 subnet_description = ''
                 vrf_name = utils.calc_vrf(network_address_full)
@@ -424,36 +596,35 @@ def calculate_diff(devices):
 
                     # Searches for matching master subnets in the IPAM-database
                     try:
-                        master_subnet = ipam_api.get_master_subnet(possible_master_subnets)
+                        master_subnet = ipam.get_master_subnet(possible_master_subnets)
                     except Exception as e:
                         raise e
                     
-                    print(f"Calculated master subnet for {network_address_full}: {master_subnet}")
-                    print()
+                    log.debug(f"Calculated master subnet for {network_address_full}: {master_subnet}")
 
                     new_subnet = compile_new_subnet_data(subnet_id, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_name)
 
                     if new_subnet['new-subnet-description'] == '' or new_subnet['new-subnet-description'] is None:
                         new_subnet['new-subnet-description'] = 'Created by AutoIpam'
 
-                    if not pending_changes['new-subnets']:
-                        pending_changes['new-subnets'].append(new_subnet)
-                    else:
-                        # Check if the new subnet address is already present in the list
-                        if network_address not in [i['new-network-address'] for i in pending_changes['new-subnets']]:
-                            pending_changes['new-subnets'].append(new_subnet)
+                    # Check if the new subnet address is already present in the list
+                    if network_address not in pending_subnets:
+                        pending_subnets.add(network_address)
+                        pending_changes['new-subnets'] += 1
+                        if report is not None:
+                            report.entry('new-subnets', new_subnet)
 
                 new_address = compile_new_addr_data(device, interface)
 
-                if not pending_changes['new-addresses']:
-                    pending_changes['new-addresses'].append(new_address)
-                else:
-                    # Check if the new address is already present in the list
-                    if interface['ipv4Address'] not in [i['ip'] for i in pending_changes['new-addresses']]:
-                        pending_changes['new-addresses'].append(new_address)
+                # Check if the new address is already present in the list
+                if interface['ipv4Address'] not in pending_addresses:
+                    pending_addresses.add(interface['ipv4Address'])
+                    pending_changes['new-addresses'] += 1
+                    if report is not None:
+                        report.entry('new-addresses', new_address)
 
             else:
-                print(f"IP-address {interface['ipv4Address']:15} already exists")
+                log.debug(f"IP-address {interface['ipv4Address']:15} already exists")
                 updated_address = calc_addr_update_data(device, interface, address_response)
 
                 if updated_address:
@@ -461,28 +632,70 @@ def calculate_diff(devices):
                     updated_address['ip-address'] = interface['ipv4Address']
                     updated_address['change-type'] = 'update'
                     
-                    pending_changes['updated-addresses'].append(updated_address)
+                    pending_changes['updated-addresses'] += 1
+                    if report is not None:
+                        report.entry('updated-addresses', updated_address)
 
     return pending_changes   
 
 
-def update_ipam(devices):
-    """Updates the IPAM database with the provided device and interface list"""
-    updated_addresses = []
-    updated_subnets = []
-    conflicts = []
+def create_subnet(ipam, subnet, subnet_name, subnet_description, vrf_id, lookup=None):
+    """Creates a new subnet in the IPAM database with the most specific existing master subnet.\n
+    The master subnet is searched through lookup, which defaults to ipam.\n
+    Returns the create_subnet response, where id is None if the subnet could not be created."""
+    if lookup is None:
+        lookup = ipam
+    network_address_full = subnet['network_address_full']
+    possible_master_subnets = utils.calc_master_subnets(network_address_full)
+    
+    try:
+        master_subnet = lookup.get_master_subnet(possible_master_subnets)
+    except Exception as e:
+        raise e
+    
+    log.debug(f"Calculated existing master subnet for {network_address_full}: {master_subnet}")
+    
+    master_subnet_id = None
+    if master_subnet is not None:
+        try:
+            master_subnet_id = lookup.get_subnet_id(master_subnet)
+        except Exception as e:
+            raise e
+    try:
+        return ipam.create_subnet(subnet['network_address'], subnet['subnet_mask'], subnet['cidr'], subnet_name, subnet_description, vrf_id, c.SECTION_ID, master_subnet_id)
+    except Exception as e:
+        raise e
+
+
+def create_subnet_locked(ipam, subnet, subnet_name, subnet_description, vrf_id, lock_service):
+    """Creates a new subnet while holding the subnet lock, so no other worker creates the same subnet or its master at the same time.\n
+    The subnet and its master are looked up in the live IPAM database once the lock is held, since another worker may have created them meanwhile."""
+    with locks.hold_all(lock_service, locks.subnet_lock_keys(subnet['network_address_full'])):
+        # Not coalesced with lookups started before the lock was held
+        subnet_id = ipam_api.get_subnet_id.__wrapped__(subnet['network_address_full'])
+        if subnet_id is not None:
+            return {'id': subnet_id, 'existing': True}
+        return create_subnet(ipam, subnet, subnet_name, subnet_description, vrf_id, lookup=ipam_api)
+
+
+def apply_updates(devices, report, ipam=ipam_api, lock_service=None):
+    """Applies the changes needed for the provided device and interface list to the IPAM database.\n
+    Every applied change and conflict is written to report as soon as it is made.\n
+    With a lock_service, new subnets are created under a subnet lock shared by all workers."""
+    progress.set_total('lookups', sum(len(device['interfaces']) for device in devices))
     for device in devices:
         for interface in device['interfaces']:
             try:
-                address_response = ipam_api.get_address(interface['ipv4Address'])
+                address_response = ipam.get_address(interface['ipv4Address'])
             except Exception as e:
                 raise e
+            progress.advance('lookups')
             
             updated_address = {}
             updated_subnet = {}
 
             if address_response is not False:
-                print(f"IP-address {interface['ipv4Address']:15} already exists")
+                log.debug(f"IP-address {interface['ipv4Address']:15} already exists")
 
                 updated_address = calc_addr_update_data(device, interface, address_response)
 
@@ -492,11 +705,17 @@ def update_ipam(devices):
                     updated_address['ip'] = interface['ipv4Address']
 
                     try:
-                        ipam_api.update_address(updated_address)
+                        updated = ipam.update_address(updated_address)
                     except Exception as e:
                         raise e
-                    else:
-                        updated_addresses.append(updated_address)
+                    if not updated:
+                        conflict = {'id': updated_address['id'], 'ip': interface['ipv4Address'], 'error': 'Address update failed'}
+                        log.warning(f"Error updating {interface['ipv4Address']}, skipping", extra={'conflict': conflict})
+                        report.conflict(conflict)
+                        progress.error('writes')
+                        continue
+                    report.address(updated_address)
+                    progress.advance('writes')
 
             else:
                 subnet = utils.calc_subnet(interface['ipv4Address'], interface['ipv4Mask'])
@@ -507,192 +726,282 @@ def update_ipam(devices):
                 subnet_name = interface['subnet-name']
                 subnet_description = ''
                 vrf_name = utils.calc_vrf(network_address_full)
-                vrf_id = ipam_api.get_vrf_id(vrf_name)
+                vrf_id = ipam.get_vrf_id(vrf_name)
                 
                 try:
-                    subnet_id = ipam_api.get_subnet_id(network_address_full)
+                    subnet_id = ipam.get_subnet_id(network_address_full)
                 except Exception as e:
                     raise e
 
                 if subnet_id is False:
-                    return
+                    conflict = {'id': None, 'subnet': network_address_full, 'error': 'Subnet lookup failed'}
+                    log.warning(f'Error looking up {network_address_full}, skipping', extra={'conflict': conflict})
+                    report.conflict(conflict)
+                    progress.error('writes')
+                    continue
                 elif subnet_id is None:
-                    possible_master_subnets = utils.calc_master_subnets(network_address_full)
-                    
-                    try:
-                        master_subnet = ipam_api.get_master_subnet(possible_master_subnets)
-                    except Exception as e:
-                        raise e
-                    
-                    print(f"Calculated existing master subnet for {network_address_full}: {master_subnet}")
-                    
-                    if master_subnet is not None:
-                        try:
-                            master_subnet_id = ipam_api.get_subnet_id(master_subnet)
-                        except Exception as e:
-                            raise e
-                        try:
-                            response = ipam_api.create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, c.SECTION_ID, master_subnet_id)
-                            subnet_id = response['id']
-                            if subnet_id is None:
-                                print(f'Error creating {response["subnet"]}')
-                                print(response['error'])
-                                print('Skipping...')
-                                conflicts.append(response)
-                                continue
-                            else:
-                                change_type = 'create'
-                        except Exception as e:
-                            raise e
+                    if lock_service is None:
+                        response = create_subnet(ipam, subnet, subnet_name, subnet_description, vrf_id)
                     else:
-                        try:
-                            response = ipam_api.create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, c.SECTION_ID)
-                            subnet_id = response['id']
-                            if subnet_id is None:
-                                print(f'Error creating {response["subnet"]}')
-                                print(response['error'])
-                                print('Skipping...')
-                                conflicts.append(response)
-                                continue       
-                        except Exception as e:
-                            raise e
-                    
-                    # Data for NEW subnet
-                    updated_subnet = compile_new_subnet_data(subnet_id, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_name)
-                    updated_subnet['change-type'] = 'create'
-                    updated_subnets.append(updated_subnet)
-                        
-                    if subnet_id is False:
-                        return
+                        response = create_subnet_locked(ipam, subnet, subnet_name, subnet_description, vrf_id, lock_service)
+                    subnet_id = response['id']
+                    if subnet_id is None:
+                        log.warning(f'Error creating {response["subnet"]}: {response["error"]}, skipping', extra={'conflict': response})
+                        report.conflict(response)
+                        progress.error('writes')
+                        continue
+
+                    if not response.get('existing'):
+                        # Data for NEW subnet
+                        updated_subnet = compile_new_subnet_data(subnet_id, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_name)
+                        updated_subnet['change-type'] = 'create'
+                        report.subnet(updated_subnet)
+                        progress.advance('writes')
+
                 try:    
-                    address_id = ipam_api.create_address(interface, device, subnet_id)
+                    address_id = ipam.create_address(interface, device, subnet_id)
                 except Exception as e:
                     raise e
+                if address_id is None:
+                    conflict = {'id': None, 'ip': interface['ipv4Address'], 'subnetId': subnet_id, 'error': 'Address creation failed'}
+                    log.warning(f"Error creating {interface['ipv4Address']}, skipping", extra={'conflict': conflict})
+                    report.conflict(conflict)
+                    progress.error('writes')
+                    continue
                 
                 # Data for NEW address
                 updated_address = compile_new_addr_data(device, interface, address_id)
                 updated_address['change-type'] = 'create'
-                updated_addresses.append(updated_address)
+                report.address(updated_address)
+                progress.advance('writes')
 
-    if len(conflicts) > 0:
-        utils.export_json(c.CONFLICTS_PATH+c.CONFLICT_FILE_NAME, conflicts)
 
+def apply_partition(devices, strategy=None):
+    """Applies one partition of devices in a worker process, using the IPAM view prepared by the parent process.\n
+    strategy is the IPAM lookup strategy chosen by the parent process, so all workers use the same view.\n
+    Each worker writes its own report files and returns the number of changes."""
+    log_utils.setup_logging()
+    ipam = open_ipam(max_age=float('inf'), strategy=strategy)
+    report = reports.UpdateReport(suffix=f'_worker{os.getpid()}')
+    try:
+        # Workers can not draw on the parent's progress line, so they log their progress instead
+        with progress.track(f'worker {os.getpid()}', interactive=False):
+            apply_updates(devices, report, ipam, locks.get_lock_service())
+    finally:
+        paths = report.close()
+    # The per-address requests of a parallel update are only measured in the workers
+    planner.save_history()
+    return report.counts(), paths
+
+
+def validate_devices(devices, ipam=ipam_api):
+    """Checks the complete device and interface list before anything is written, see validate.validate_plan.\n
+    Rejected interfaces are logged and written to the rejected report.\n
+    Returns the devices with the interfaces that can be applied, the rejected interfaces and the report paths."""
+    applicable, rejected = validate.validate_plan(devices, ipam.get_vrf_id, ipam.get_subnet_id)
+    if not rejected:
+        return applicable, rejected, []
+    report = reports.RejectedReport()
+    try:
+        for entry in rejected:
+            log.warning(f"Rejected {entry['ip']} on {entry['hostname']}: {entry['reason']}", extra={'rejected': entry})
+            report.entry(entry)
+    finally:
+        paths = report.close()
+    checks = ', '.join(f'{check}: {count}' for check, count in sorted(validate.count_per_check(rejected).items()))
+    log.warning(f'{len(rejected)} interface(s) rejected by validation ({checks})')
+    return applicable, rejected, paths
+
+
+def update_ipam(devices, ipam=ipam_api, strategy=None):
+    """Updates the IPAM database with the provided device and interface list.\n
+    Lookups and writes are done through ipam, which is either the live ipam_api or a local IpamMirror.
+    Worker processes open the view of strategy, see open_ipam.\n
+    The complete list is validated first, interfaces that can not be applied are rejected before the first write.
+    The devices are split over SYNC_WORKERS processes and limited to this node's partition when SYNC_NODE is set.\n
+    Changes are written to the report files while they are applied."""
+    # Every node validates the complete list, so duplicates and overlaps across partitions are found
+    devices, rejected, rejected_paths = validate_devices(devices, ipam)
+    interfaces = sum(len(device['interfaces']) for device in devices)
+
+    if c.SYNC_NODE is not None:
+        node, nodes = c.SYNC_NODE
+        devices = partition.partition_devices(devices, nodes, c.SYNC_PARTITION)[node]
+        log.info(f'Node {node+1}/{nodes}: syncing {len(devices)} device(s) partitioned by {c.SYNC_PARTITION}')
+
+    if c.SYNC_WORKERS > 1:
+        partitions = partition.partition_devices(devices, c.SYNC_WORKERS, c.SYNC_PARTITION)
+        counts, paths = partition.run_partitions(functools.partial(apply_partition, strategy=strategy), partitions)
+    else:
+        report = reports.UpdateReport()
+        try:
+            apply_updates(devices, report, ipam, locks.get_lock_service() if c.SYNC_NODE is not None else None)
+        finally:
+            paths = report.close()
+        counts = report.counts()
+
+    progress.finish()
     print('Update complete\n')
-    export_update_report(updated_subnets, updated_addresses)
-
-
-def export_update_report(updated_subnets, updated_addresses):
-    """Exports a report in csv-format with all applied changes"""
-    export = False
-    export_prompt = input('Export report? [Y/n] ').lower().strip()
-    if export_prompt == 'y' or export_prompt == '':
-
-        if len(updated_subnets) > 0:
-            # Export subnets report
-            export = True
-            field_names = [
-                'id',
-                'change-type',
-                'old-network-address',
-                'new-network-address',
-                'old-cidr',
-                'new-cidr',
-                'old-subnet-mask',
-                'new-subnet-mask',
-                'old-subnet-name',
-                'new-subnet-name',
-                'old-subnet-description',
-                'new-subnet-description',
-                'old-vrf',
-                'new-vrf'
-            ]
-            utils.export_csv(c.SUBNET_REPORT_PATH+c.SUBNET_REPORT_FILE_NAME, updated_subnets, field_names)
-
-        if len(updated_addresses) > 0:
-            # Export addresses report
-            export = True
-            field_names = [
-                'id', 
-                'change-type',
-                'device-type', 
-                'ip', 
-                'old-hostname', 
-                'new-hostname', 
-                'old-description',
-                'new-description',
-                'old-is_gateway',
-                'new-is_gateway',
-                'old-owner',
-                'new-owner',
-                'old-mac',
-                'new-mac',
-                'old-device-serial',
-                'new-device-serial'
-            ]
-            utils.export_csv(c.ADDRESS_REPORT_PATH+c.ADDRESS_REPORT_FILE_NAME, updated_addresses, field_names)
-
-        if not export:
-            print('No changes to export.')
-
-
-def show_diff(pending_changes):
-    """Displays the calculated differencies between the source and the IPAM database"""
-    print('\nPending changes:')
+    print(f"Subnets created: {counts['updated-subnets']}, addresses created or updated: {counts['updated-addresses']}, conflicts: {counts['conflicts']}, rejected: {len(rejected)}\n")
+    reports.show_report_paths(paths + rejected_paths)
+    counts['devices'] = len(devices)
+    counts['rejected'] = len(rejected)
+    # Created and updated addresses, which bounds the share of new addresses the next plan assumes
+    planner.save_history(interfaces, counts['updated-addresses'])
+    return counts
+
+
+def open_ipam(max_age, strategy=None, devices=None):
+    """Returns the IPAM view of a lookup strategy: the local IPAM mirror or snapshot, the live IPAM API backed by
+    prefetched data, or the live IPAM API. Without a strategy the one configured in constants.py is used.\n
+    With devices a stale mirror only refreshes the subnets of their interfaces, see ipam_mirror.IpamMirror.refresh."""
+    if strategy is None:
+        strategy = planner.get_configured_strategy()
+    if strategy == 'mirror':
+        ip_addresses = None if devices is None else [interface['ipv4Address'] for device in devices for interface in device['interfaces']]
+        return ipam_mirror.open_mirror(max_age, ip_addresses)
+    if strategy == 'snapshot':
+        return snapshot.open_snapshot(max_age)
+    if strategy == 'prefetch':
+        return prefetch.PrefetchedIpam(ipam_api, max_age)
+    return ipam_api
+
+
+def open_planned_ipam(devices, max_age, workers=1):
+    """Chooses the cheapest IPAM lookup strategy for the devices of a run, see planner.choose, shows the plan and opens it.\n
+    Returns the IPAM view and the chosen strategy."""
+    plan = planner.choose(devices, max_age, workers)
+    planner.show_plan(plan)
+    return open_ipam(max_age, plan['strategy'], devices), plan['strategy']
+
+
+def refresh_mirror():
+    """Creates or refreshes the local IPAM mirror"""
+    mirror = ipam_mirror.IpamMirror()
+    mirror.refresh()
+    mirror.close()
+
+
+def find_stale_addresses(interactive=None):
+    """Fetches all devices from every source in RECONCILE_SOURCES and the IPAM snapshot, and returns the stale addresses.\n
+    Returns (stale, owned_count, source_errors), where source_errors is the number of devices that could not be fetched."""
+    with progress.track('reconcile', interactive) as reconcile_progress:
+        devices = []
+        for source in c.RECONCILE_SOURCES:
+            source_devices = fetch_source(source)
+            if source_devices is None:
+                raise Exception(f'No data received from {source}, reconcile aborted')
+            devices += source_devices
+        source_errors = reconcile_progress.snapshot()['stages'].get('devices', {}).get('errors', 0)
+        subnets, addresses = reconcile.get_snapshot()
+        stale, owned_count = reconcile.find_stale(devices, subnets, addresses)
+    return stale, owned_count, source_errors
+
+
+def show_stale_addresses(stale, owned_count):
+    """Displays the number of stale addresses in total and per subnet, and writes them to a report"""
+    print(f'\n{len(stale)} of {owned_count} addresses owned by AutoIpam are no longer reported by any source')
+    for subnet, count in sorted(reconcile.count_per_subnet(stale).items(), key=lambda item: item[1], reverse=True):
+        print(f'    {subnet:<20} {count}')
+    print()
+    report = reports.Report(c.RECONCILE_PATH+c.RECONCILE_FILE_NAME, reconcile.RECONCILE_REPORT_FIELDS)
+    for entry in stale:
+        report.write(entry)
+    reports.show_report_paths(report.close())
+
+
+def delete_stale_addresses(stale, owned_count, source_errors, force=False, interactive=None):
+    """Deletes the stale addresses unless the source data was incomplete or the safety threshold is exceeded.\n
+    force skips the threshold, but never deletes based on incomplete source data."""
+    if source_errors > 0:
+        log.warning(f'{source_errors} device(s) could not be fetched from the sources, nothing deleted')
+        return 0
+    if not force:
+        try:
+            reconcile.check_threshold(len(stale), owned_count)
+        except reconcile.ThresholdExceeded as e:
+            log.warning(f'{e}, nothing deleted. Review the report and use --force to delete anyway')
+            return 0
 
-    print('\nNew subnets:')    
-    if not pending_changes['new-subnets']:
-        print('No new subnets')
-    else:
-        for entry in pending_changes['new-subnets']:
-            print("-----------------------------------------")
-            for key, value in entry.items():
-                print(f"    {key}: {value}")
+    report = reports.Report(c.RECONCILE_PATH+c.RECONCILE_FILE_NAME+'_deleted', reconcile.RECONCILE_REPORT_FIELDS)
+    with progress.track('reconcile delete', interactive):
+        try:
+            deleted = reconcile.delete_stale(stale, report)
+        finally:
+            paths = report.close()
+    if c.IPAM_MIRROR_ENABLED:
+        refresh_mirror()
+    print(f'Deleted {deleted} of {len(stale)} stale addresses\n')
+    reports.show_report_paths(paths)
+    return deleted
+
+
+def reconcile_addresses(delete=False, force=False):
+    """Reports, and with delete removes, addresses owned by AutoIpam that are no longer reported by any source"""
+    stale, owned_count, source_errors = find_stale_addresses(interactive=False)
+    show_stale_addresses(stale, owned_count)
+    if delete and stale:
+        delete_stale_addresses(stale, owned_count, source_errors, force, interactive=False)
+
+
+def reconcile_command():
+    """Runs the reconcile command, asking before anything is deleted"""
+    stale, owned_count, source_errors = find_stale_addresses()
+    show_stale_addresses(stale, owned_count)
+    if not stale:
+        return
+    delete_prompt = input(f'Delete {len(stale)} stale addresses? [y/N] ').lower().strip()
+    if delete_prompt == 'y':
+        delete_stale_addresses(stale, owned_count, source_errors)
 
-    print('\nNew addresses:')
-    if not pending_changes['new-addresses']:
-        print('No new addresses')
-    else:
-        for entry in pending_changes['new-addresses']:
-            print("-----------------------------------------")
-            for key, value in entry.items():
-                print(f"    {key}: {value}")
 
-    print('\nMismatching address data:')
-    if not pending_changes['updated-addresses']:
-        print('No changes needed')
-    else:
-        for entry in pending_changes['updated-addresses']:
-            print("-----------------------------------------")
-            for key, value in entry.items():
-                print(f"    {key}: {value}")
+def show_diff(pending_changes, report, rejected):
+    """Displays a summary of the calculated differencies between the source and the IPAM database,
+    and lets the user page through the entries, read back from the closed DiffReport"""
+    sections = [
+        ('new-subnets', 'New subnets', 'No new subnets'),
+        ('new-addresses', 'New addresses', 'No new addresses'),
+        ('updated-addresses', 'Mismatching address data', 'No changes needed'),
+        ('rejected', 'Rejected by validation', 'None')
+    ]
 
-    # Creates a file in json-format and exports the calculated differencies between the source and the IPAM database
-    while True:
-        export_prompt = input('\nExport the diff result? [Y/n] ').lower().strip()
-        if export_prompt == 'n':
-            return
-        elif export_prompt == 'y' or export_prompt == '':
-            utils.export_json(c.DIFF_PATH+c.DIFF_EXPORT_FILE_NAME, pending_changes)
-            return
+    print('\nPending changes:')
+    for key, title, empty in sections:
+        count = len(rejected) if key == 'rejected' else pending_changes[key]
+        print(f'{title+":":<28} {count if count > 0 else empty}')
 
+    for key, title, _ in sections:
+        count = len(rejected) if key == 'rejected' else pending_changes[key]
+        if count == 0:
+            continue
+        show_prompt = input(f'\nShow {count} {title.lower()}? [y/N] ').lower().strip()
+        if show_prompt != 'y':
+            continue
+        print(f'\n{title}:')
+        entries = rejected if key == 'rejected' else report.entries(key)
+        for index, entry in enumerate(entries, start=1):
+            print("-----------------------------------------")
+            for entry_key, value in entry.items():
+                print(f"    {entry_key}: {value}")
+            if index % c.DIFF_PAGE_SIZE == 0 and index < count:
+                page_prompt = input(f'-- {index}/{count}, Enter for more, q to stop -- ').lower().strip()
+                if page_prompt == 'q':
+                    break
 
-def source_checkpoint():
-    """ """
-    try:
-        sid = checkpoint_api.get_sid()
-    except Exception as e:
-        raise e
 
+def source_checkpoint(filters=None):
+    """Lets the user select one or all Check Point devices matching the filters and returns their interface data"""
     print('Requesting device list...')
-    device_list = checkpoint_api.get_device_list(sid)
+    source_filters.show_filters(filters)
+    device_list = get_checkpoint_device_list(filters)
     devices = []
     device_range = []
 
-    print(f'\nID:   Hostname:                      Device type:')
+    print(f'\nID:   Hostname:                      Device type:{"                Domain:" if c.CHECKPOINT_DOMAINS else ""}')
     for id, device in enumerate(device_list):
         device['presented-id'] = id
         device_range.append(id)
-        print(f'{device["presented-id"]:<5} {device["name"]:<30} {device["type"]}')
+        print(f'{device["presented-id"]:<5} {device["name"]:<30} {device["type"]:<22}{device["domain"] or ""}'.rstrip())
 
     print()
     while True:
@@ -700,7 +1009,7 @@ def source_checkpoint():
         if device_select_prompt == 'exit':
             return None
         elif device_select_prompt == 'all':   
-            devices = get_from_checkpoint_all()
+            devices = get_from_checkpoint_all(filters)
             return devices
         elif device_select_prompt.isnumeric():
             device_select_prompt = int(device_select_prompt)
@@ -719,12 +1028,27 @@ def source_checkpoint():
 def lvl2():
     """Subsession level 2"""
     while True:
-        readline.set_completer(cli_utils.lvl2_completer)
-        readline.parse_and_bind('tab: complete')
-        command = input('source>').lower().strip()
-        if command in cli_utils.lvl2_commands:
+        cli_utils.enable_completion(lvl2_commands)
+        command, _, args = input('source>').strip().partition(' ')
+        command = command.lower()
+        if command in lvl2_commands:
+            try:
+                filters = source_filters.parse_filters(args, command if command in lvl2_sources else None)
+            except ValueError as e:
+                print(f'%{e}')
+                continue
+            if filters and command not in lvl2_sources:
+                print('%Filters can only be used with a source')
+                continue
+            # The run deadline covers fetching from the source and applying the result to IPAM
+            http_utils.set_deadline(c.RUN_DEADLINE)
             try:
-                result = cli_utils.lvl2_commands[command]()
+                if command in lvl2_sources:
+                    result = lvl2_commands[command](filters)
+                else:
+                    result = lvl2_commands[command]()
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 raise Exception(e)
             if command == 'exit':
@@ -742,45 +1066,136 @@ def lvl2():
     return result
 
 
+def show_cache_stats():
+    """Logs how many source responses were served from the response cache in this session"""
+    cache_stats = http_cache.stats()
+    if cache_stats['hits'] or cache_stats['revalidated']:
+        log.info(f"{cache_stats['hits']} source responses served from cache, {cache_stats['revalidated']} revalidated, {cache_stats['misses']} requested (--no-cache to bypass)")
+
+
+def run_command(command):
+    """Runs the update, diff or reconcile command, showing the progress of each stage while it runs"""
+    if command == 'reconcile':
+        # The deadline covers reconcile like update and diff, it sets up its own progress
+        http_utils.set_deadline(c.RUN_DEADLINE)
+        reconcile_command()
+        return
+    with progress.track(command):
+        devices = lvl1_commands[command]()
+        if devices is None:
+            return
+        show_cache_stats()
+        if command == 'update':
+            # Always refresh the subnets the devices touch before writing, so no changes are based on stale data
+            ipam, strategy = open_planned_ipam(devices, max_age=0, workers=c.SYNC_WORKERS)
+            update_ipam(devices, ipam, strategy)
+        elif command == 'diff':
+            # The diff is written to the report files while it is calculated
+            ipam, _ = open_planned_ipam(devices, max_age=c.IPAM_MIRROR_MAX_AGE)
+            devices, rejected, rejected_paths = validate_devices(devices, ipam)
+            report = reports.DiffReport()
+            try:
+                pending_changes = calculate_diff(devices, ipam, report)
+            finally:
+                paths = report.close() + rejected_paths
+            progress.finish()
+            if pending_changes is None:
+                log.error('IPAM subnet lookup failed, the diff is incomplete')
+                return
+            planner.save_history(sum(len(device['interfaces']) for device in devices), pending_changes['new-addresses'])
+            show_diff(pending_changes, report, rejected)
+            print()
+            reports.show_report_paths(paths)
+
+
 def main():
     """Main function"""
+    # Answered before anything else is set up, these must stay fast
     if '--version' in sys.argv or '-v' in sys.argv:
         utils.show_version()
+        return
     elif '--help' in sys.argv or '-h' in sys.argv:
         cli_utils.show_lvl1_help()
+        return
+
+    c.SYNC_WORKERS = int(cli_utils.get_arg_value('--workers', c.SYNC_WORKERS))
+    c.SYNC_PARTITION = cli_utils.get_arg_value('--partition', c.SYNC_PARTITION)
+    if '--node' in sys.argv:
+        c.SYNC_NODE = partition.parse_node(cli_utils.get_arg_value('--node'))
+    c.LOG_LEVEL = cli_utils.get_arg_value('--log-level', c.LOG_LEVEL)
+    c.LOG_JSON_FILE = cli_utils.get_arg_value('--log-file', c.LOG_JSON_FILE)
+    log_utils.setup_logging()
+    if c.SYNC_NODE is not None and not locks.is_shared_between_hosts():
+        # Hosts of a partitioned sync only exclude each other from creating the same subnet through a shared lock service
+        log.error(f'--node needs a lock service shared between hosts, {c.LOCK_SERVICE} only locks on this host (LOCK_SERVICE in constants.py)')
+        return
+    # Event driven syncs need the current device data, and recordings must contain every request
+    if '--no-cache' in sys.argv or '--listen' in sys.argv or '--record' in sys.argv or '--replay' in sys.argv:
+        c.HTTP_CACHE_ENABLED = False
+    if '--record' in sys.argv:
+        fixtures.start_recording(cli_utils.get_arg_value('--record'))
+    elif '--replay' in sys.argv:
+        fixtures.start_replay(cli_utils.get_arg_value('--replay'), float(cli_utils.get_arg_value('--replay-speed', c.FIXTURE_REPLAY_SPEED)))
+
+    if '--listen' in sys.argv:
+        dnac_events.listen(sync_dnac_devices)
+    elif '--daemon' in sys.argv:
+        daemon.run(sync_source)
+    elif '--reconcile' in sys.argv:
+        reconcile_addresses(delete='--delete' in sys.argv, force='--force' in sys.argv)
     else:
         print('\n############################## AutoIpam ##############################')
         utils.show_version()
         cli_utils.show_lvl1_help()
+        prefetch.start()
         while True:
-            readline.set_completer(cli_utils.lvl1_completer)
-            readline.parse_and_bind('tab: complete')
+            cli_utils.enable_completion(lvl1_commands)
             command = input('>').lower().strip()
-            if command in cli_utils.lvl1_commands:
-                if command == 'update':
-                    devices = cli_utils.lvl1_commands[command]()
-                    if devices is not None:
-                        update_ipam(devices)
-                    else:
-                        continue
-                elif command == 'diff':
-                    devices = cli_utils.lvl1_commands[command]()
-                    if devices is not None:
-                        pending_changes = calculate_diff(devices)
-                        show_diff(pending_changes)
-                    else:
-                        continue
+            if command in lvl1_commands:
+                if command in ('update', 'diff', 'reconcile'):
+                    try:
+                        run_command(command)
+                    except DeadlineExceeded as e:
+                        print(f'\n{e}, aborting {command}\n')
+                    finally:
+                        http_utils.set_deadline(None)
 
                 elif command == 'exit':
                     return
                 else:
-                    cli_utils.lvl1_commands[command]()
+                    lvl1_commands[command]()
             elif command == '':
                 continue
             else:
                 print('%Invalid command')
 
 
+# Available CLI-commands per subsession level
+lvl1_commands = {
+    'update': lvl2,
+    'diff': lvl2,
+    'mirror': refresh_mirror,
+    'reconcile': reconcile_command,
+    'version': utils.show_version,
+    '?': cli_utils.show_lvl1_help,
+    'help': cli_utils.show_lvl1_help,
+    'exit': cli_utils.exit_func
+}
+
+# Level 2 commands that fetch data from a source and accept filters
+lvl2_sources = ('dnac', 'checkpoint', 'vmanage')
+
+lvl2_commands = {
+    'dnac': get_from_dnac,
+    'checkpoint': source_checkpoint,
+    'vmanage': get_from_vmanage,
+    '?': cli_utils.show_lvl2_help,
+    'help': cli_utils.show_lvl2_help,
+    'version': utils.show_version,
+    'exit': cli_utils.exit_func
+}
+
+
 if __name__ == '__main__':
     main()
     print()
@@ -1,4 +1,7 @@
 from src import constants as c
+from src import http_utils
+from src import log_utils
+from src.errors import AuthError
 
 import requests
 import json
@@ -7,34 +10,77 @@ import json
 from urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
+log = log_utils.get_logger('checkpoint_api')
+
  
-def get_sid():
-    """Requests a session ID"""
+def login(domain=None):
+    """Logs in to the Check Point management server and returns the login response.\n
+    On a Multi-Domain Server the session is opened in the given domain, without a domain in the System Data domain."""
     headers = {'Content-Type': "application/json"}
-    payload = json.dumps({"api-key": c.CHECKPOINT_API_KEY})
+    payload = {"api-key": c.CHECKPOINT_API_KEY}
+    if domain is not None:
+        payload['domain'] = domain
+    payload = json.dumps(payload)
 
     try:
-        response = requests.post(c.CHECKPOINT_URL+c.CHECKPOINT_AUTH, headers=headers, verify=False, data=payload)
-        if response.status_code != 200:
-            print(f"{response.json()['code']} {response.json()['message']}")
-            raise f"{response.json()['code']} {response.json()['message']}"
+        response = http_utils.request('checkpoint', 'POST', c.CHECKPOINT_URL+c.CHECKPOINT_AUTH, headers=headers, verify=False, data=payload)
     except ConnectionError as e:
         raise ConnectionError(e)    
     except TimeoutError as e:
         raise ConnectionError(e)
-    except Exception as e:
-        raise Exception(e)
+    if response.status_code != 200:
+        log.error(f"{response.json()['code']} {response.json()['message']}")
+        raise Exception(f"{response.json()['code']} {response.json()['message']}")
+    return response.json()
+
+
+def get_sid():
+    """Requests a session ID"""
+    return login()['sid']
+
+
+def logout(sid):
+    """Ends the session for a given session ID, freeing the session slot on the management server"""
+    headers = {'Content-Type': "application/json", 'X-chkp-sid': sid}
+    try:
+        http_utils.request('checkpoint', 'POST', c.CHECKPOINT_URL+c.CHECKPOINT_LOGOUT, headers=headers, verify=False, data=json.dumps({}))
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+
+
+def check_session(response):
+    """Raises AuthError if the session ID was rejected"""
+    if response.status_code == 401 or (response.status_code != 200 and response.json().get('code') == 'generic_err_wrong_session_id'):
+        raise AuthError(f"{response.json().get('code')} {response.json().get('message')}")
+
+
+def get_domains(sid):
+    """Requests the domains of a Multi-Domain Server, the session must be in the System Data domain"""
+    headers = {'Content-Type': "application/json", 'X-chkp-sid': sid}
+    payload = json.dumps({"limit": 500, "details-level": "standard"})
+    try:
+        response = http_utils.request('checkpoint', 'POST', c.CHECKPOINT_URL+c.CHECKPOINT_SHOW_DOMAINS, idempotent=True, headers=headers, verify=False, data=payload)
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
     else:
-        sid = response.json()['sid']
-        return sid
+        check_session(response)
+        return response.json()['objects']
 
 
-def get_device_list(sid):
-    """Requests a list of devices"""
+def get_device_list(sid, filter_text=None, domain=None):
+    """Requests a list of devices, optionally limited to devices matching a search text.\n
+    domain is the domain of the session, responses of different domains are cached separately."""
     headers = {'Content-Type': "application/json", 'X-chkp-sid': sid}
-    payload = json.dumps({"limit": 500})
+    payload = {"limit": 500}
+    if filter_text is not None:
+        payload['filter'] = filter_text
+    payload = json.dumps(payload)
     try:
-        response = requests.post(c.CHECKPOINT_URL+c.CHECKPOINT_SHOW_GATEWAYS_AND_SERVERS, headers=headers, verify=False, data=payload)
+        response = http_utils.request('checkpoint', 'POST', c.CHECKPOINT_URL+c.CHECKPOINT_SHOW_GATEWAYS_AND_SERVERS, idempotent=True, scope=domain, headers=headers, verify=False, data=payload)
     except ConnectionError as e:
         raise e    
     except TimeoutError as e:
@@ -42,16 +88,17 @@ def get_device_list(sid):
     #except Exception as e:
     #    pass
     else:
+        check_session(response)
         return response.json()['objects']
     
 
-def get_device_data(sid, uid):
-    """Requests data for a given device"""
+def get_device_data(sid, uid, domain=None):
+    """Requests data for a given device, domain is the domain of the session"""
     headers = {'Content-Type': "application/json", 'X-chkp-sid': sid}
     payload = json.dumps({"uid": uid,
                "details-level": "full"})
     try:
-        response = requests.post(c.CHECKPOINT_URL+c.CHECKPOINT_SHOW_OBJECT,  headers=headers, verify=False, data=payload)
+        response = http_utils.request('checkpoint', 'POST', c.CHECKPOINT_URL+c.CHECKPOINT_SHOW_OBJECT, idempotent=True, scope=domain, headers=headers, verify=False, data=payload)
     except ConnectionError as e:
         raise e    
     except TimeoutError as e:
@@ -59,6 +106,7 @@ def get_device_data(sid, uid):
     #except Exception as e:
     #    pass
     else:
+        check_session(response)
         return response.json()['object']
 
 
@@ -1,5 +1,4 @@
-from src import utils
-import main
+import sys
 
 
 def show_lvl1_help():
@@ -8,9 +7,18 @@ def show_lvl1_help():
     print('Commands:        Description:')
     print('update         - Update IPAM')
     print('diff           - Show data difference between the IPAM database and the source')
+    print('mirror         - Refresh the local IPAM mirror')
+    print('reconcile      - Find and delete addresses no longer reported by any source')
     print('version        - Show script version')
     print('?/help         - Show this help output')
     print('exit           - Exit script\n')
+    print('Start with --listen to sync devices from DNA-Center event notifications')
+    print('Start with --daemon to run scheduled syncs in the background')
+    print('Start with --reconcile to report stale addresses, add --delete to delete them')
+    print('Use --workers <n>, --partition <site/vrf/hostname> and --node <node>/<nodes> to split updates over processes and hosts')
+    print('Use --log-level <debug/info/warning> and --log-file <path> to control logging')
+    print('Use --record <archive> to record all API requests, --replay <archive> [--replay-speed <n>] to replay them offline')
+    print('Use --no-cache to request all source data again instead of using cached responses')
     print('Press TAB to autocomplete command')
     print('Use UP and DOWN arrows to traverse command history')
     print()
@@ -23,51 +31,49 @@ def show_lvl2_help():
     print('Command:         Source:')
     print('dnac           - Cisco DNA-Center')
     print('checkpoint     - Check Point')
-    print('vmanage        - Cisco vmanage')
+    print('vmanage        - Cisco SD-WAN Manager (vManage)')
     print('exit           - Go back')
     print()
+    print('Sources can be filtered with key=value arguments, comma separate multiple values:')
+    print('Filter:          Description:')
+    print('hostname=       - Hostname pattern, e.g. hostname=SE-MUN-*')
+    print('site=           - DNA-Center site name or vManage site id')
+    print('ip=             - Management IP range, e.g. ip=10.200.0.0/16')
+    print('family=         - DNA-Center device family, e.g. family="Switches and Hubs"')
+    print('type=           - Check Point object type or vManage device model, e.g. type=simple-gateway')
+    print('domain=         - Check Point domain on a Multi-Domain Server, e.g. domain=Europe*')
+    print()
+
 
+def get_arg_value(flag, default=None):
+    """Returns the value following a command line flag, e.g. --workers 4"""
+    if flag not in sys.argv:
+        return default
+    index = sys.argv.index(flag)
+    if index + 1 >= len(sys.argv):
+        raise ValueError(f'Missing value for {flag}')
+    return sys.argv[index + 1]
 
-def lvl1_completer(text, state):
-    """Tab completer for subsession level 1"""
-    options = [cmd for cmd in lvl1_commands.keys() if cmd.startswith(text)]
-    if state < len(options):
-        return options[state]
-    else:
-        return None
 
+def make_completer(commands):
+    """Returns a tab completer for the commands of a subsession"""
+    def completer(text, state):
+        options = [cmd for cmd in commands.keys() if cmd.startswith(text)]
+        if state < len(options):
+            return options[state]
+        else:
+            return None
+    return completer
 
-def lvl2_completer(text, state):
-    """Tab completer for subsession level 2"""
-    options = [cmd for cmd in lvl2_commands.keys() if cmd.startswith(text)]
-    if state < len(options):
-        return options[state]
-    else:
-        return None
+
+def enable_completion(commands):
+    """Enables tab completion and command history for the commands of a subsession.\n
+    readline is only imported here, so headless runs (--daemon, --listen, --reconcile, cron) never load it."""
+    import readline
+    readline.set_completer(make_completer(commands))
+    readline.parse_and_bind('tab: complete')
 
 
 def exit_func():
     """Callable exit function for subsessions"""
     return None
-
-
-# Available CLI-commands per subsession level
-lvl1_commands = {
-    'update': main.lvl2,
-    'diff': main.lvl2,
-    'version': utils.show_version,
-    '?': show_lvl1_help,
-    'help': show_lvl1_help,
-    'exit': exit_func
-}
-
-lvl2_commands = {
-    'dnac': main.get_from_dnac,
-    'checkpoint': main.source_checkpoint,
-    'vmanage': main.get_from_vmanage,
-    '?': show_lvl2_help,
-    'help': show_lvl2_help,
-    'version': utils.show_version,
-    'exit': exit_func
-}
-
@@ -1,5 +1,4 @@
 import os
-import ipaddress
 
 RELEASE = {'version': 'v0.1.4 Beta', 'date': '2024-05-15'}
 
@@ -7,7 +6,9 @@ SECTION_ID = 3 #SCA
 SUBNET_REPORT_PATH = '/var/autoipam-reports/subnet-reports/'   
 ADDRESS_REPORT_PATH = '/var/autoipam-reports/address-reports/'
 CONFLICTS_PATH = '/var/autoipam-reports/conflicts/'             
+REJECTED_PATH = '/var/autoipam-reports/rejected/'
 DIFF_PATH = '/var/autoipam-reports/diff/'
+MIRROR_PATH = '/var/autoipam/'
 
 
 # Time stamp and unique identifier are set in functions in utils.py
@@ -15,12 +16,66 @@ SUBNET_REPORT_FILE_NAME = 'autoipam_report_subnets'
 ADDRESS_REPORT_FILE_NAME = 'autoipam_report_addresses'
 DIFF_EXPORT_FILE_NAME = 'autoipam_diff'
 CONFLICT_FILE_NAME = 'update_conflicts'
+REJECTED_FILE_NAME = 'update_rejected'
+MIRROR_FILE_NAME = 'ipam_mirror.db'
+SNAPSHOT_FILE_NAME = 'ipam_snapshot.bin'
+PLANNER_HISTORY_FILE_NAME = 'planner_history.json'
+
+
+# Reports are written while an update or diff is running
+REPORT_FORMATS = ['jsonl', 'csv']       # jsonl and/or csv
+REPORT_COMPRESS = False                 # gzip compress report files
+REPORT_GZIP_BATCH = 100                 # Rows per gzip member when compressing
+REPORT_FLUSH_ROWS = 100                 # Rows buffered before they are written to the file
+REPORT_FLUSH_INTERVAL = 2               # Max seconds a row stays buffered while rows keep coming in
+REPORT_FSYNC_INTERVAL = 10              # Min seconds between fsyncs while running, every file is synced when it is closed
+DIFF_PAGE_SIZE = 25                     # Diff entries shown per page
+
+
+# Local SQLite mirror of the IPAM section, used by diff and update when enabled
+IPAM_MIRROR_ENABLED = False
+IPAM_MIRROR_MAX_AGE = 900              # Seconds before diff refreshes the mirror or snapshot
+MIRROR_FULL_REFRESH_MAX_AGE = 86400     # Seconds before a refresh requests every address again, until then only the subnets of the run are requested
+MIRROR_TOUCHED_MAX_SUBNETS = 200        # Runs touching more subnets than this refresh every address
+
+# Memory-mapped binary snapshot of the IPAM section, rebuilt by every update and shared by its worker processes
+IPAM_SNAPSHOT_ENABLED = False
+
+# IPAM lookups per run: per-address requests (live), per-address requests with prefetched subnets and VRFs (prefetch),
+# the snapshot or the mirror. auto estimates the cost of each and picks the cheapest, see src/planner.py.
+# IPAM_MIRROR_ENABLED and IPAM_SNAPSHOT_ENABLED fix auto to the mirror or snapshot.
+IPAM_LOOKUP_STRATEGY = 'auto'
+PLANNER_STRATEGIES = ['live', 'prefetch', 'snapshot', 'mirror']     # Strategies auto chooses from
+PLANNER_NEW_SHARE = 0.05                # Share of interfaces assumed missing in IPAM until a run has been recorded
+PLANNER_ENDPOINTS = {                   # (seconds, bytes) per request assumed until the endpoint has been measured
+    'ipam addresses/search': (0.15, 1500),
+    'ipam subnets/cidr': (0.15, 1000),
+    'ipam vrf': (0.15, 3000),
+    'ipam custom_fields': (0.15, 3000),
+    'ipam sections/subnets': (3.0, 5 * 1024 * 1024),
+    'ipam addresses': (30.0, 60 * 1024 * 1024),
+    'ipam subnets/addresses': (0.3, 20 * 1024)
+}
+PLANNER_DECODE_RATES = {                # Bytes per second of bulk responses loaded into each local copy
+    'prefetch': 50 * 1024 * 1024,
+    'snapshot': 30 * 1024 * 1024,
+    'mirror': 10 * 1024 * 1024
+}
 
 
 IPAM_API_KEY = os.environ.get('AUTOIPAM_IPAM_API_KEY')
 CHECKPOINT_API_KEY = os.environ.get('AUTOIPAM_CHECKPOINT_API_KEY')
 DNAC_API_KEY = os.environ.get('AUTOIPAM_DNAC_API_KEY')
 DNAC_USERNAME = 'autoipam'
+VMANAGE_PASSWORD = os.environ.get('AUTOIPAM_VMANAGE_PASSWORD')
+VMANAGE_USERNAME = 'autoipam'
+
+
+# Credential cache
+DNAC_TOKEN_LIFETIME = 3600              # DNA-center tokens are valid for 60 minutes
+CREDENTIAL_REFRESH_MARGIN = 60          # Seconds before expiry a token is considered expired
+CREDENTIAL_DISK_CACHE = False           # Reuse tokens and session IDs across runs
+CREDENTIAL_CACHE_PATH = os.path.expanduser('~/.cache/autoipam/credentials.json')
 
 
 IGNORED_IP_RANGES = [
@@ -31,51 +86,122 @@ IGNORED_IP_RANGES = [
 ]
 
 
-# VRFs
+# VRFs, compiled to networks on first use by utils.calc_vrf
 SCA_PROCESS_VRF = [
-    ipaddress.ip_network('10.192.0.0/16'),
-    ipaddress.ip_network('10.193.0.0/16'),
-    ipaddress.ip_network('10.194.0.0/16'),
-    ipaddress.ip_network('10.195.0.0/16')
+    '10.192.0.0/16',
+    '10.193.0.0/16',
+    '10.194.0.0/16',
+    '10.195.0.0/16'
 ]
 
 SCA_FACILITY_VRF = [
-    ipaddress.ip_network('10.196.0.0/16'),
-    ipaddress.ip_network('10.197.0.0/16'),
-    ipaddress.ip_network('10.198.0.0/16'),
-    ipaddress.ip_network('10.199.0.0/16')
+    '10.196.0.0/16',
+    '10.197.0.0/16',
+    '10.198.0.0/16',
+    '10.199.0.0/16'
 ]
 
 SCA_MGMT_VRF = [
-    ipaddress.ip_network('10.200.0.0/16'),
-    ipaddress.ip_network('10.201.0.0/16'),
-    ipaddress.ip_network('10.202.0.0/16'),
-    ipaddress.ip_network('10.203.0.0/16')
+    '10.200.0.0/16',
+    '10.201.0.0/16',
+    '10.202.0.0/16',
+    '10.203.0.0/16'
 ]
 
 SCA_PRINT_VRF = [
-    ipaddress.ip_network('10.204.0.0/16'),
-    ipaddress.ip_network('10.205.0.0/16'),
-    ipaddress.ip_network('10.206.0.0/16'),
-    ipaddress.ip_network('10.207.0.0/16')
+    '10.204.0.0/16',
+    '10.205.0.0/16',
+    '10.206.0.0/16',
+    '10.207.0.0/16'
 ]
 
 SCA_COMMON_VRF = [
-    ipaddress.ip_network('10.212.0.0/16'),
-    ipaddress.ip_network('10.213.0.0/16'),
-    ipaddress.ip_network('10.214.0.0/16'),
-    ipaddress.ip_network('10.215.0.0/16')
+    '10.212.0.0/16',
+    '10.213.0.0/16',
+    '10.214.0.0/16',
+    '10.215.0.0/16'
 ]
 
 SCA_DC_VRF = [
-    ipaddress.ip_network('10.216.0.0/16')
+    '10.216.0.0/16'
 ]
 
 SCA_DMZ_VRF = [
-    ipaddress.ip_network('10.218.0.0/16')
+    '10.218.0.0/16'
 ]
 
 
+# Background prefetch of tokens, IPAM VRFs and subnets and the Check Point gateway list while the CLI is idle
+PREFETCH_ENABLED = True
+PREFETCH_MAX_AGE = 300                  # Seconds before prefetched data is considered stale
+PREFETCH_INTERVAL = 30                  # Seconds between checks for stale prefetched data
+
+
+# Sync daemon (main.py --daemon)
+DAEMON_JOBS = {                         # Seconds between syncs per source
+    'dnac': 3600,
+    'checkpoint': 3600,
+    'vmanage': 3600
+}
+DAEMON_JITTER = 0.1                     # Random extra delay as a fraction of the interval
+DAEMON_STATUS_HOST = '127.0.0.1'
+DAEMON_STATUS_PORT = 8472
+
+
+# Partitioned sync (main.py --workers N --partition vrf --node 1/2)
+SYNC_WORKERS = 1                        # Worker processes applying changes to IPAM
+SYNC_PARTITION = 'vrf'                  # Partition strategy: site, vrf or hostname
+SYNC_NODE = None                        # (node, nodes) zero based, set with --node when several hosts share the sync
+LOCK_SERVICE = 'sqlite'                 # Lock service for subnet creation, see src/locks.py
+LOCK_FILE_NAME = 'locks.db'
+LOCK_TTL = 300                          # Seconds before a lock held by a crashed worker is taken over
+LOCK_TIMEOUT = 120
+SUBNET_LOCK_PREFIX = 16                 # Subnets are locked on their supernet with this prefix length, shorter subnets on every one they contain
+
+
+# Stale address reconciliation (reconcile command, main.py --reconcile)
+RECONCILE_SOURCES = ['dnac', 'checkpoint', 'vmanage']    # Sources that together report every address AutoIpam owns
+RECONCILE_MAX_DELETE = 200              # Max stale addresses deleted in one run
+RECONCILE_MAX_DELETE_SHARE = 0.05       # Max share of the addresses owned by AutoIpam deleted in one run
+RECONCILE_WORKERS = 8                   # Concurrent delete requests
+RECONCILE_PATH = '/var/autoipam-reports/reconcile/'
+RECONCILE_FILE_NAME = 'autoipam_reconcile'
+
+# Recorded HTTP fixtures (main.py --record <archive> / --replay <archive>)
+FIXTURE_REPLAY_SPEED = 1.0              # 1 replays with the recorded latencies, 2 twice as fast, 0 without any delay
+FIXTURE_GZIP_BATCH = 100                # Exchanges per gzip member in the archive
+FIXTURE_REDACT_FIELDS = ['api-key', 'sid', 'Token', 'token', 'password', 'j_password']     # Json and form fields
+FIXTURE_REDACT_HEADERS = ['set-cookie', 'cookie', 'authorization', 'token', 'x-auth-token', 'x-chkp-sid', 'x-xsrf-token']
+FIXTURE_REDACT_PATHS = ['/dataservice/client/token']                                        # Endpoints returning a bare secret
+
+# Logging (main.py --log-level debug --log-file /var/autoipam/autoipam.log)
+LOG_LEVEL = 'INFO'                      # Console log level, DEBUG shows every lookup and change
+LOG_JSON_FILE = None                    # Path of a json lines log file receiving all levels, None to disable
+
+
+# Progress display
+PROGRESS_REFRESH = 0.5                  # Seconds between refreshes of the progress line in interactive mode
+PROGRESS_EVENT_INTERVAL = 5             # Seconds between progress events logged in headless mode
+
+
+# HTTP timeouts and retries
+HTTP_TIMEOUTS = {                       # (connect, read) timeout in seconds per backend
+    'ipam': (5, 30),
+    'dnac': (5, 60),
+    'checkpoint': (5, 60),
+    'vmanage': (5, 60)
+}
+RUN_DEADLINE = None                     # Max seconds for a complete update or diff, None for no deadline
+HTTP_POOL_SIZE = 16                     # Pooled connections per backend
+HTTP_RETRIES = 3                        # Retries for idempotent reads
+HTTP_RETRY_BASE_DELAY = 0.5
+HTTP_RETRY_MAX_DELAY = 10
+HTTP_HEDGING_ENABLED = False            # Send a second GET for slow IPAM address and subnet lookups
+HTTP_HEDGE_DEFAULT_DELAY = 1.0          # Hedge delay used until enough latency samples are collected
+HTTP_HEDGE_MIN_SAMPLES = 20
+HTTP_LATENCY_WINDOW = 500
+
+
 # IPAM endpoints
 IPAM_URL = 'https://ipam.sca.com'
 #IPAM_URL = 'https://ipamtest.sca.com'  #TEST URL
@@ -87,22 +213,94 @@ IPAM_GET_SUBNET = f'/api/{APP_ID}/subnets/cidr/'#{subnet}/ in CIDR format
 IPAM_GET_VRFS = f'/api/{APP_ID}/vrf/'
 IPAM_CREATE_SUBNET = f'/api/{APP_ID}/subnets/'
 IPAM_SEARCH_ADDRESS = f'/api/{APP_ID}/addresses/search/'#{ip}/
+IPAM_SECTIONS = f'/api/{APP_ID}/sections/'#{sectionId}/subnets/
+IPAM_SUBNET_ADDRESSES = f'/api/{APP_ID}/subnets/'#{subnetId}/addresses/
 
 
 # Checkpoint endpoints
 CHECKPOINT_URL = 'https://S1PRMGM0004.forestproducts.sca.com'
+CHECKPOINT_DOMAINS = None               # None for a single management server, 'all' or a list of domain names on a Multi-Domain Server
+CHECKPOINT_DOMAIN_WORKERS = 4           # Domains requested concurrently
+CHECKPOINT_DOMAIN_REQUESTS = 4          # Concurrent object requests per domain
 
 CHECKPOINT_AUTH = '/web_api/login'
+CHECKPOINT_LOGOUT = '/web_api/logout'
 CHECKPOINT_SHOW_NETWORKS = '/web_api/show-networks'
 CHECKPOINT_SHOW_HOSTS = '/web_api/show-hosts'
 CHECKPOINT_SHOW_CHECKPOINT_HOSTS = '/web_api/show-checkpoint-hosts'
 CHECKPOINT_SHOW_GATEWAYS_AND_SERVERS = '/web_api/show-gateways-and-servers'
 CHECKPOINT_SHOW_OBJECT = '/web_api/show-object'
+CHECKPOINT_SHOW_DOMAINS = '/web_api/show-domains'
 
 
 # DNA-center endpoints
 DNAC_URL = 'https://dnac.forestproducts.sca.com'
+DNAC_DEVICE_FAMILIES = ['Routers', 'Switches and Hubs']
+DNAC_PAGE_SIZE = 500                    # Devices per page, pages capped by older DNA-center releases are detected
+DNAC_WORKERS = 8                        # Device list pages and devices whose interfaces are requested concurrently
+DNAC_INTERFACE_STRATEGY = 'auto'        # Request interfaces per device, from the bulk interface listing, or auto
+DNAC_BULK_MIN_DEVICES = 300             # Devices from which auto uses the interface listing for an unfiltered sync
 
 DNAC_AUTH = '/dna/system/api/v1/auth/token/'
 DNAC_NETWORK_DEVICE = '/dna/intent/api/v1/network-device/'
+DNAC_NETWORK_DEVICE_COUNT = '/dna/intent/api/v1/network-device/count'
 DNAC_INTERFACES = '/dna/intent/api/v1/interface/network-device/'#{deviceId}
+DNAC_INTERFACE_LIST = '/dna/intent/api/v1/interface'
+DNAC_INTERFACE_COUNT = '/dna/intent/api/v1/interface/count'
+
+
+# vManage endpoints
+VMANAGE_URL = 'https://vmanage.sca.com'
+#VMANAGE_URL = 'http://127.0.0.1:8473'  #Local mock, see src/vmanage_mock.py
+VMANAGE_PAGE_SIZE = 500                 # Devices per inventory page
+VMANAGE_WORKERS = 16                    # Edges whose interfaces are requested concurrently
+VMANAGE_SESSION_TIMEOUT = 1800          # Seconds of inactivity before vManage ends a session
+
+VMANAGE_AUTH = '/j_security_check'
+VMANAGE_TOKEN = '/dataservice/client/token'
+VMANAGE_LOGOUT = '/logout'
+VMANAGE_DEVICES = '/dataservice/device'
+VMANAGE_INTERFACES = '/dataservice/device/interface'#?deviceId={systemIp}
+
+# DNA-center event notifications (main.py --listen)
+DNAC_EVENT_HOST = None                  # None listens on 0.0.0.0 if DNAC_EVENT_TOKEN is set, otherwise on 127.0.0.1 only
+DNAC_EVENT_PORT = 8471
+DNAC_EVENT_PATH = '/dnac/events'
+DNAC_EVENT_TOKEN = os.environ.get('AUTOIPAM_DNAC_EVENT_TOKEN')    # Shared secret set as a custom header on the DNA-center webhook
+DNAC_EVENT_TOKEN_HEADER = 'X-AutoIpam-Token'
+DNAC_EVENT_DEBOUNCE = 10                # Seconds without new events before a batch is synced
+DNAC_EVENT_MAX_DELAY = 60               # Max seconds an event waits during a continuous burst
+
+
+# Source response cache, reused by later commands and runs (main.py --no-cache to bypass)
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_PATH = os.path.expanduser('~/.cache/autoipam/http_cache.db')
+HTTP_CACHE_MAX_SIZE = 256 * 1024 * 1024 # Bytes, the least recently used responses are evicted beyond this
+HTTP_CACHE_TTLS = {                     # Seconds a response is used without asking the source, per endpoint path
+    DNAC_NETWORK_DEVICE: 900,
+    DNAC_NETWORK_DEVICE_COUNT: 900,
+    DNAC_INTERFACE_LIST: 900,
+    DNAC_INTERFACE_COUNT: 900,
+    DNAC_INTERFACES+'*': 900,
+    CHECKPOINT_SHOW_GATEWAYS_AND_SERVERS: 900,
+    CHECKPOINT_SHOW_OBJECT: 900,
+    VMANAGE_DEVICES: 900,
+    VMANAGE_INTERFACES: 900
+}
+
+
+# Pre-flight validation of every update, rejected interfaces are written to the rejected report instead of IPAM
+VALIDATION_MAX_LENGTHS = {              # Max characters per IPAM field, as in the phpIPAM schema and custom fields
+    'hostname': 255,
+    'description': 64,
+    'owner': 128,
+    'mac': 20,
+    'custom_Device_Serial': 255,
+    'custom_Subnet_Name': 255
+}
+VALIDATION_MIN_PREFIX = 8               # Interfaces in subnets shorter than this are rejected
+
+
+# Conversion of raw source objects to the standardized interface convention, see src/normalise.py
+NORMALISE_WORKERS = 2                   # Processes converting large batches, 0 converts everything in the calling process
+NORMALISE_BATCH = 1000                  # Interfaces per batch sent to the processes, smaller batches are converted right away
@@ -0,0 +1,159 @@
+from src import sources, singleflight
+from src import constants as c
+from src import log_utils
+from src.errors import AuthError
+
+import os
+import json
+import time
+import atexit
+import threading
+
+
+log = log_utils.get_logger('credentials')
+
+
+# Cached credentials per backend: {'dnac': {'value': token, 'expires': unix time, 'timeout': idle timeout or None}}
+# The vManage value is a dictionary with the session cookie and XSRF token
+# Every Check Point domain has its own session, cached as 'checkpoint/<domain>'
+_credentials = {}
+_lock = threading.Lock()
+_logins = singleflight.KeyedLock()        # Login lock per backend, so different backends log in concurrently
+
+
+def _load_disk_cache():
+    """Loads credentials cached by a previous run, if the disk cache is enabled"""
+    if not c.CREDENTIAL_DISK_CACHE or not os.path.exists(c.CREDENTIAL_CACHE_PATH):
+        return
+    try:
+        with open(c.CREDENTIAL_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return
+    for backend, credential in cached.items():
+        # Only reuse credentials issued by the currently configured server
+        if credential.get('url') == _backend_url(backend) and credential['expires'] > time.time():
+            _credentials[backend] = credential
+
+
+def _save_disk_cache():
+    """Writes the cached credentials to disk, readable by the current user only"""
+    if not c.CREDENTIAL_DISK_CACHE:
+        return
+    cache_dir = os.path.dirname(c.CREDENTIAL_CACHE_PATH)
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    fd = os.open(c.CREDENTIAL_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(_credentials, f)
+
+
+def _backend_url(backend):
+    """Returns the server URL for a given backend"""
+    return {'dnac': c.DNAC_URL, 'checkpoint': c.CHECKPOINT_URL, 'vmanage': c.VMANAGE_URL}[backend.partition('/')[0]]
+
+
+def checkpoint_backend(domain):
+    """Returns the backend name of the session in a Check Point domain, checkpoint for a single management server"""
+    return 'checkpoint' if domain is None else f'checkpoint/{domain}'
+
+
+def _is_valid(backend):
+    """Checks if a cached credential exists and is not about to expire"""
+    credential = _credentials.get(backend)
+    if credential is None:
+        return False
+    return credential['expires'] - c.CREDENTIAL_REFRESH_MARGIN > time.time()
+
+
+def _login(backend):
+    """Requests a new token or session ID for a given backend"""
+    backend_name, _, domain = backend.partition('/')
+    if backend_name == 'dnac':
+        token = sources.get('dnac').get_token()
+        credential = {
+            'value': token,
+            'expires': time.time() + c.DNAC_TOKEN_LIFETIME,
+            'timeout': None,
+            'url': c.DNAC_URL
+        }
+    elif backend_name == 'checkpoint':
+        response = sources.get('checkpoint').login(domain or None)
+        timeout = response.get('session-timeout', 600)
+        credential = {
+            'value': response['sid'],
+            'expires': time.time() + timeout,
+            'timeout': timeout,
+            'url': c.CHECKPOINT_URL
+        }
+    elif backend_name == 'vmanage':
+        credential = {
+            'value': sources.get('vmanage').login(),
+            'expires': time.time() + c.VMANAGE_SESSION_TIMEOUT,
+            'timeout': c.VMANAGE_SESSION_TIMEOUT,
+            'url': c.VMANAGE_URL
+        }
+    with _lock:
+        _credentials[backend] = credential
+        _save_disk_cache()
+
+
+def get_credential(backend, force_refresh=False):
+    """Returns a valid token or session ID for a given backend, logging in only when needed.\n
+    Only one login per backend runs at a time, logins to different backends and Check Point domains run concurrently."""
+    with _lock:
+        if not _credentials:
+            _load_disk_cache()
+    with _logins.hold(backend):
+        if force_refresh or not _is_valid(backend):
+            _login(backend)
+        return _credentials[backend]['value']
+
+
+def invalidate(backend, value):
+    """Drops a cached credential that was rejected by the remote API"""
+    with _lock:
+        credential = _credentials.get(backend)
+        if credential is not None and credential['value'] == value:
+            del _credentials[backend]
+
+
+def _touch(backend):
+    """Extends the expiry of a credential with an idle timeout after a successful request"""
+    credential = _credentials.get(backend)
+    if credential is not None and credential['timeout'] is not None:
+        credential['expires'] = time.time() + credential['timeout']
+
+
+def call(backend, func, *args, **kwargs):
+    """Calls an API function with a valid credential as its first argument.\n
+    If the credential is rejected it is refreshed once and the call is retried."""
+    value = get_credential(backend)
+    try:
+        result = func(value, *args, **kwargs)
+    except AuthError:
+        invalidate(backend, value)
+        value = get_credential(backend)
+        result = func(value, *args, **kwargs)
+    _touch(backend)
+    return result
+
+
+def logout_all():
+    """Logs out of all sessions that hold a slot on the remote server"""
+    if c.CREDENTIAL_DISK_CACHE:
+        # Sessions cached on disk are kept open, so the next run can reuse them
+        return
+    with _lock:
+        for backend in list(_credentials):
+            backend_name = backend.partition('/')[0]
+            if backend_name not in ('checkpoint', 'vmanage'):
+                continue
+            credential = _credentials[backend]
+            try:
+                sources.get(backend_name).logout(credential['value'])
+            except Exception as e:
+                log.warning(f'{backend} logout failed: {e}')
+            del _credentials[backend]
+
+
+atexit.register(logout_all)
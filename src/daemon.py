@@ -0,0 +1,154 @@
+from src import http_utils, prefetch, progress, log_utils
+from src import constants as c
+
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+log = log_utils.get_logger('daemon')
+
+
+class SyncJob:
+    """A sync job for a single source, run on a fixed interval with jitter.\n
+    A job never overlaps with itself, a run that is due while the previous one is still going is skipped."""
+
+    def __init__(self, source, interval, sync_function):
+        self.source = source
+        self.interval = interval
+        self.sync_function = sync_function
+        self.lock = threading.Lock()
+        self.next_run = time.time() + self.jitter()
+        self.metrics = {
+            'source': source,
+            'interval': interval,
+            'running': False,
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,
+            'last-start': None,
+            'last-end': None,
+            'last-duration': None,
+            'last-status': None,
+            'last-error': None,
+            'last-result': None,
+            'next-run': self.next_run
+        }
+
+    def jitter(self):
+        """Returns a random delay that spreads the runs of different sources"""
+        return random.uniform(0, self.interval * c.DAEMON_JITTER)
+
+    def is_due(self):
+        """Checks if the job should run now"""
+        return time.time() >= self.next_run
+
+    def schedule_next(self):
+        """Schedules the next run one interval plus jitter from now"""
+        self.next_run = time.time() + self.interval + self.jitter()
+        self.metrics['next-run'] = self.next_run
+
+    def run(self):
+        """Runs the sync for the source once, unless it is already running"""
+        if not self.lock.acquire(blocking=False):
+            self.metrics['skipped'] += 1
+            log.warning(f'{self.source}: previous run still in progress, skipping')
+            return
+        try:
+            self.metrics['running'] = True
+            self.metrics['last-start'] = time.time()
+            log.info(f'{self.source}: sync started')
+            http_utils.set_deadline(c.RUN_DEADLINE)
+            try:
+                self.metrics['last-result'] = self.sync_function(self.source)
+                self.metrics['last-status'] = 'success'
+                self.metrics['last-error'] = None
+            except Exception as e:
+                self.metrics['failures'] += 1
+                self.metrics['last-status'] = 'failed'
+                self.metrics['last-error'] = str(e)
+                log.error(f'{self.source}: sync failed: {e}')
+            finally:
+                http_utils.set_deadline(None)
+            self.metrics['runs'] += 1
+            self.metrics['last-end'] = time.time()
+            self.metrics['last-duration'] = round(self.metrics['last-end'] - self.metrics['last-start'], 2)
+            log.info(f"{self.source}: sync {self.metrics['last-status']} in {self.metrics['last-duration']}s")
+        finally:
+            self.metrics['running'] = False
+            self.lock.release()
+
+
+class Scheduler:
+    """Runs every configured sync job in its own thread whenever it is due"""
+
+    def __init__(self, sync_function, jobs=None):
+        if jobs is None:
+            jobs = c.DAEMON_JOBS
+        self.jobs = [SyncJob(source, interval, sync_function) for source, interval in jobs.items()]
+        self.started = time.time()
+        self.stopped = threading.Event()
+
+    def status(self):
+        """Returns the daemon status, the metrics of the last run per job and the progress of running syncs"""
+        return {
+            'version': c.RELEASE['version'],
+            'uptime': round(time.time() - self.started, 2),
+            'jobs': [dict(job.metrics) for job in self.jobs],
+            'progress': progress.snapshot_all()
+        }
+
+    def run_forever(self):
+        """Starts jobs when they are due, until stopped"""
+        while not self.stopped.is_set():
+            for job in self.jobs:
+                if job.is_due():
+                    job.schedule_next()
+                    threading.Thread(target=job.run, name=f'autoipam-{job.source}', daemon=True).start()
+            self.stopped.wait(1)
+
+
+def make_status_handler(scheduler):
+    """Returns a request handler class that serves the scheduler status as json"""
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/status':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps(scheduler.status(), indent=4).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StatusHandler
+
+
+def run(sync_function):
+    """Runs the sync daemon until interrupted.\n
+    Connections, tokens and prefetched IPAM data are kept warm in memory between runs,
+    and the status is served on http://DAEMON_STATUS_HOST:DAEMON_STATUS_PORT/status"""
+    scheduler = Scheduler(sync_function)
+    prefetch.start()
+
+    server = ThreadingHTTPServer((c.DAEMON_STATUS_HOST, c.DAEMON_STATUS_PORT), make_status_handler(scheduler))
+    threading.Thread(target=server.serve_forever, name='autoipam-status', daemon=True).start()
+    log.info(f'AutoIpam daemon started, status on http://{c.DAEMON_STATUS_HOST}:{c.DAEMON_STATUS_PORT}/status')
+    for job in scheduler.jobs:
+        log.info(f'{job.source}: every {job.interval}s')
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        log.info('Stopping daemon')
+    finally:
+        scheduler.stopped.set()
+        server.shutdown()
@@ -1,4 +1,7 @@
 from src import constants as c
+from src import http_utils
+from src import log_utils
+from src.errors import AuthError
 
 import requests
 from requests.auth import HTTPBasicAuth
@@ -7,12 +10,15 @@ from requests.auth import HTTPBasicAuth
 from urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
+log = log_utils.get_logger('dnac_api')
+
 
 def get_token():
     """Retrieves session token from DNA-center"""
-    print('Requesting session token...')
+    log.info('Requesting session token...')
     try:
-        response = requests.post(
+        response = http_utils.request(
+            'dnac', 'POST',
             c.DNAC_URL+c.DNAC_AUTH,
             auth=HTTPBasicAuth(c.DNAC_USERNAME, c.DNAC_API_KEY),
             verify=False
@@ -22,7 +28,7 @@ def get_token():
     except TimeoutError as e:
         raise e
     except Exception as e:
-        print(response.content)
+        log.error(response.content)
         raise SystemExit(e)
         
     token = response.json()["Token"]
@@ -30,22 +36,27 @@ def get_token():
 
 
 ## GET DEVICE LIST ACCORDING TO PARAMETERS
-def get_device_list(token, family, offset=0):
+def get_device_list(token, family, offset=0, filter_params=None, limit=None):
     """Get device list according to provided device family.\n
-    Returns a maximum of 100 devices per request.\n
-    Use offset to retrieve a larger number of devices."""
+    Returns a maximum of limit devices per request, DNAC_PAGE_SIZE by default. DNA-center may return less if it caps the page size.\n
+    Use offset to retrieve a larger number of devices, DNA-center counts offsets from 1.\n
+    filter_params are added to the query to filter devices on the DNA-center side."""
     headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
 
     params = {
-        'limit': 100,       #Max 100, set this to a lower number for faster testing
+        'limit': c.DNAC_PAGE_SIZE if limit is None else limit,
         'family': family
     }
 
     if offset > 0:
         params['offset'] = offset
 
+    if filter_params:
+        params.update(filter_params)
+
     try:
-        response = requests.get(
+        response = http_utils.request(
+            'dnac', 'GET',
             c.DNAC_URL+c.DNAC_NETWORK_DEVICE,
             headers = headers,
             verify=False,
@@ -56,9 +67,57 @@ def get_device_list(token, family, offset=0):
     except TimeoutError as e:
         raise e
     except Exception as e:
-        print(response.content)
+        log.error(response.content)
         raise SystemExit(e)
     else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
+        return response.json()['response']
+
+
+def get_device_count(token, family):
+    """Get the number of devices in a device family, returns None if DNA-center does not support counting per family"""
+    headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
+    try:
+        response = http_utils.request(
+            'dnac', 'GET',
+            c.DNAC_URL+c.DNAC_NETWORK_DEVICE_COUNT,
+            headers=headers,
+            verify=False,
+            params={'family': family}
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
+        if response.status_code != 200:
+            log.debug(f'Device count for {family} not available: {response.status_code}')
+            return None
+        return response.json()['response']
+
+
+def get_device(token, device_id):
+    """Get a single device by its id, returns None if the device does not exist"""
+    headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
+    try:
+        response = http_utils.request(
+            'dnac', 'GET',
+            c.DNAC_URL+c.DNAC_NETWORK_DEVICE+device_id,
+            headers=headers,
+            verify=False
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
+        if response.status_code == 404:
+            return None
         return response.json()['response']
 
 
@@ -66,9 +125,10 @@ def get_interfaces(token, device):
     """Get interface information per device"""
     response = None
     headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
-    print(f'Requesting interface data for {device["hostname"]}')
+    log.debug(f'Requesting interface data for {device["hostname"]}')
     try:
-        response = requests.get(
+        response = http_utils.request(
+            'dnac', 'GET',
             c.DNAC_URL+c.DNAC_INTERFACES+device['id'],
             headers=headers,
             verify=False
@@ -78,9 +138,60 @@ def get_interfaces(token, device):
     except TimeoutError as e:
         raise e
     except Exception as e:
-        print(response.content)
+        log.error(response.content)
         raise SystemExit(e)
     else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
+        return response.json()['response']
+
+
+def get_interface_count(token):
+    """Get the number of interfaces of all devices, returns None if DNA-center does not support counting interfaces"""
+    headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
+    try:
+        response = http_utils.request(
+            'dnac', 'GET',
+            c.DNAC_URL+c.DNAC_INTERFACE_COUNT,
+            headers=headers,
+            verify=False
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
+        if response.status_code != 200:
+            log.debug(f'Interface count not available: {response.status_code}')
+            return None
+        return response.json()['response']
+
+
+def get_interface_list(token, offset=1, limit=None):
+    """Get a page of the interfaces of all devices, each interface holds the id of its device in deviceId.\n
+    Returns a maximum of limit interfaces per request, DNAC_PAGE_SIZE by default. Offsets are counted from 1."""
+    headers = {'X-Auth-Token': token, 'Content-Type': 'application/json'}
+    params = {
+        'offset': offset,
+        'limit': c.DNAC_PAGE_SIZE if limit is None else limit
+    }
+    try:
+        response = http_utils.request(
+            'dnac', 'GET',
+            c.DNAC_URL+c.DNAC_INTERFACE_LIST,
+            headers=headers,
+            verify=False,
+            params=params
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    else:
+        if response.status_code == 401:
+            raise AuthError(response.content)
         return response.json()['response']
 
 
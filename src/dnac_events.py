@@ -0,0 +1,179 @@
+from src import log_utils
+from src import constants as c
+
+import json
+import time
+import ipaddress
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+log = log_utils.get_logger('dnac_events')
+
+class EventQueue:
+    """Collects device ids from event notifications and hands them over in debounced batches.\n
+    A batch is released once no new event has arrived for the debounce time, or when the oldest
+    queued event has waited for the max delay, so a burst of events results in a single sync."""
+
+    def __init__(self, debounce=None, max_delay=None):
+        self.debounce = c.DNAC_EVENT_DEBOUNCE if debounce is None else debounce
+        self.max_delay = c.DNAC_EVENT_MAX_DELAY if max_delay is None else max_delay
+        self.device_ids = set()
+        self.first_event = None
+        self.last_event = None
+        self.condition = threading.Condition()
+
+    def put(self, device_ids):
+        """Queues a list of device ids"""
+        with self.condition:
+            now = time.monotonic()
+            if not self.device_ids:
+                self.first_event = now
+            self.device_ids.update(device_ids)
+            self.last_event = now
+            self.condition.notify()
+
+    def get_batch(self):
+        """Blocks until a debounced batch of device ids is ready and returns it"""
+        with self.condition:
+            while True:
+                if not self.device_ids:
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                wait_time = min(self.last_event + self.debounce, self.first_event + self.max_delay) - now
+                if wait_time <= 0:
+                    batch = self.device_ids
+                    self.device_ids = set()
+                    return batch
+                self.condition.wait(wait_time)
+
+
+def get_device_ids(event):
+    """Returns the device ids referenced by a DNA-center event notification"""
+    device_ids = set()
+    network = event.get('network') or {}
+    details = event.get('details') or {}
+    for device_id in (network.get('deviceId'), details.get('deviceId'), details.get('deviceUuid')):
+        if device_id:
+            device_ids.add(device_id)
+    return device_ids
+
+
+def make_handler(event_queue):
+    """Returns a request handler class that queues device ids from posted event notifications"""
+
+    class EventHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.rstrip('/') != c.DNAC_EVENT_PATH.rstrip('/'):
+                self.send_response(404)
+                self.end_headers()
+                return
+            if c.DNAC_EVENT_TOKEN and self.headers.get(c.DNAC_EVENT_TOKEN_HEADER) != c.DNAC_EVENT_TOKEN:
+                log.warning(f'Rejected event from {self.client_address[0]} without a valid token')
+                self.send_response(401)
+                self.end_headers()
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            # DNA-center sends a single event per notification, the stand-in sender may send a list
+            events = payload if isinstance(payload, list) else [payload]
+            device_ids = set()
+            for event in events:
+                device_ids.update(get_device_ids(event))
+            if device_ids:
+                event_queue.put(device_ids)
+                log.info(f"Event received for device(s): {', '.join(sorted(device_ids))}")
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            # Received events are logged by do_POST, skip the default access log
+            pass
+
+    return EventHandler
+
+
+def is_loopback(host):
+    """Checks if a listen address is only reachable from this host"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def get_listen_host():
+    """Returns DNAC_EVENT_HOST, or if it is not set 0.0.0.0 with a token and 127.0.0.1 without one"""
+    if c.DNAC_EVENT_HOST is not None:
+        return c.DNAC_EVENT_HOST
+    return '0.0.0.0' if c.DNAC_EVENT_TOKEN else '127.0.0.1'
+
+
+def listen(sync_function, host=None, port=None):
+    """Receives DNA-center event notifications and calls sync_function with a set of device ids per debounced batch.\n
+    Runs until interrupted. Posted events trigger IPAM writes, so without a token only loopback addresses are accepted."""
+    host = get_listen_host() if host is None else host
+    port = c.DNAC_EVENT_PORT if port is None else port
+    if not c.DNAC_EVENT_TOKEN and not is_loopback(host):
+        log.error(f'Listening on {host} needs a token, set AUTOIPAM_DNAC_EVENT_TOKEN or listen on 127.0.0.1')
+        return
+    event_queue = EventQueue()
+    server = ThreadingHTTPServer((host, port), make_handler(event_queue))
+    server_thread = threading.Thread(target=server.serve_forever, name='autoipam-events', daemon=True)
+    server_thread.start()
+    log.info(f'Listening for DNA-Center events on http://{host}:{port}{c.DNAC_EVENT_PATH}')
+
+    try:
+        while True:
+            device_ids = event_queue.get_batch()
+            try:
+                sync_function(device_ids)
+            except Exception as e:
+                # A failed batch is reported and the listener keeps running
+                log.error(f'Sync failed for device(s) {", ".join(sorted(device_ids))}: {e}')
+    except KeyboardInterrupt:
+        log.info('Stopping event listener')
+    finally:
+        server.shutdown()
+
+
+def send_test_event(device_id, url=None, event_id='NETWORK-DEVICES-3-250'):
+    """Sends a DNA-center style event notification for a device to a running listener, used as a stand-in for DNA-center"""
+    if url is None:
+        url = f'http://127.0.0.1:{c.DNAC_EVENT_PORT}{c.DNAC_EVENT_PATH}'
+    event = {
+        'version': '1.0.0',
+        'eventId': event_id,
+        'name': 'Test event sent by AutoIpam',
+        'type': 'NETWORK',
+        'timestamp': int(time.time() * 1000),
+        'details': {'Type': 'Network Device'},
+        'network': {'deviceId': device_id}
+    }
+    headers = {'Content-Type': 'application/json'}
+    if c.DNAC_EVENT_TOKEN:
+        headers[c.DNAC_EVENT_TOKEN_HEADER] = c.DNAC_EVENT_TOKEN
+    request = urllib.request.Request(url, data=json.dumps(event).encode(), headers=headers, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def main():
+    """Main function, should only be used for developement, testing and debugging.\n
+    Sends a test event for each device id given on the command line: python -m src.dnac_events <deviceId>..."""
+    import sys
+    for device_id in sys.argv[1:]:
+        print(f'{device_id}: {send_test_event(device_id)}')
+
+
+if __name__ == '__main__':
+    main()
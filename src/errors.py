@@ -0,0 +1,8 @@
+class AuthError(Exception):
+    """Raised by the API modules when a token or session ID is rejected by the remote API"""
+    pass
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the overall run deadline is reached before a request could be sent"""
+    pass
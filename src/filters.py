@@ -0,0 +1,136 @@
+from src import constants as c
+
+import shlex
+import fnmatch
+import ipaddress
+
+
+# Filters available for the source commands, e.g. "dnac site=Munksund hostname=SE-MUN-*"
+FILTER_KEYS = ('hostname', 'site', 'ip', 'family', 'type', 'domain')
+
+# Filters each source applies, any other filter would be ignored by it
+SOURCE_FILTER_KEYS = {
+    'dnac': ('hostname', 'site', 'ip', 'family'),
+    'checkpoint': ('hostname', 'ip', 'type', 'domain'),
+    'vmanage': ('hostname', 'site', 'ip', 'type')
+}
+
+
+def parse_family(values):
+    """Returns DNA-center device families in the spelling of DNAC_DEVICE_FAMILIES, matched case insensitive.\n
+    Raises ValueError for a family that is not configured, as DNA-center would return no devices for it."""
+    families = {family.lower(): family for family in c.DNAC_DEVICE_FAMILIES}
+    for value in values:
+        if value.lower() not in families:
+            raise ValueError(f'Unknown family "{value}", configured families: {", ".join(c.DNAC_DEVICE_FAMILIES)}')
+    return [families[value.lower()] for value in values]
+
+
+def parse_filters(args, source=None):
+    """Parses key=value filter arguments for a source into a dictionary.\n
+    Values can be comma separated lists and quoted if they contain spaces, e.g. family="Switches and Hubs".\n
+    Raises ValueError for malformed or unknown filters, and for filters the source does not apply."""
+    available = FILTER_KEYS if source is None else SOURCE_FILTER_KEYS[source]
+    filters = {}
+    for arg in shlex.split(args):
+        key, separator, value = arg.partition('=')
+        key = key.lower()
+        if separator == '' or value == '':
+            raise ValueError(f'Invalid filter "{arg}", expected key=value')
+        if key not in FILTER_KEYS:
+            raise ValueError(f'Unknown filter "{key}", available filters: {", ".join(available)}')
+        if key not in available:
+            raise ValueError(f'Filter "{key}" is not supported by {source}, available filters: {", ".join(available)}')
+        values = [item.strip() for item in value.split(',') if item.strip() != '']
+        if key == 'ip':
+            values = [ipaddress.ip_network(item, strict=False) for item in values]
+        if key == 'family':
+            values = parse_family(values)
+        filters[key] = values
+    return filters
+
+
+def show_filters(filters):
+    """Displays the active filters"""
+    if not filters:
+        return
+    print('Active filters:')
+    for key, values in filters.items():
+        print(f"    {key}: {', '.join(str(value) for value in values)}")
+    print()
+
+
+def match_hostname(hostname, patterns):
+    """Checks if a hostname matches any of the provided glob patterns, case insensitive"""
+    if hostname is None:
+        return False
+    return any(fnmatch.fnmatch(hostname.lower(), pattern.lower()) for pattern in patterns)
+
+
+def match_ip(ip_address, networks):
+    """Checks if an ip-address is part of any of the provided networks"""
+    if ip_address in (None, ''):
+        return False
+    ip = ipaddress.ip_address(ip_address)
+    return any(ip in network for network in networks)
+
+
+def dnac_query_params(filters):
+    """Returns the filters that can be pushed down to the DNA-center network-device query as a dict of query parameters.\n
+    DNA-center matches hostname with regular expressions, so a single glob pattern is translated and pushed down.
+    Several patterns are left to match_dnac_device, like every filter that can not be pushed down."""
+    params = {}
+    if 'site' in filters:
+        params['locationName'] = filters['site']
+    if 'hostname' in filters and len(filters['hostname']) == 1:
+        params['hostname'] = filters['hostname'][0].replace('.', '\\.').replace('*', '.*').replace('?', '.')
+    return params
+
+
+def match_dnac_device(device, filters):
+    """Applies the filters DNA-center could not apply to a retrieved device"""
+    if 'hostname' in filters and not match_hostname(device['hostname'], filters['hostname']):
+        return False
+    if 'ip' in filters and not match_ip(device.get('managementIpAddress'), filters['ip']):
+        return False
+    return True
+
+
+def checkpoint_filter_text(filters):
+    """Returns a search text that can be pushed down to the Check Point API, or None.\n
+    Only a single hostname pattern is pushed down, using its literal part before the first wildcard."""
+    if 'hostname' not in filters or len(filters['hostname']) != 1:
+        return None
+    prefix = filters['hostname'][0].split('*')[0].split('?')[0]
+    if prefix == '':
+        return None
+    return prefix
+
+
+def match_checkpoint_device(device, filters):
+    """Applies the filters to a device in the Check Point gateway list"""
+    if 'hostname' in filters and not match_hostname(device['name'], filters['hostname']):
+        return False
+    if 'type' in filters and device['type'].lower() not in [device_type.lower() for device_type in filters['type']]:
+        return False
+    if 'ip' in filters and not match_ip(device.get('ipv4-address'), filters['ip']):
+        return False
+    return True
+
+
+def match_checkpoint_domain(domain, filters):
+    """Checks if a Check Point domain matches the domain filter, domains are matched like hostnames"""
+    return 'domain' not in filters or match_hostname(domain, filters['domain'])
+
+
+def match_vmanage_device(device, filters):
+    """Applies the filters to a device in the vManage inventory, site matches the vManage site id"""
+    if 'hostname' in filters and not match_hostname(device.get('host-name'), filters['hostname']):
+        return False
+    if 'site' in filters and str(device.get('site-id')) not in filters['site']:
+        return False
+    if 'type' in filters and device.get('device-model', '').lower() not in [device_type.lower() for device_type in filters['type']]:
+        return False
+    if 'ip' in filters and not match_ip(device.get('system-ip'), filters['ip']):
+        return False
+    return True
@@ -0,0 +1,250 @@
+from src import http_utils, log_utils
+from src import constants as c
+
+import os
+import glob
+import gzip
+import json
+import time
+import atexit
+import base64
+import threading
+import urllib.parse
+from collections import deque
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+log = log_utils.get_logger('fixtures')
+
+REDACTED = 'REDACTED'
+
+_recorder = None
+_replayer = None
+
+
+class FixtureMissing(Exception):
+    """Raised when a replayed run sends a request that was not recorded"""
+    pass
+
+
+def redact_value(value):
+    """Redacts secret fields in a decoded json body or form, recursively"""
+    if isinstance(value, dict):
+        return {key: REDACTED if key in c.FIXTURE_REDACT_FIELDS else redact_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact_value(item) for item in value]
+    return value
+
+
+def redact_body(body, content_type=''):
+    """Redacts secret fields in a request or response body, returns the body as text or None"""
+    if body is None or body == b'' or body == '':
+        return None
+    if isinstance(body, bytes):
+        try:
+            body = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return 'base64:'+base64.b64encode(body).decode()
+    try:
+        return json.dumps(redact_value(json.loads(body)), sort_keys=True)
+    except ValueError:
+        pass
+    if 'x-www-form-urlencoded' in content_type:
+        form = urllib.parse.parse_qsl(body, keep_blank_values=True)
+        if form:
+            return urllib.parse.urlencode([(key, REDACTED if key in c.FIXTURE_REDACT_FIELDS else value) for key, value in form])
+    return body
+
+
+def redact_url(url):
+    """Redacts secret query parameters and sorts the query, so equal requests have equal urls"""
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((key, REDACTED if key in c.FIXTURE_REDACT_FIELDS else value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, urllib.parse.urlencode(query), ''))
+
+
+def redact_headers(headers):
+    """Removes secret headers, cookies are recorded separately by name only"""
+    return {key: value for key, value in headers.items() if key.lower() not in c.FIXTURE_REDACT_HEADERS}
+
+
+def redact_response_body(url, response):
+    """Redacts a response body, bodies of endpoints that return a bare secret are replaced completely"""
+    if any(urllib.parse.urlsplit(url).path.endswith(path) for path in c.FIXTURE_REDACT_PATHS):
+        return REDACTED
+    return redact_body(response.content, response.headers.get('Content-Type', ''))
+
+
+def request_key(backend, request):
+    """Returns the key a request is matched on when replaying: backend, method, redacted url and body"""
+    body = redact_body(request.body, request.headers.get('Content-Type', ''))
+    return f'{backend} {request.method} {redact_url(request.url)} {body or ""}'
+
+
+class Recorder:
+    """Writes every exchange of a run to a gzip compressed JSON Lines archive, one exchange per line.\n
+    Lines are written as complete gzip members of FIXTURE_GZIP_BATCH exchanges, like the reports.
+    Worker processes write to their own file next to the archive, one member per exchange since
+    they exit without running atexit handlers. Replay picks these files up as well."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file_path = path
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.counts = {}
+        self.closed = False
+        self.started = time.monotonic()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        open(path, 'wb').close()
+
+    def write(self, backend, request, response, elapsed):
+        """Records a single exchange"""
+        exchange = {
+            'key': request_key(backend, request),
+            'elapsed': round(elapsed, 4),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': redact_headers(response.headers),
+            'cookies': sorted(response.cookies.keys()),
+            'body': redact_response_body(request.url, response)
+        }
+        with self.lock:
+            if self.pid != os.getpid():
+                # Exchanges buffered by the parent process belong to the parent's archive
+                self.pid = os.getpid()
+                self.file_path = f'{self.path}.{self.pid}'
+                self.buffer = []
+                self.counts = {}
+            self.buffer.append(json.dumps(exchange, ensure_ascii=False)+'\n')
+            self.counts[backend] = self.counts.get(backend, 0) + 1
+            # Exchanges after close, e.g. logouts at exit, are written right away
+            if len(self.buffer) >= c.FIXTURE_GZIP_BATCH or self.file_path != self.path or self.closed:
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered exchanges as a gzip member, must be called with the lock held"""
+        if not self.buffer:
+            return
+        with open(self.file_path, 'ab') as f:
+            f.write(gzip.compress(''.join(self.buffer).encode('utf-8')))
+        self.buffer = []
+
+    def close(self):
+        """Writes the remaining exchanges and logs the number of recorded requests"""
+        with self.lock:
+            self.flush()
+            self.closed = True
+        log.info(f'Recorded {sum(self.counts.values())} requests ({format_counts(self.counts)}) in {time.monotonic() - self.started:.1f}s to {self.path}')
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Connection pool that records every exchange it sends"""
+
+    def __init__(self, backend, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.backend = backend
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        # Reading the content here keeps the measured latency comparable to a replayed response
+        response.content
+        self.recorder.write(self.backend, request, response, time.monotonic() - start)
+        return response
+
+
+class Replayer:
+    """Serves recorded exchanges in the order they were recorded per request key.\n
+    Once all recordings of a key are used the last one is repeated, e.g. for hedged or retried requests."""
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = c.FIXTURE_REPLAY_SPEED if speed is None else speed
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        self.counts = {}
+        self.missing = 0
+        self.started = time.monotonic()
+        for file_path in [path] + sorted(glob.glob(f'{glob.escape(path)}.*')):
+            with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    exchange = json.loads(line)
+                    self.exchanges.setdefault(exchange['key'], deque()).append(exchange)
+
+    def next(self, backend, request):
+        """Returns the next recorded exchange for a request"""
+        key = request_key(backend, request)
+        with self.lock:
+            recordings = self.exchanges.get(key)
+            if not recordings:
+                self.missing += 1
+                raise FixtureMissing(f'No recorded response for {key[:200]}')
+            exchange = recordings.popleft() if len(recordings) > 1 else recordings[0]
+            self.counts[backend] = self.counts.get(backend, 0) + 1
+        return exchange
+
+    def delay(self, exchange):
+        """Returns the time to wait before a recorded response is returned, scaled by the replay speed"""
+        if self.speed <= 0:
+            return 0
+        return exchange['elapsed'] / self.speed
+
+    def close(self):
+        """Logs the number of replayed requests and the wall time of the run"""
+        log.info(f'Replayed {sum(self.counts.values())} requests ({format_counts(self.counts)}), {self.missing} missing, in {time.monotonic() - self.started:.1f}s at speed {self.speed}')
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport that answers requests from a fixture archive instead of the network"""
+
+    def __init__(self, backend, replayer):
+        super().__init__()
+        self.backend = backend
+        self.replayer = replayer
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        exchange = self.replayer.next(self.backend, request)
+        time.sleep(self.replayer.delay(exchange))
+
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.reason = exchange['reason']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        body = exchange['body'] or ''
+        response._content = base64.b64decode(body[7:]) if body.startswith('base64:') else body.encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        for name in exchange['cookies']:
+            response.cookies.set(name, REDACTED)
+        return response
+
+    def close(self):
+        pass
+
+
+def format_counts(counts):
+    """Formats request counts per backend, e.g. ipam: 120, dnac: 14"""
+    return ', '.join(f'{backend}: {count}' for backend, count in sorted(counts.items())) or 'none'
+
+
+def start_recording(path):
+    """Records all requests sent from now on to the archive at path"""
+    global _recorder
+    _recorder = Recorder(path)
+    http_utils.set_transport(lambda backend: RecordingAdapter(backend, _recorder, pool_connections=1, pool_maxsize=c.HTTP_POOL_SIZE))
+    atexit.register(_recorder.close)
+
+
+def start_replay(path, speed=None):
+    """Answers all requests from now on from the archive at path, speed 1 keeps the recorded latencies and 0 removes them"""
+    global _replayer
+    _replayer = Replayer(path, speed)
+    http_utils.set_transport(lambda backend: ReplayAdapter(backend, _replayer))
+    atexit.register(_replayer.close)
@@ -0,0 +1,180 @@
+from src import constants as c
+from src import log_utils
+
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import sqlite3
+import threading
+import urllib.parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+log = log_utils.get_logger('http_cache')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed);
+"""
+
+_db = None
+_db_pid = None
+_lock = threading.Lock()
+_stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+
+
+def get_db():
+    """Returns the cache database of the current process, created on first use and readable by the current user only"""
+    global _db, _db_pid
+    if _db is None or _db_pid != os.getpid():
+        os.makedirs(os.path.dirname(c.HTTP_CACHE_PATH), exist_ok=True)
+        os.close(os.open(c.HTTP_CACHE_PATH, os.O_RDWR | os.O_CREAT, 0o600))
+        _db = sqlite3.connect(c.HTTP_CACHE_PATH, timeout=30, check_same_thread=False)
+        _db.row_factory = sqlite3.Row
+        # Cached responses can be requested again, so durability is traded for fast writes
+        _db.execute('PRAGMA journal_mode=WAL')
+        _db.execute('PRAGMA synchronous=NORMAL')
+        _db.executescript(SCHEMA)
+        _db_pid = os.getpid()
+    return _db
+
+
+def get_ttl(method, url, idempotent):
+    """Returns the number of seconds a response may be served from the cache, or None if the endpoint is not cached.\n
+    Only idempotent reads of the endpoints in HTTP_CACHE_TTLS are cached, never logins, writes or IPAM."""
+    if not c.HTTP_CACHE_ENABLED or not idempotent:
+        return None
+    path = urllib.parse.urlsplit(url).path
+    for pattern, ttl in c.HTTP_CACHE_TTLS.items():
+        if fnmatch.fnmatchcase(path, pattern):
+            return ttl
+    return None
+
+
+def request_key(backend, method, url, kwargs, scope=None):
+    """Returns the cache key of a request: backend, scope, method, url with query and body.\n
+    Headers are left out, so requests with a new token or session ID share the cached response."""
+    prepared = requests.Request(method.upper(), url, params=kwargs.get('params'), data=kwargs.get('data'), json=kwargs.get('json')).prepare()
+    body = prepared.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(f'{backend} {scope or ""} {prepared.method} {prepared.url} '.encode('utf-8') + body).hexdigest()
+
+
+def get(key):
+    """Returns the cached entry of a request, or None"""
+    with _lock:
+        db = get_db()
+        row = db.execute('SELECT * FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        # The access time is only kept to the minute, so most hits do not write to the database
+        now = time.time()
+        if now - row['accessed'] > 60:
+            with db:
+                db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return dict(row)
+
+
+def is_fresh(entry, ttl):
+    """Checks if a cached entry is younger than the ttl of its endpoint"""
+    return time.time() - entry['stored'] < ttl
+
+
+def conditional_headers(entry):
+    """Returns the headers revalidating a stale entry, empty if the server sent neither ETag nor Last-Modified"""
+    headers = json.loads(entry['headers'])
+    conditions = {}
+    for name, value in headers.items():
+        if name.lower() == 'etag':
+            conditions['If-None-Match'] = value
+        elif name.lower() == 'last-modified':
+            conditions['If-Modified-Since'] = value
+    return conditions
+
+
+def is_cacheable(response):
+    """Checks if a response can be stored: successful json only.\n
+    vManage answers an expired session with the login page and status 200, which must never be served again."""
+    return response.status_code == 200 and 'json' in response.headers.get('Content-Type', '')
+
+
+def put(key, response):
+    """Stores a response, evicting the least recently used entries once the cache exceeds HTTP_CACHE_MAX_SIZE"""
+    body = response.content
+    if len(body) > c.HTTP_CACHE_MAX_SIZE:
+        return
+    headers = {name: value for name, value in response.headers.items() if name.lower() in ('content-type', 'etag', 'last-modified')}
+    now = time.time()
+    with _lock:
+        db = get_db()
+        with db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, stored, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.url, response.status_code, json.dumps(headers), body, len(body), now, now)
+            )
+            evict(db, key)
+
+
+def evict(db, stored_key):
+    """Deletes the least recently used entries, except the one just stored, until the cache fits in HTTP_CACHE_MAX_SIZE.\n
+    Must be called with the lock held."""
+    total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    if total <= c.HTTP_CACHE_MAX_SIZE:
+        return
+    evicted = 0
+    for row in db.execute('SELECT key, size FROM responses WHERE key != ? ORDER BY accessed', (stored_key,)).fetchall():
+        if total <= c.HTTP_CACHE_MAX_SIZE:
+            break
+        db.execute('DELETE FROM responses WHERE key = ?', (row['key'],))
+        total -= row['size']
+        evicted += 1
+    log.debug(f'Evicted {evicted} cached responses')
+
+
+def touch(key):
+    """Marks a revalidated entry as fresh again"""
+    now = time.time()
+    with _lock:
+        db = get_db()
+        with db:
+            db.execute('UPDATE responses SET stored = ?, accessed = ? WHERE key = ?', (now, now, key))
+
+
+def make_response(entry):
+    """Builds a response from a cached entry"""
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.reason = 'OK'
+    response.headers = CaseInsensitiveDict(json.loads(entry['headers']))
+    response._content = entry['body']
+    response.encoding = 'utf-8'
+    response.url = entry['url']
+    return response
+
+
+def count(outcome):
+    """Counts a cache hit, revalidated entry or miss"""
+    with _lock:
+        _stats[outcome] += 1
+
+
+def stats():
+    """Returns the number of cache hits, revalidated entries and misses of this run"""
+    with _lock:
+        return dict(_stats)
+
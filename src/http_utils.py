@@ -0,0 +1,221 @@
+from src import constants as c
+from src import http_cache
+from src.errors import DeadlineExceeded
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+_state = threading.local()        # Deadline per thread, so concurrent jobs each have their own
+_sessions = {}
+_session_lock = threading.Lock()
+_latencies = {}
+_sizes = {}                       # Response sizes per endpoint, next to the latencies
+_latency_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='autoipam-hedge')
+_transport = None                 # Function returning the adapter for a backend, replaces the default connection pool
+
+
+def _reset_after_fork():
+    """Drops the state a forked worker process must not share with its parent: pooled connections, whose sockets
+    the parent keeps using, locks that may have been held by a thread that does not exist in the child, and the hedge threads"""
+    global _session_lock, _latency_lock, _hedge_executor
+    _session_lock = threading.Lock()
+    _latency_lock = threading.Lock()
+    _sessions.clear()
+    _hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='autoipam-hedge')
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session(backend):
+    """Returns a pooled session per backend, so connections are reused between requests"""
+    with _session_lock:
+        if backend not in _sessions:
+            session = requests.Session()
+            if _transport is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=c.HTTP_POOL_SIZE)
+            else:
+                adapter = _transport(backend)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[backend] = session
+        return _sessions[backend]
+
+
+def set_transport(transport):
+    """Sets a function that returns the adapter used by the session of a backend, e.g. to record or replay requests.\n
+    None restores the default connection pool. Existing sessions are dropped, so all further requests use the new transport."""
+    global _transport
+    with _session_lock:
+        _transport = transport
+        _sessions.clear()
+
+
+def set_deadline(seconds):
+    """Sets an overall deadline for all requests made from now on by the current thread, None removes the deadline"""
+    _state.deadline = None if seconds is None else time.monotonic() + seconds
+
+
+def get_deadline():
+    """Returns the deadline of the current thread as a monotonic time, or None"""
+    return getattr(_state, 'deadline', None)
+
+
+def remaining_time():
+    """Returns the number of seconds left before the deadline, or None if no deadline is set"""
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def get_timeout(backend):
+    """Returns the (connect, read) timeout for a backend, clamped to the remaining deadline"""
+    connect_timeout, read_timeout = c.HTTP_TIMEOUTS[backend]
+    remaining = remaining_time()
+    if remaining is None:
+        return (connect_timeout, read_timeout)
+    if remaining <= 0:
+        raise DeadlineExceeded('Run deadline exceeded')
+    return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+
+def record_latency(key, seconds, size=None):
+    """Stores the latency and response size in bytes of a successful request in a rolling window per endpoint"""
+    with _latency_lock:
+        if key not in _latencies:
+            _latencies[key] = deque(maxlen=c.HTTP_LATENCY_WINDOW)
+            _sizes[key] = deque(maxlen=c.HTTP_LATENCY_WINDOW)
+        _latencies[key].append(seconds)
+        if size is not None:
+            _sizes[key].append(size)
+
+
+def get_p95_latency(key):
+    """Returns the 95th percentile latency for an endpoint, or None if there are too few samples"""
+    with _latency_lock:
+        samples = sorted(_latencies.get(key, ()))
+    if len(samples) < c.HTTP_HEDGE_MIN_SAMPLES:
+        return None
+    return samples[int(len(samples) * 0.95) - 1]
+
+
+def get_endpoint_stats():
+    """Returns the mean latency, mean response size and number of samples per endpoint of this process"""
+    with _latency_lock:
+        return {
+            key: {
+                'latency': sum(samples) / len(samples),
+                'bytes': sum(_sizes[key]) / len(_sizes[key]) if _sizes[key] else None,
+                'samples': len(samples)
+            }
+            for key, samples in _latencies.items() if samples
+        }
+
+
+def backoff(attempt):
+    """Sleeps with exponential backoff and full jitter before a retry"""
+    delay = random.uniform(0, min(c.HTTP_RETRY_MAX_DELAY, c.HTTP_RETRY_BASE_DELAY * 2 ** attempt))
+    remaining = remaining_time()
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded('Run deadline exceeded')
+    time.sleep(delay)
+
+
+def request(backend, method, url, idempotent=None, latency_key=None, scope=None, **kwargs):
+    """Sends a request with the configured timeouts for a backend.\n
+    Idempotent requests (GET by default) are retried with jittered backoff on connection errors,
+    timeouts and temporary server errors. All other requests are sent exactly once.\n
+    Idempotent reads of source endpoints with a ttl in HTTP_CACHE_TTLS are served from the response cache while fresh.
+    scope separates cached responses that depend on the session, e.g. the Check Point domain."""
+    if idempotent is None:
+        idempotent = method.upper() == 'GET'
+    ttl = http_cache.get_ttl(method, url, idempotent)
+    if ttl is None:
+        return send(backend, method, url, idempotent, latency_key, **kwargs)
+
+    key = http_cache.request_key(backend, method, url, kwargs, scope)
+    entry = http_cache.get(key)
+    if entry is not None and http_cache.is_fresh(entry, ttl):
+        http_cache.count('hits')
+        return http_cache.make_response(entry)
+    if entry is not None:
+        # A stale entry is revalidated where the server sent an ETag or Last-Modified header
+        kwargs['headers'] = {**(kwargs.get('headers') or {}), **http_cache.conditional_headers(entry)}
+
+    response = send(backend, method, url, idempotent, latency_key, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        http_cache.touch(key)
+        http_cache.count('revalidated')
+        return http_cache.make_response(entry)
+    http_cache.count('misses')
+    if http_cache.is_cacheable(response):
+        http_cache.put(key, response)
+    return response
+
+
+def send(backend, method, url, idempotent, latency_key=None, **kwargs):
+    """Sends a request, retrying idempotent requests, see request"""
+    attempts = c.HTTP_RETRIES + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        kwargs['timeout'] = get_timeout(backend)
+        start = time.monotonic()
+        try:
+            response = get_session(backend).request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt + 1 == attempts:
+                raise
+            backoff(attempt)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt + 1 < attempts:
+            backoff(attempt)
+            continue
+
+        record_latency(latency_key or f'{backend} {method.upper()}', time.monotonic() - start, len(response.content))
+        return response
+
+
+def hedged_get(backend, url, latency_key, **kwargs):
+    """Sends a GET request, and a second identical request if the first one has not answered
+    within the p95 latency of the endpoint. Returns whichever response arrives first."""
+    if not c.HTTP_HEDGING_ENABLED:
+        return request(backend, 'GET', url, latency_key=latency_key, **kwargs)
+
+    hedge_delay = get_p95_latency(latency_key)
+    if hedge_delay is None:
+        hedge_delay = c.HTTP_HEDGE_DEFAULT_DELAY
+
+    deadline = get_deadline()
+
+    def hedge():
+        # Runs in an executor thread, which needs the deadline of the calling thread
+        _state.deadline = deadline
+        return request(backend, 'GET', url, latency_key=latency_key, **dict(kwargs))
+
+    first = _hedge_executor.submit(hedge)
+    done, _ = wait([first], timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    second = _hedge_executor.submit(hedge)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+    # Both requests failed, raise the error of the original request
+    return first.result()
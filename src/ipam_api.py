@@ -1,9 +1,14 @@
 from src import constants as c
+from src import http_utils
+from src import log_utils
+from src import singleflight
 
-import requests
 import ipaddress
 
 
+log = log_utils.get_logger('ipam_api')
+
+
 #---------- Used for dev/debugging ----------
 
 #with open('../debug_dnac_device.json', 'r') as f:
@@ -18,21 +23,26 @@ import ipaddress
 def get_custom_fields():
     """Retrieves available custom fields"""
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
-    response = requests.get(
+    response = http_utils.request(
+        'ipam', 'GET',
         c.IPAM_URL+c.IPAM_GET_CUSTOM_FIELDS,
+        latency_key='ipam custom_fields',
         headers=headers, 
         verify=True
     )
     return response
 
 
+@singleflight.coalesce('ipam subnet')
 def get_subnet(network_address):
     """Requests subnet information for a given network address"""
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
 
     try:
-        response = requests.get(
+        response = http_utils.hedged_get(
+            'ipam',
             c.IPAM_URL+c.IPAM_GET_SUBNET+network_address+'/',
+            'ipam subnets/cidr',
             headers=headers, 
             verify=True
         )
@@ -56,20 +66,23 @@ def get_subnet(network_address):
         return subnet
 
 
+@singleflight.coalesce('ipam subnet id')
 def get_subnet_id(network_address):
     """Requests a subnet id for a given network address"""
-    print(f'Searching subnet-id for {network_address}')
+    log.debug(f'Searching subnet-id for {network_address}')
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
 
     try:
-        response = requests.get(
+        response = http_utils.hedged_get(
+            'ipam',
             c.IPAM_URL+c.IPAM_GET_SUBNET+network_address+'/',
+            'ipam subnets/cidr',
             headers=headers, 
             verify=True
         )
         if response.json()['success'] is not True:
             if response.json()['message'] == 'No subnets found':
-                print(response.json()['message'])
+                log.debug(response.json()['message'])
                 return None
     except ConnectionError as e:
         raise e    
@@ -79,17 +92,19 @@ def get_subnet_id(network_address):
     #    pass
     else:
         subnet_id = response.json()['data'][0]['id']
-        print(f"Found subnet with id: {subnet_id}")
+        log.debug(f"Found subnet with id: {subnet_id}")
         return subnet_id
     
 
-def get_vrf_id(vrf_name):
-    """Requests a list of available VRFs from the IPAM database and calculates matching vrfId for a specified VRF-name"""
+def get_vrfs():
+    """Requests a list of available VRFs from the IPAM database"""
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
 
     try:
-        response = requests.get(
+        response = http_utils.request(
+            'ipam', 'GET',
             c.IPAM_URL+c.IPAM_GET_VRFS,
+            latency_key='ipam vrf',
             headers=headers,
             verify=True
         )
@@ -101,7 +116,13 @@ def get_vrf_id(vrf_name):
         raise Exception(e)
     
     if response.status_code == 200:
-        vrf_list = response.json()['data']
+        return response.json()['data']
+    return []
+
+
+def get_vrf_id(vrf_name):
+    """Requests a list of available VRFs from the IPAM database and calculates matching vrfId for a specified VRF-name"""
+    vrf_list = get_vrfs()
 
     for vrf in vrf_list:
         if vrf['name'] == vrf_name:
@@ -110,6 +131,73 @@ def get_vrf_id(vrf_name):
     return None
         
 
+def get_section_subnets(section_id):
+    """Requests all subnets in a given section"""
+    headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
+
+    try:
+        response = http_utils.request(
+            'ipam', 'GET',
+            c.IPAM_URL+c.IPAM_SECTIONS+str(section_id)+'/subnets/',
+            latency_key='ipam sections/subnets',
+            headers=headers,
+            verify=True
+        )
+    except ConnectionError as e:
+        raise ConnectionError(e)
+    except TimeoutError as e:
+        raise TimeoutError(e)
+    else:
+        if response.json()['success'] is True:
+            return response.json()['data']
+        return []
+
+
+def get_subnet_addresses(subnet_id):
+    """Requests all address objects in a given subnet"""
+    headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
+
+    try:
+        response = http_utils.request(
+            'ipam', 'GET',
+            c.IPAM_URL+c.IPAM_SUBNET_ADDRESSES+str(subnet_id)+'/addresses/',
+            latency_key='ipam subnets/addresses',
+            headers=headers,
+            verify=True
+        )
+    except ConnectionError as e:
+        raise ConnectionError(e)
+    except TimeoutError as e:
+        raise TimeoutError(e)
+    else:
+        if response.json()['success'] is True:
+            return response.json()['data']
+        return []
+
+
+def get_all_addresses():
+    """Requests all address objects in the IPAM database"""
+    headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
+
+    try:
+        response = http_utils.request(
+            'ipam', 'GET',
+            c.IPAM_URL+c.IPAM_ADDRESSES,
+            latency_key='ipam addresses',
+            headers=headers,
+            verify=True
+        )
+    except ConnectionError as e:
+        raise ConnectionError(e)
+    except TimeoutError as e:
+        raise TimeoutError(e)
+    else:
+        if response.json()['success'] is True:
+            return response.json()['data']
+        return []
+
+
+@singleflight.coalesce('ipam master subnet')
 def get_master_subnet(possible_master_subnets):
     """Searches for existing subnets in the IPAM database that match the list of possible master subnets"""
     existing_possible_master_subnets = []
@@ -121,10 +209,7 @@ def get_master_subnet(possible_master_subnets):
     # Sorts the existing master subnets by prefix length in descending order
     sorted_possible_master_subnets = sorted(existing_possible_master_subnets, key=lambda x: ipaddress.ip_network(x).prefixlen, reverse=True)
     
-    print(f'Matching master subnets found:')
-    for subnet in sorted_possible_master_subnets:
-        print(subnet)
-    print()
+    log.debug(f"Matching master subnets found: {', '.join(sorted_possible_master_subnets)}")
 
     if len(sorted_possible_master_subnets) > 0:
         return sorted_possible_master_subnets[0]
@@ -133,8 +218,21 @@ def get_master_subnet(possible_master_subnets):
 
 
 def create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id=None):
-    """Creates a new subnet object in the IPAM-database"""
-    print(f'Creating entry for subnet {network_address}/{cidr}')
+    """Creates a new subnet object in the IPAM-database.\n
+    Only one create per subnet is in flight in this process. A create that had to wait for another one
+    looks the subnet up again and returns it as existing, instead of getting a 409 from IPAM."""
+    with singleflight.exclusive(f'subnet {network_address}/{cidr}') as waited:
+        if waited:
+            # Not coalesced, a lookup started before the other create finished would not see the new subnet
+            subnet_id = get_subnet_id.__wrapped__(f'{network_address}/{cidr}')
+            if subnet_id is not None:
+                return {'id': subnet_id, 'existing': True}
+        return post_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id)
+
+
+def post_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id=None):
+    """Sends the request that creates a new subnet object in the IPAM-database"""
+    log.debug(f'Creating entry for subnet {network_address}/{cidr}')
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
 
     params = {
@@ -154,7 +252,8 @@ def create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_descri
         params['custom_Subnet_Name'] = subnet_name
 
     try:
-        response = requests.post(
+        response = http_utils.request(
+            'ipam', 'POST',
             c.IPAM_URL+c.IPAM_CREATE_SUBNET,
             headers=headers, 
             verify=True,
@@ -170,26 +269,32 @@ def create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_descri
         data = {}
         if response.status_code == 201:
             data['id'] = response.json()['id']
-            print(f"{response.json()['message']} with id {response.json()['id']}")
+            log.debug(f"{response.json()['message']} with id {response.json()['id']}")
             return data
         elif response.status_code == 409:
             data['id'] = None
-            data['subnet'] = network_address+'/'+cidr,
+            data['subnet'] = f'{network_address}/{cidr}'
             data['error'] = response.json()['message']
             return data
         else:
-            print(response.content)
-            exit()
+            # Other subnets and addresses do not depend on this one, so the update continues
+            log.error(response.content)
+            data['id'] = None
+            data['subnet'] = f'{network_address}/{cidr}'
+            data['error'] = f'Status {response.status_code}'
+            return data
     
 
 def get_address(network_address):
     """Requests data for a given network address"""
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
-    print('Requesting interface data...')
+    log.debug(f'Requesting address data for {network_address}')
 
     try:
-        response = requests.get(
+        response = http_utils.hedged_get(
+            'ipam',
             c.IPAM_URL+c.IPAM_SEARCH_ADDRESS+network_address+'/',
+            'ipam addresses/search',
             headers=headers, 
             verify=True,
         )
@@ -208,8 +313,8 @@ def get_address(network_address):
     
 
 def create_address(interface, device, subnet_id):
-    """Creates a new address object in the IPAM-database"""
-    print(f"Creating entry for address: {interface['ipv4Address']}")
+    """Creates a new address object in the IPAM-database, returns its id or None if it could not be created"""
+    log.debug(f"Creating entry for address: {interface['ipv4Address']}")
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
     params = {
         'subnetId': subnet_id,
@@ -224,7 +329,8 @@ def create_address(interface, device, subnet_id):
     }
 
     try:
-        response = requests.post(
+        response = http_utils.request(
+            'ipam', 'POST',
             c.IPAM_URL+c.IPAM_ADDRESSES,
             headers=headers, 
             verify=True,
@@ -238,20 +344,18 @@ def create_address(interface, device, subnet_id):
     #   pass
     else:
         if response.status_code == 201:
-            print(f"{response.json()['message']} with id: {response.json()['id']}\n")
+            log.debug(f"{response.json()['message']} with id: {response.json()['id']}")
             return response.json()['id']
         else:
-            print('Failed:')
-            print(response.content)
-            print('Parameters:')
-            print(params)
-            print(f'subnetId: {subnet_id}')
-            exit() 
+            log.error(f'Failed: {response.content}')
+            log.error(f'Parameters: {params}')
+            log.error(f'subnetId: {subnet_id}')
+            return None
 
 
 def update_address(updated_address):
-    """Updates an existing address object in the IPAM-database"""
-    print(f"Updating address entry {updated_address['id']}...")
+    """Updates an existing address object in the IPAM-database, returns True if it was updated"""
+    log.debug(f"Updating address entry {updated_address['id']}...")
     headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
     params = {}
 
@@ -269,7 +373,8 @@ def update_address(updated_address):
         params['custom_Device_Serial'] = updated_address['new-device-serial']
 
     try:
-        response = requests.patch(
+        response = http_utils.request(
+            'ipam', 'PATCH',
             c.IPAM_URL+c.IPAM_ADDRESSES+str(updated_address['id'])+'/',
             headers=headers, 
             verify=True,
@@ -283,12 +388,35 @@ def update_address(updated_address):
     #    pass
     else:
         if response.json()['message'] == 'Address updated':
-            print(f"{response.json()['message']}\n")
-            return
+            log.debug(response.json()['message'])
+            return True
         else:
-            print("Update failed:")
-            print(response.content)
-            exit()
+            log.error(f'Update failed: {response.content}')
+            return False
+
+
+def delete_address(address_id):
+    """Deletes an address object from the IPAM-database, returns True if it was deleted"""
+    log.debug(f'Deleting address entry {address_id}...')
+    headers = {'token': c.IPAM_API_KEY, 'Content-Type': 'application/json'}
+
+    try:
+        response = http_utils.request(
+            'ipam', 'DELETE',
+            c.IPAM_URL+c.IPAM_ADDRESSES+str(address_id)+'/',
+            headers=headers,
+            verify=True
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    else:
+        if response.status_code == 200:
+            log.debug(response.json()['message'])
+            return True
+        log.error(f'Delete failed for address {address_id}: {response.content}')
+        return False
 
 
 def main():
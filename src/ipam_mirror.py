@@ -0,0 +1,332 @@
+from src import ipam_api
+from src import constants as c
+from src import log_utils
+
+import os
+import json
+import time
+import bisect
+import sqlite3
+import ipaddress
+
+
+log = log_utils.get_logger('ipam_mirror')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subnets (
+    id INTEGER PRIMARY KEY,
+    subnet TEXT NOT NULL,
+    mask TEXT NOT NULL,
+    network_int INTEGER NOT NULL,
+    edit_date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subnets_cidr ON subnets (subnet, mask);
+CREATE INDEX IF NOT EXISTS idx_subnets_network ON subnets (network_int);
+
+CREATE TABLE IF NOT EXISTS addresses (
+    id INTEGER PRIMARY KEY,
+    subnet_id INTEGER,
+    ip TEXT NOT NULL,
+    ip_int INTEGER NOT NULL,
+    edit_date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_addresses_ip ON addresses (ip_int);
+CREATE INDEX IF NOT EXISTS idx_addresses_subnet ON addresses (subnet_id);
+
+CREATE TABLE IF NOT EXISTS vrfs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS custom_fields (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Rows written by AutoIpam itself get this edit date so the next refresh replaces them with the authoritative IPAM row
+LOCAL_EDIT_DATE = ''
+
+
+def ip_to_int(ip_address):
+    """Converts an ip-address string to its integer representation"""
+    return int(ipaddress.IPv4Address(ip_address))
+
+
+def find_touched_subnets(subnets, ip_addresses):
+    """Returns the ids of the IPAM subnets containing any of the ip-addresses, invalid addresses are skipped"""
+    ip_ints = set()
+    for ip_address in ip_addresses:
+        try:
+            ip_ints.add(ip_to_int(ip_address))
+        except (ValueError, TypeError):
+            continue
+    ip_ints = sorted(ip_ints)
+
+    touched = set()
+    for subnet in subnets:
+        network = ip_to_int(subnet['subnet'])
+        index = bisect.bisect_left(ip_ints, network)
+        if index < len(ip_ints) and ip_ints[index] < network + (1 << (32 - int(subnet['mask']))):
+            touched.add(int(subnet['id']))
+    return touched
+
+
+class IpamMirror:
+    """Local SQLite copy of the IPAM section.\n
+    Exposes the same lookup and write functions as ipam_api, so it can be used in its place.\n
+    Lookups are served from the database, writes are sent to the live API and recorded locally."""
+
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(c.MIRROR_PATH, exist_ok=True)
+            path = c.MIRROR_PATH+c.MIRROR_FILE_NAME
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """Closes the database connection"""
+        self.db.close()
+
+    #---------- Refresh ----------
+
+    def last_refresh(self):
+        """Returns the unix time of the last refresh that requested every address, or None if the mirror has never been refreshed.\n
+        Refreshes limited to the subnets of a run leave it unchanged, as the other subnets were not refreshed."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_refresh'").fetchone()
+        if row is None:
+            return None
+        return float(row['value'])
+
+    def needs_full_refresh(self):
+        """Checks if the next refresh has to request every address, as the last full refresh is older than MIRROR_FULL_REFRESH_MAX_AGE"""
+        return self.is_stale(c.MIRROR_FULL_REFRESH_MAX_AGE)
+
+    def is_stale(self, max_age):
+        """Checks if the whole mirror is older than max_age seconds.\n
+        A stale mirror is refreshed by every run opening it, limited to the subnets of the run until it needs a full refresh."""
+        last_refresh = self.last_refresh()
+        if last_refresh is None:
+            return True
+        return time.time() - last_refresh > max_age
+
+    def refresh(self, ip_addresses=None):
+        """Incrementally refreshes the mirror from the IPAM database.\n
+        The subnets of the section are always requested. With ip_addresses only the addresses of the subnets containing them
+        are requested, unless the last full refresh is older than MIRROR_FULL_REFRESH_MAX_AGE or more than
+        MIRROR_TOUCHED_MAX_SUBNETS subnets are touched, then every address is.
+        Only rows with a changed edit timestamp are rewritten, rows no longer present in IPAM are removed."""
+        log.info('Refreshing local IPAM mirror...')
+        subnets = ipam_api.get_section_subnets(c.SECTION_ID)
+        touched = None
+        if ip_addresses is not None and not self.needs_full_refresh():
+            touched = find_touched_subnets(subnets, ip_addresses)
+            if len(touched) > c.MIRROR_TOUCHED_MAX_SUBNETS:
+                touched = None
+        if touched is None:
+            subnet_ids = {str(subnet['id']) for subnet in subnets}
+            addresses = [address for address in ipam_api.get_all_addresses() if str(address['subnetId']) in subnet_ids]
+        else:
+            addresses = [address for subnet_id in sorted(touched) for address in ipam_api.get_subnet_addresses(subnet_id)]
+        vrfs = ipam_api.get_vrfs()
+        custom_fields = ipam_api.get_custom_fields().json().get('data') or {}
+
+        with self.db:
+            changed_subnets = self._sync_rows('subnets', subnets, self._subnet_row)
+            changed_addresses = self._sync_rows('addresses', addresses, self._address_row, touched)
+            # Addresses of removed subnets are gone from IPAM as well, also when their subnet was not touched
+            changed_addresses += self.db.execute('DELETE FROM addresses WHERE subnet_id NOT IN (SELECT id FROM subnets)').rowcount
+
+            self.db.execute('DELETE FROM vrfs')
+            self.db.executemany(
+                'INSERT INTO vrfs (id, name, data) VALUES (?, ?, ?)',
+                [(int(vrf['vrfId']), vrf['name'], json.dumps(vrf)) for vrf in vrfs]
+            )
+            self.db.execute('DELETE FROM custom_fields')
+            self.db.executemany(
+                'INSERT INTO custom_fields (name, data) VALUES (?, ?)',
+                [(name, json.dumps(field)) for name, field in custom_fields.items()]
+            )
+            if touched is None:
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_refresh', ?)", (str(time.time()),))
+
+        scope = 'every subnet' if touched is None else f'{len(touched)} touched subnets'
+        log.info(f'Mirror refreshed from {scope}: {changed_subnets} subnets and {changed_addresses} addresses changed')
+
+    def _sync_rows(self, table, live_rows, to_row, subnet_ids=None):
+        """Upserts rows whose edit timestamp differs from the stored one and deletes rows missing from IPAM.\n
+        With subnet_ids the live addresses only cover those subnets, so only stored addresses in them can be missing."""
+        if subnet_ids is None:
+            stored = dict(self.db.execute(f'SELECT id, edit_date FROM {table}').fetchall())
+        else:
+            rows = self.db.execute(f'SELECT id, edit_date, subnet_id FROM {table}').fetchall()
+            stored = {row['id']: row['edit_date'] for row in rows if row['subnet_id'] in subnet_ids}
+        live_ids = set()
+        changed = []
+        for live_row in live_rows:
+            row = to_row(live_row)
+            live_ids.add(row[0])
+            if row[0] not in stored or stored[row[0]] != live_row.get('editDate'):
+                changed.append(row)
+
+        removed = [(row_id,) for row_id in stored if row_id not in live_ids]
+        columns = 'id, subnet, mask, network_int, edit_date, data' if table == 'subnets' else 'id, subnet_id, ip, ip_int, edit_date, data'
+        self.db.executemany(f'INSERT OR REPLACE INTO {table} ({columns}) VALUES (?, ?, ?, ?, ?, ?)', changed)
+        self.db.executemany(f'DELETE FROM {table} WHERE id = ?', removed)
+        return len(changed) + len(removed)
+
+    @staticmethod
+    def _subnet_row(subnet, edit_date=None):
+        """Converts an IPAM subnet object to a database row"""
+        return (
+            int(subnet['id']),
+            subnet['subnet'],
+            str(subnet['mask']),
+            ip_to_int(subnet['subnet']),
+            subnet.get('editDate') if edit_date is None else edit_date,
+            json.dumps(subnet)
+        )
+
+    @staticmethod
+    def _address_row(address, edit_date=None):
+        """Converts an IPAM address object to a database row"""
+        return (
+            int(address['id']),
+            int(address['subnetId']),
+            address['ip'],
+            ip_to_int(address['ip']),
+            address.get('editDate') if edit_date is None else edit_date,
+            json.dumps(address)
+        )
+
+    #---------- Lookups ----------
+
+    def get_custom_fields(self):
+        """Returns the mirrored custom fields"""
+        rows = self.db.execute('SELECT name, data FROM custom_fields').fetchall()
+        return {row['name']: json.loads(row['data']) for row in rows}
+
+    def get_subnet(self, network_address):
+        """Returns subnet information for a given network address in CIDR format"""
+        subnet, mask = network_address.split('/')
+        row = self.db.execute('SELECT id, subnet, mask FROM subnets WHERE subnet = ? AND mask = ?', (subnet, mask)).fetchone()
+        if row is None:
+            return None
+        return {'network_address': row['subnet'], 'cidr': row['mask'], 'id': row['id']}
+
+    def get_subnet_id(self, network_address):
+        """Returns the subnet id for a given network address in CIDR format"""
+        subnet = self.get_subnet(network_address)
+        if subnet is None:
+            return None
+        return subnet['id']
+
+    def get_vrf_id(self, vrf_name):
+        """Returns the vrfId for a specified VRF-name"""
+        row = self.db.execute('SELECT id FROM vrfs WHERE name = ?', (vrf_name,)).fetchone()
+        if row is None:
+            return None
+        return row['id']
+
+    def get_master_subnet(self, possible_master_subnets):
+        """Returns the most specific existing subnet out of a list of possible master subnets"""
+        existing_possible_master_subnets = [subnet for subnet in possible_master_subnets if self.get_subnet(subnet) is not None]
+        if len(existing_possible_master_subnets) == 0:
+            return None
+        return max(existing_possible_master_subnets, key=lambda x: ipaddress.ip_network(x).prefixlen)
+
+    def get_address(self, network_address):
+        """Returns address data for a given ip-address in the same format as the IPAM search endpoint"""
+        rows = self.db.execute('SELECT data FROM addresses WHERE ip_int = ?', (ip_to_int(network_address),)).fetchall()
+        if len(rows) == 0:
+            return False
+        return {'success': True, 'data': [json.loads(row['data']) for row in rows]}
+
+    #---------- Writes ----------
+
+    def create_subnet(self, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id=None):
+        """Creates a new subnet in the IPAM database and records it in the mirror"""
+        data = ipam_api.create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id)
+        if data['id'] is not None:
+            subnet = {
+                'id': data['id'],
+                'subnet': network_address,
+                'mask': str(cidr),
+                'sectionId': section_id,
+                'description': subnet_description if subnet_description not in ('', None) else 'Created by AutoIpam',
+                'vrfId': vrf_id,
+                'masterSubnetId': master_subnet_id
+            }
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO subnets (id, subnet, mask, network_int, edit_date, data) VALUES (?, ?, ?, ?, ?, ?)',
+                    self._subnet_row(subnet, LOCAL_EDIT_DATE)
+                )
+        return data
+
+    def create_address(self, interface, device, subnet_id):
+        """Creates a new address in the IPAM database and records it in the mirror, returns None if it could not be created"""
+        address_id = ipam_api.create_address(interface, device, subnet_id)
+        if address_id is None:
+            return None
+        address = {
+            'id': address_id,
+            'subnetId': subnet_id,
+            'ip': interface['ipv4Address'],
+            'description': interface['description'],
+            'hostname': device['hostname'],
+            'is_gateway': interface['is-gateway'],
+            'owner': device['owner'],
+            'note': 'Created by AutoIpam',
+            'mac': interface['mac'],
+            'custom_Device_Serial': device['serial']
+        }
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO addresses (id, subnet_id, ip, ip_int, edit_date, data) VALUES (?, ?, ?, ?, ?, ?)',
+                self._address_row(address, LOCAL_EDIT_DATE)
+            )
+        return address_id
+
+    def update_address(self, updated_address):
+        """Updates an existing address in the IPAM database and records the change in the mirror, returns True if it was updated"""
+        if not ipam_api.update_address(updated_address):
+            return False
+        row = self.db.execute('SELECT data FROM addresses WHERE id = ?', (int(updated_address['id']),)).fetchone()
+        if row is None:
+            return True
+        address = json.loads(row['data'])
+        fields = {
+            'new-hostname': 'hostname',
+            'new-description': 'description',
+            'new-is_gateway': 'is_gateway',
+            'new-owner': 'owner',
+            'new-mac': 'mac',
+            'new-device-serial': 'custom_Device_Serial'
+        }
+        for key, field in fields.items():
+            if key in updated_address:
+                address[field] = updated_address[key]
+        with self.db:
+            self.db.execute('UPDATE addresses SET edit_date = ?, data = ? WHERE id = ?', (LOCAL_EDIT_DATE, json.dumps(address), int(updated_address['id'])))
+        return True
+
+
+def open_mirror(max_age, ip_addresses=None):
+    """Opens the local IPAM mirror and refreshes it if it is older than max_age seconds.\n
+    ip_addresses limits the refresh to the subnets containing them, see IpamMirror.refresh."""
+    mirror = IpamMirror()
+    if mirror.is_stale(max_age):
+        mirror.refresh(ip_addresses)
+    return mirror
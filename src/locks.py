@@ -0,0 +1,124 @@
+from src import constants as c
+
+import os
+import time
+import socket
+import sqlite3
+import ipaddress
+import threading
+from contextlib import contextmanager, ExitStack
+
+
+class LockTimeout(Exception):
+    """Raised when a lock could not be acquired within the timeout"""
+    pass
+
+
+class SqliteLockService:
+    """Named locks stored in a SQLite file, shared by all processes on the host.\n
+    Locks held longer than the TTL are considered abandoned by a crashed worker and are taken over."""
+
+    shared_between_hosts = False        # Lock services reachable from every host of a --node sync set this to True
+
+    def __init__(self, path=None, ttl=None):
+        if path is None:
+            os.makedirs(c.MIRROR_PATH, exist_ok=True)
+            path = c.MIRROR_PATH+c.LOCK_FILE_NAME
+        self.ttl = c.LOCK_TTL if ttl is None else ttl
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, acquired REAL NOT NULL)')
+        self.db_lock = threading.Lock()
+
+    @staticmethod
+    def owner():
+        """Returns an identifier for the current host, process and thread"""
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+    def try_acquire(self, name):
+        """Tries to acquire a lock once, returns True on success"""
+        now = time.time()
+        with self.db_lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute('DELETE FROM locks WHERE name = ? AND acquired < ?', (name, now - self.ttl))
+                cursor = self.db.execute('INSERT OR IGNORE INTO locks (name, owner, acquired) VALUES (?, ?, ?)', (name, self.owner(), now))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return cursor.rowcount == 1
+
+    def acquire(self, name, timeout=None):
+        """Waits until a lock is acquired, raises LockTimeout after timeout seconds"""
+        timeout = c.LOCK_TIMEOUT if timeout is None else timeout
+        give_up = time.monotonic() + timeout
+        delay = 0.05
+        while not self.try_acquire(name):
+            if time.monotonic() >= give_up:
+                raise LockTimeout(f'Timed out waiting for lock {name}')
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+
+    def release(self, name):
+        """Releases a lock held by the current owner"""
+        with self.db_lock:
+            self.db.execute('DELETE FROM locks WHERE name = ? AND owner = ?', (name, self.owner()))
+
+    @contextmanager
+    def lock(self, name, timeout=None):
+        """Holds a lock for the duration of a with-block"""
+        self.acquire(name, timeout)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+
+# Available lock services, other implementations (e.g. for locks shared between hosts) can be added with register_lock_service
+LOCK_SERVICES = {
+    'sqlite': SqliteLockService
+}
+
+_lock_service = None
+_lock_service_pid = None
+
+
+def register_lock_service(name, lock_service_class):
+    """Registers a lock service class, which must implement acquire, release and lock like SqliteLockService,
+    and set shared_between_hosts if its locks are seen by every host"""
+    LOCK_SERVICES[name] = lock_service_class
+
+
+def get_lock_service():
+    """Returns the lock service configured in constants.py, one instance per process"""
+    global _lock_service, _lock_service_pid
+    # A database connection inherited from a parent process must not be reused
+    if _lock_service is None or _lock_service_pid != os.getpid():
+        _lock_service = LOCK_SERVICES[c.LOCK_SERVICE]()
+        _lock_service_pid = os.getpid()
+    return _lock_service
+
+
+def is_shared_between_hosts():
+    """Checks if the configured lock service protects subnet creation across hosts, as needed by --node"""
+    return getattr(LOCK_SERVICES[c.LOCK_SERVICE], 'shared_between_hosts', False)
+
+
+def subnet_lock_keys(subnet):
+    """Returns the lock names for a subnet, sorted so every holder acquires them in the same order.\n
+    Subnets are locked on their supernet at SUBNET_LOCK_PREFIX, so creating a subnet and creating its master can not happen
+    at the same time. Subnets shorter than SUBNET_LOCK_PREFIX lock every network of that length they contain, which
+    validation bounds by rejecting prefixes shorter than VALIDATION_MIN_PREFIX."""
+    network = ipaddress.ip_network(subnet, strict=False)
+    if network.prefixlen >= c.SUBNET_LOCK_PREFIX:
+        return [f'subnet:{network.supernet(new_prefix=c.SUBNET_LOCK_PREFIX)}']
+    return [f'subnet:{lock_network}' for lock_network in network.subnets(new_prefix=c.SUBNET_LOCK_PREFIX)]
+
+
+@contextmanager
+def hold_all(lock_service, names):
+    """Holds several locks for the duration of a with-block, acquired in the given order"""
+    with ExitStack() as stack:
+        for name in names:
+            stack.enter_context(lock_service.lock(name))
+        yield
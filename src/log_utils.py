@@ -0,0 +1,107 @@
+from src import constants as c
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+
+# Attributes every log record has, anything else was passed with extra= and is included in json logs
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_listener = None
+_listener_pid = None
+
+
+def get_logger(name):
+    """Returns the logger for a module, e.g. get_logger('ipam_api') -> autoipam.ipam_api"""
+    return logging.getLogger(f'autoipam.{name}')
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Shows info messages as plain text and prefixes warnings and errors with their level"""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            return f'{record.levelname}: {message}'
+        if record.levelno <= logging.DEBUG:
+            return f'[{record.name.split(".")[-1]}] {message}'
+        return message
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Writes records to the console, clearing a progress line on a terminal first so it is not mixed with the message"""
+
+    def format(self, record):
+        message = super().format(record)
+        if self.stream.isatty():
+            return '\r\x1b[K'+message
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a log record as a single json object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=None, json_file=None):
+    """Configures the autoipam loggers.\n
+    Records are put on a queue by the calling thread and written by a background listener,
+    so console and file output never block the code that logs."""
+    global _listener, _listener_pid
+    level = c.LOG_LEVEL if level is None else level
+    json_file = c.LOG_JSON_FILE if json_file is None else json_file
+
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+    console_handler = ConsoleHandler(sys.stdout)
+    console_handler.setFormatter(ConsoleFormatter())
+    console_handler.setLevel(level.upper())
+    handlers = [console_handler]
+
+    if json_file is not None:
+        os.makedirs(os.path.dirname(json_file) or '.', exist_ok=True)
+        file_handler = logging.FileHandler(json_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.setLevel(logging.DEBUG)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger('autoipam')
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(logging.DEBUG if json_file is not None else level.upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """Writes all queued log records and stops the listener"""
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,256 @@
+from src import utils, log_utils
+from src import constants as c
+
+import atexit
+import ipaddress
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+log = log_utils.get_logger('normalise')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def field(*path):
+    """Takes a value from the raw interface, following the path of keys"""
+    return ('interface', path)
+
+
+def value(constant):
+    """Sets the same value for every interface"""
+    return ('value', constant)
+
+
+def computed(function):
+    """Calculates a value from the raw object and interface, function(raw_object, raw_interface)"""
+    return ('computed', function)
+
+
+# Check Point objects without comments give their interfaces no description
+OBJECT_COMMENTS = computed(lambda raw_object, raw_interface: None if raw_object['comments'] == '' else raw_object['comments'])
+INTERFACE_COMMENTS = computed(lambda raw_object, raw_interface: None if raw_object['comments'] == '' else raw_interface['comments'])
+
+# Addresses reported for interfaces without an address
+EMPTY_ADDRESSES = ('', '-', '0.0.0.0', None)
+
+
+def vmanage_address(raw_object, raw_interface):
+    """vEdge reports address/prefix in ip-address, IOS-XE edges the address only"""
+    return raw_interface.get('ip-address', '').partition('/')[0]
+
+
+def vmanage_mask(raw_object, raw_interface):
+    """vEdge reports the mask as prefix length, IOS-XE edges as mask"""
+    prefix = raw_interface.get('ip-address', '').partition('/')[2]
+    if prefix != '':
+        return str(ipaddress.ip_network(f'0.0.0.0/{prefix}').netmask)
+    return raw_interface.get('ipv4-subnet-mask')
+
+
+def vmanage_mac(raw_object, raw_interface):
+    """vManage reports - as hwaddr of interfaces without a mac address"""
+    mac = raw_interface.get('hwaddr')
+    return None if mac in ('', '-') else mac
+
+
+def checkpoint_interface(address, mask, cidr, description, subnet_name, is_gateway):
+    """Field mapping shared by the Check Point object types, which differ in key names only"""
+    return {
+        'interface-name': field('name'),
+        'description': description,
+        'ipv4Address': address,
+        'ipv4Mask': mask,
+        'cidr': cidr,
+        'subnet-name': subnet_name,
+        'subnet-description': value(''),
+        'is-gateway': value(is_gateway),
+        'mac': value(None),
+        'vlan-id': value(None)
+    }
+
+
+# Field mapping per source and object type:
+#   interfaces  path of keys to the list of interfaces in the raw object, () if the object is the interface,
+#               None if the interfaces are requested separately
+#   address     the ipv4 address, interfaces without one or with an ignored address are skipped
+#   skip        optional function(raw_interface) returning the reason an interface is skipped, or None
+#   fields      the standardized interface fields
+NORMALISERS = {
+    ('checkpoint', 'simple-cluster'): {
+        'interfaces': ('interfaces', 'objects'),
+        'address': field('ipv4-address'),
+        'fields': checkpoint_interface(
+            field('ipv4-address'), field('ipv4-network-mask'), field('ipv4-mask-length'),
+            INTERFACE_COMMENTS, field('comments'), 1
+        )
+    },
+    ('checkpoint', 'checkpoint-host'): {
+        'interfaces': ('interfaces',),
+        'address': field('subnet4'),
+        'fields': checkpoint_interface(
+            field('subnet4'), field('subnet-mask'), field('mask-length4'),
+            OBJECT_COMMENTS,
+            value(''), 0
+        )
+    },
+    ('checkpoint', 'cluster-member'): {
+        'interfaces': ('interfaces',),
+        'address': field('ipv4-address'),
+        'fields': checkpoint_interface(
+            field('ipv4-address'), field('ipv4-network-mask'), field('ipv4-mask-length'),
+            OBJECT_COMMENTS,
+            value(''), 0
+        )
+    },
+    ('checkpoint', 'simple-gateway'): {
+        'interfaces': ('interfaces',),
+        'address': field('ipv4-address'),
+        'fields': checkpoint_interface(
+            field('ipv4-address'), field('ipv4-network-mask'), field('ipv4-mask-length'),
+            OBJECT_COMMENTS,
+            value(''), 0
+        )
+    },
+    ('checkpoint', 'EthernetInterface'): {
+        'interfaces': (),
+        'address': field('ipv4-address'),
+        'fields': checkpoint_interface(
+            field('ipv4-address'), field('ipv4SubnetMask'), field('interfaces', 0, 'mask-length4'),
+            OBJECT_COMMENTS,
+            value(''), 0
+        )
+    },
+    ('dnac', 'device'): {
+        'interfaces': None,
+        'address': field('ipv4Address'),
+        'skip': lambda raw_interface: 'administratively down' if raw_interface['adminStatus'] == 'DOWN' else None,
+        'fields': {
+            'description': field('portName'),
+            'ipv4Address': field('ipv4Address'),
+            'ipv4Mask': field('ipv4Mask'),
+            'mac': field('macAddress'),
+            'vlan-id': field('vlanId'),
+            'subnet-name': value(''),
+            'subnet-description': value(''),
+            'is-gateway': value(None)
+        }
+    },
+    ('vmanage', 'edge'): {
+        'interfaces': None,
+        'address': computed(vmanage_address),
+        'skip': lambda raw_interface: (
+            'not ipv4' if raw_interface.get('af-type', 'ipv4') != 'ipv4'
+            else 'administratively down' if raw_interface.get('if-admin-status') in ('Down', 'if-state-down')
+            else None
+        ),
+        'fields': {
+            'description': field('ifname'),
+            'ipv4Address': computed(vmanage_address),
+            'ipv4Mask': computed(vmanage_mask),
+            'mac': computed(vmanage_mac),
+            'vlan-id': value(None),
+            'subnet-name': value(''),
+            'subnet-description': value(''),
+            'is-gateway': value(None)
+        }
+    }
+}
+
+
+def resolve(spec, raw_object, raw_interface):
+    """Returns the value of a field spec for a raw interface"""
+    kind, argument = spec
+    if kind == 'value':
+        return argument
+    if kind == 'computed':
+        return argument(raw_object, raw_interface)
+    data = raw_interface
+    for key in argument:
+        data = data[key]
+    return data
+
+
+def is_known(source, object_type):
+    """Checks if there is a normaliser for an object type"""
+    return (source, object_type) in NORMALISERS
+
+
+def get_raw_interfaces(normaliser, raw_object):
+    """Returns the list of raw interfaces of a raw object"""
+    if normaliser['interfaces'] == ():
+        return [raw_object]
+    raw_interfaces = raw_object
+    for key in normaliser['interfaces']:
+        raw_interfaces = raw_interfaces[key]
+    return raw_interfaces
+
+
+def normalise(source, object_type, raw_object, raw_interfaces=None):
+    """Converts the interfaces of a raw object to the standardized convention, see NORMALISERS.\n
+    raw_interfaces is given for sources that request the interfaces separately from the object.
+    Raises KeyError, IndexError or TypeError if the object is missing a field."""
+    normaliser = NORMALISERS[(source, object_type)]
+    if raw_interfaces is None:
+        raw_interfaces = get_raw_interfaces(normaliser, raw_object)
+    skip = normaliser.get('skip')
+    fields = normaliser['fields'].items()
+
+    interfaces = []
+    for raw_interface in raw_interfaces:
+        address = resolve(normaliser['address'], raw_object, raw_interface)
+        if address in EMPTY_ADDRESSES or utils.check_ip_in_ignored(address):
+            continue
+        reason = None if skip is None else skip(raw_interface)
+        if reason is not None:
+            log.debug(f'Interface with {address} {reason}, skipping..')
+            continue
+        interfaces.append({name: resolve(spec, raw_object, raw_interface) for name, spec in fields})
+    return interfaces
+
+
+def normalise_batch(source, objects):
+    """Normalises a batch of (object_type, raw_object), in a normaliser process or the calling thread.\n
+    Returns (interfaces, error) per object, so one incomplete object does not fail the whole batch."""
+    results = []
+    for object_type, raw_object in objects:
+        try:
+            results.append((normalise(source, object_type, raw_object), None))
+        except (KeyError, IndexError, TypeError) as e:
+            results.append((None, f'{type(e).__name__}: {e}'))
+    return results
+
+
+def count_interfaces(source, object_type, raw_object):
+    """Returns the number of raw interfaces of an object, 0 if it has none or is of an unknown type"""
+    normaliser = NORMALISERS.get((source, object_type))
+    if normaliser is None or normaliser['interfaces'] is None:
+        return 0
+    try:
+        return len(get_raw_interfaces(normaliser, raw_object))
+    except (KeyError, IndexError, TypeError):
+        return 0
+
+
+def get_pool():
+    """Returns the normaliser process pool, started on first use.\n
+    Processes are spawned, since forking while the source requests are running in threads is not safe."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=c.NORMALISE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def submit(source, objects, interface_count):
+    """Normalises a batch of (object_type, raw_object) and returns a future of the normalise_batch result.\n
+    Batches of at least NORMALISE_BATCH interfaces are converted in the process pool, so the calling thread
+    stays free for requests. Smaller batches, and all batches if NORMALISE_WORKERS is 0, are converted right away."""
+    if c.NORMALISE_WORKERS > 0 and interface_count >= c.NORMALISE_BATCH:
+        return get_pool().submit(normalise_batch, source, objects)
+    future = Future()
+    future.set_result(normalise_batch(source, objects))
+    return future
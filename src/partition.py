@@ -0,0 +1,73 @@
+from src import utils
+from src import constants as c
+
+import zlib
+import multiprocessing
+
+
+def stable_hash(value):
+    """Returns a hash of a string that is the same in every process and on every host"""
+    return zlib.crc32(str(value).encode())
+
+
+def calc_site(hostname):
+    """Calculates the site of a device from the first two parts of its hostname, e.g. SE-MUN-PAPER-SW01 -> SE-MUN"""
+    if hostname is None:
+        return ''
+    return '-'.join(hostname.split('-')[:2])
+
+
+def partition_key(device, interface, strategy):
+    """Returns the value that decides which partition an interface belongs to"""
+    if strategy == 'site':
+        return calc_site(device['hostname'])
+    elif strategy == 'vrf':
+        subnet = utils.calc_subnet(interface['ipv4Address'], interface['ipv4Mask'])
+        return utils.calc_vrf(subnet['network_address_full'])
+    elif strategy == 'hostname':
+        return device['hostname']
+    raise ValueError(f'Unknown partition strategy "{strategy}", available strategies: site, vrf, hostname')
+
+
+def partition_devices(devices, partitions, strategy):
+    """Splits the devices into a fixed number of partitions.\n
+    Interfaces are assigned by a stable hash of their partition key, so every process and host calculates the same partitions.
+    A device whose interfaces end up in several partitions (only possible with the vrf strategy) is split accordingly."""
+    result = [[] for _ in range(partitions)]
+    for device in devices:
+        device_parts = {}
+        for interface in device['interfaces']:
+            index = stable_hash(partition_key(device, interface, strategy)) % partitions
+            device_parts.setdefault(index, []).append(interface)
+        for index, interfaces in device_parts.items():
+            device_part = dict(device)
+            device_part['interfaces'] = interfaces
+            result[index].append(device_part)
+    return result
+
+
+def parse_node(value):
+    """Parses a node argument in the format <node>/<nodes>, e.g. 2/4, into a zero based (node, nodes) tuple"""
+    node, _, nodes = value.partition('/')
+    node, nodes = int(node), int(nodes)
+    if not 1 <= node <= nodes:
+        raise ValueError(f'Invalid node "{value}", expected <node>/<nodes> with 1 <= node <= nodes')
+    return node - 1, nodes
+
+
+def run_partitions(worker_function, partitions):
+    """Runs worker_function for every partition in a process pool.\n
+    Each worker returns its change counts and report paths, which are merged."""
+    partitions = [devices for devices in partitions if devices]
+    counts = {'updated-subnets': 0, 'updated-addresses': 0, 'conflicts': 0}
+    paths = []
+    if not partitions:
+        return counts, paths
+
+    print(f'Applying changes with {len(partitions)} worker processes, partitioned by {c.SYNC_PARTITION}\n')
+    with multiprocessing.Pool(processes=len(partitions)) as pool:
+        for worker_counts, worker_paths in pool.imap_unordered(worker_function, partitions):
+            for key, value in worker_counts.items():
+                counts[key] += value
+            paths += worker_paths
+    return counts, paths
@@ -0,0 +1,218 @@
+from src import http_utils, log_utils
+from src import prefetch, snapshot, ipam_mirror
+from src import constants as c
+
+import os
+import json
+import time
+import tempfile
+
+
+log = log_utils.get_logger('planner')
+
+
+# Bulk requests each strategy sends to load its local copy of the IPAM section
+BULK_ENDPOINTS = {
+    'live': (),
+    'prefetch': ('ipam vrf', 'ipam sections/subnets'),
+    'snapshot': ('ipam sections/subnets', 'ipam addresses', 'ipam vrf', 'ipam custom_fields'),
+    'mirror': ('ipam sections/subnets', 'ipam addresses', 'ipam vrf', 'ipam custom_fields')
+}
+
+# Requests of a mirror refresh limited to the subnets of a run, plus one 'ipam subnets/addresses' per touched subnet
+TOUCHED_ENDPOINTS = ('ipam sections/subnets', 'ipam vrf', 'ipam custom_fields')
+
+# Prefetched items loaded by the bulk requests of prefetch, in the same order
+PREFETCH_ITEMS = prefetch.IPAM_ITEMS
+
+DESCRIPTIONS = {
+    'live': 'per-address requests',
+    'prefetch': 'per-address requests, prefetched subnets and VRFs',
+    'snapshot': 'IPAM snapshot',
+    'mirror': 'IPAM mirror'
+}
+
+
+def get_history_path():
+    """Returns the path of the file with the measurements of earlier runs"""
+    return c.MIRROR_PATH+c.PLANNER_HISTORY_FILE_NAME
+
+
+def load_history():
+    """Returns the measurements of earlier runs: latency and response size per endpoint and the share of new addresses"""
+    try:
+        with open(get_history_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'endpoints': {}, 'new_share': None}
+
+
+def save_history(interfaces=None, new_addresses=None):
+    """Adds the endpoints measured in this process to the history, and the share of new addresses if interfaces is given.\n
+    The history only improves the estimates, so a history that can not be written is logged and skipped."""
+    history = load_history()
+    for key, stats in http_utils.get_endpoint_stats().items():
+        entry = history['endpoints'].setdefault(key, {})
+        entry['latency'] = stats['latency']
+        if stats['bytes'] is not None:
+            entry['bytes'] = stats['bytes']
+    if interfaces:
+        history['new_share'] = new_addresses / interfaces
+    history['updated'] = time.time()
+
+    path = get_history_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.planner-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(history, f, indent=4)
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.debug(f'Could not write planner history: {e}')
+
+
+def get_endpoint(key, history):
+    """Returns the expected (seconds, bytes) of a request, measured in this process, in earlier runs or from PLANNER_ENDPOINTS"""
+    seconds, size = c.PLANNER_ENDPOINTS[key]
+    stats = dict(history['endpoints'].get(key, {}))
+    current = http_utils.get_endpoint_stats().get(key)
+    if current is not None:
+        stats['latency'] = current['latency']
+        if current['bytes'] is not None:
+            stats['bytes'] = current['bytes']
+    return stats.get('latency', seconds), stats.get('bytes', size)
+
+
+def get_age(strategy):
+    """Returns the seconds since the local copy of a strategy was loaded, or None if there is none"""
+    if strategy == 'snapshot':
+        created = snapshot.read_created(snapshot.get_path())
+        return None if created is None else time.time() - created
+    if strategy == 'mirror':
+        if not os.path.exists(c.MIRROR_PATH+c.MIRROR_FILE_NAME):
+            return None
+        mirror = ipam_mirror.IpamMirror()
+        try:
+            last_refresh = mirror.last_refresh()
+        finally:
+            mirror.close()
+        return None if last_refresh is None else time.time() - last_refresh
+    return None
+
+
+def needs_full_mirror_refresh():
+    """Checks if a mirror refresh has to request every address, see ipam_mirror.IpamMirror.needs_full_refresh"""
+    if not os.path.exists(c.MIRROR_PATH+c.MIRROR_FILE_NAME):
+        return True
+    mirror = ipam_mirror.IpamMirror()
+    try:
+        return mirror.needs_full_refresh()
+    finally:
+        mirror.close()
+
+
+def count_networks(devices):
+    """Returns the number of /24 networks of the interface addresses, an estimate of the subnets a mirror refresh touches"""
+    return len({str(interface['ipv4Address']).rpartition('.')[0] for device in devices for interface in device['interfaces']})
+
+
+def get_bulk_endpoints(strategy, max_age, networks=None):
+    """Returns the bulk requests a strategy sends before the first lookup.\n
+    networks is the estimated number of subnets touched by the run, which a mirror refresh can be limited to."""
+    if strategy == 'prefetch':
+        return [key for key, item in zip(BULK_ENDPOINTS['prefetch'], PREFETCH_ITEMS) if not prefetch.is_fresh(item, max_age)]
+    if strategy in ('snapshot', 'mirror'):
+        age = get_age(strategy)
+        if age is not None and age <= max_age:
+            return []
+    if strategy == 'mirror' and networks is not None and networks <= c.MIRROR_TOUCHED_MAX_SUBNETS and not needs_full_mirror_refresh():
+        return list(TOUCHED_ENDPOINTS) + ['ipam subnets/addresses'] * networks
+    return list(BULK_ENDPOINTS[strategy])
+
+
+def get_configured_strategy():
+    """Returns the strategy set in constants.py, the mirror, snapshot, prefetch or live API in that order if it is auto"""
+    if c.IPAM_LOOKUP_STRATEGY != 'auto':
+        return c.IPAM_LOOKUP_STRATEGY
+    if c.IPAM_MIRROR_ENABLED:
+        return 'mirror'
+    if c.IPAM_SNAPSHOT_ENABLED:
+        return 'snapshot'
+    if c.PREFETCH_ENABLED:
+        return 'prefetch'
+    return 'live'
+
+
+def get_candidates():
+    """Returns the strategies to choose from, a single one if the strategy is fixed in constants.py"""
+    if c.IPAM_LOOKUP_STRATEGY != 'auto' or c.IPAM_MIRROR_ENABLED or c.IPAM_SNAPSHOT_ENABLED:
+        return [get_configured_strategy()]
+    return [strategy for strategy in c.PLANNER_STRATEGIES if strategy != 'prefetch' or c.PREFETCH_ENABLED]
+
+
+def estimate(strategy, interfaces, new_addresses, max_age, workers, history, networks=None):
+    """Estimates the IPAM requests, response bytes and seconds a strategy needs for the lookups of a run.\n
+    Every interface is searched by address with live and prefetch, and every new address also needs a subnet lookup,
+    plus a VRF lookup with live. prefetch requests the subnets and VRFs once, snapshot and mirror the whole section,
+    unless their copy is younger than max_age. A mirror refreshed in full within MIRROR_FULL_REFRESH_MAX_AGE only
+    requests the addresses of the networks of the run.
+    Per-address requests are divided over the worker processes, writes are the same for every strategy and left out."""
+    lookup_seconds, lookup_bytes = get_endpoint('ipam addresses/search', history)
+    item_calls, item_bytes, item_seconds = 0, 0, 0
+    if strategy in ('live', 'prefetch'):
+        item_calls, item_bytes, item_seconds = interfaces, interfaces * lookup_bytes, interfaces * lookup_seconds
+        per_new = ('ipam subnets/cidr', 'ipam vrf') if strategy == 'live' else ()
+        for key in per_new:
+            seconds, size = get_endpoint(key, history)
+            item_calls += new_addresses
+            item_bytes += new_addresses * size
+            item_seconds += new_addresses * seconds
+
+    bulk = [get_endpoint(key, history) for key in get_bulk_endpoints(strategy, max_age, networks)]
+    bulk_bytes = sum(size for _, size in bulk)
+    bulk_seconds = sum(seconds for seconds, _ in bulk)
+    if bulk_bytes:
+        bulk_seconds += bulk_bytes / c.PLANNER_DECODE_RATES[strategy]
+
+    return {
+        'strategy': strategy,
+        'calls': round(item_calls) + len(bulk),
+        'bytes': round(item_bytes + bulk_bytes),
+        'seconds': item_seconds / max(workers, 1) + bulk_seconds
+    }
+
+
+def choose(devices, max_age, workers=1):
+    """Estimates every candidate strategy for the interfaces of a run and returns the plan with the cheapest one.\n
+    max_age is the age up to which prefetched data, an existing snapshot or mirror is reused, 0 for update.
+    workers is the number of processes sharing the per-address requests."""
+    history = load_history()
+    interfaces = sum(len(device['interfaces']) for device in devices)
+    new_share = history.get('new_share')
+    if new_share is None:
+        new_share = c.PLANNER_NEW_SHARE
+    new_addresses = interfaces * new_share
+    networks = count_networks(devices)
+
+    candidates = get_candidates()
+    estimates = [estimate(strategy, interfaces, new_addresses, max_age, workers, history, networks) for strategy in candidates]
+    # Ties go to the strategy listed first in PLANNER_STRATEGIES
+    chosen = min(estimates, key=lambda entry: entry['seconds'])
+    return {
+        'strategy': chosen['strategy'],
+        'configured': len(candidates) == 1,
+        'interfaces': interfaces,
+        'new_addresses': round(new_addresses),
+        'estimates': estimates
+    }
+
+
+def show_plan(plan):
+    """Prints the estimate of every candidate strategy and the chosen one"""
+    print(f"\nIPAM lookup plan for {plan['interfaces']} interfaces, about {plan['new_addresses']} new:")
+    for entry in plan['estimates']:
+        marker = '*' if entry['strategy'] == plan['strategy'] else ' '
+        print(f"  {marker} {entry['strategy']:10} {entry['calls']:>8} requests {entry['bytes'] / 1024 / 1024:>9.1f} MB {entry['seconds']:>9.1f}s")
+    reason = 'set in constants.py' if plan['configured'] else 'lowest estimate'
+    print(f"Using {DESCRIPTIONS[plan['strategy']]} ({reason})\n")
+    log.info(f"IPAM lookup strategy: {plan['strategy']}", extra={'plan': plan})
@@ -0,0 +1,168 @@
+from src import ipam_api, checkpoint_api
+from src import credentials
+from src import constants as c
+
+import os
+import time
+import threading
+
+
+def _load_subnet_index():
+    """Returns all subnets in the IPAM section indexed by network address in CIDR format"""
+    subnets = ipam_api.get_section_subnets(c.SECTION_ID)
+    return {f"{subnet['subnet']}/{subnet['mask']}": subnet for subnet in subnets}
+
+
+# Data warmed in the background while the CLI waits for input, in the order it is loaded
+PREFETCH_ITEMS = {
+    'dnac_token': lambda: credentials.get_credential('dnac'),
+    'checkpoint_sid': lambda: credentials.get_credential('checkpoint'),
+    'ipam_vrfs': lambda: ipam_api.get_vrfs(),
+    'ipam_subnets': _load_subnet_index,
+    'checkpoint_gateways': lambda: credentials.call('checkpoint', checkpoint_api.get_device_list)
+}
+
+_entries = {}       # {name: {'timestamp': unix time, 'value': data}}
+_loading = {}       # {name: threading.Event}, set when a running load has finished
+_lock = threading.Lock()
+_thread = None
+
+
+def _reset_after_fork():
+    """Forked worker processes keep the prefetched data, but not the prefetch thread or loads running in other threads"""
+    global _lock, _thread
+    _lock = threading.Lock()
+    _loading.clear()
+    _thread = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _load(name):
+    """Loads an item, or waits for a load of the same item that is already running"""
+    with _lock:
+        event = _loading.get(name)
+        owner = event is None
+        if owner:
+            event = threading.Event()
+            _loading[name] = event
+
+    if not owner:
+        event.wait()
+        return
+
+    try:
+        value = PREFETCH_ITEMS[name]()
+        with _lock:
+            _entries[name] = {'timestamp': time.time(), 'value': value}
+    finally:
+        with _lock:
+            del _loading[name]
+        event.set()
+
+
+def get_age(name):
+    """Returns the seconds since an item was loaded, or None if it has not been loaded"""
+    entry = _entries.get(name)
+    if entry is None:
+        return None
+    return time.time() - entry['timestamp']
+
+
+def is_fresh(name, max_age=None):
+    """Checks if an item has been loaded within the max age configured in constants.py, and within max_age if given"""
+    age = get_age(name)
+    if age is None or age >= c.PREFETCH_MAX_AGE:
+        return False
+    return max_age is None or age <= max_age
+
+
+def get(name):
+    """Returns prefetched data, loading it in the calling thread if it is missing or stale"""
+    if not is_fresh(name):
+        _load(name)
+    if not is_fresh(name):
+        # The load this call waited on failed in the background, retry and let errors reach the caller
+        _load(name)
+    return _entries[name]['value']
+
+
+def _worker():
+    """Keeps all prefetched items fresh for as long as the CLI is running"""
+    while True:
+        for name in PREFETCH_ITEMS:
+            if is_fresh(name):
+                continue
+            try:
+                _load(name)
+            except Exception:
+                # Sources that are unreachable or not configured are simply not warmed
+                pass
+        time.sleep(c.PREFETCH_INTERVAL)
+
+
+def start():
+    """Starts warming caches in a background thread"""
+    global _thread
+    if not c.PREFETCH_ENABLED or _thread is not None:
+        return
+    _thread = threading.Thread(target=_worker, name='autoipam-prefetch', daemon=True)
+    _thread.start()
+
+
+# Prefetched items PrefetchedIpam serves lookups from
+IPAM_ITEMS = ('ipam_vrfs', 'ipam_subnets')
+
+
+class PrefetchedIpam:
+    """Serves VRF and subnet lookups from the prefetched IPAM data and delegates everything else to ipam_api.\n
+    Subnets missing from the snapshot are looked up live, subnets created during the run are added to it.
+    Items older than max_age are reloaded when the view is opened, e.g. max_age 0 for update."""
+
+    def __init__(self, ipam=ipam_api, max_age=None):
+        self.ipam = ipam
+        for name in IPAM_ITEMS:
+            if not is_fresh(name, max_age):
+                _load(name)
+
+    def __getattr__(self, name):
+        return getattr(self.ipam, name)
+
+    def get_vrf_id(self, vrf_name):
+        """Returns the vrfId for a specified VRF-name"""
+        for vrf in get('ipam_vrfs'):
+            if vrf['name'] == vrf_name:
+                return vrf['vrfId']
+        return None
+
+    def get_subnet(self, network_address):
+        """Returns subnet information for a given network address in CIDR format"""
+        subnet = get('ipam_subnets').get(network_address)
+        if subnet is None:
+            return self.ipam.get_subnet(network_address)
+        return {'network_address': subnet['subnet'], 'cidr': subnet['mask'], 'id': subnet['id']}
+
+    def get_subnet_id(self, network_address):
+        """Returns the subnet id for a given network address in CIDR format"""
+        subnet = get('ipam_subnets').get(network_address)
+        if subnet is None:
+            return self.ipam.get_subnet_id(network_address)
+        return subnet['id']
+
+    def get_master_subnet(self, possible_master_subnets):
+        """Returns the most specific existing subnet in the section out of a list of possible master subnets"""
+        subnet_index = get('ipam_subnets')
+        existing_possible_master_subnets = [subnet for subnet in possible_master_subnets if subnet in subnet_index]
+        if len(existing_possible_master_subnets) == 0:
+            return None
+        return max(existing_possible_master_subnets, key=lambda x: int(x.split('/')[1]))
+
+    def create_subnet(self, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id=None):
+        """Creates a new subnet in the IPAM database and adds it to the prefetched snapshot"""
+        data = self.ipam.create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id)
+        if data['id'] is not None and section_id == c.SECTION_ID:
+            subnet_index = get('ipam_subnets')
+            with _lock:
+                subnet_index[f'{network_address}/{cidr}'] = {'id': data['id'], 'subnet': network_address, 'mask': str(cidr)}
+        return data
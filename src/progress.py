@@ -0,0 +1,234 @@
+from src import log_utils
+from src import constants as c
+
+import sys
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+
+log = log_utils.get_logger('progress')
+
+# Stages of a sync in the order they are shown
+STAGES = {
+    'devices': 'devices fetched',
+    'interfaces': 'interfaces normalised',
+    'lookups': 'IPAM lookups',
+    'writes': 'writes applied'
+}
+
+# Progress of every running sync by label, read by the daemon status endpoint
+_active = {}
+_active_lock = threading.Lock()
+
+# The progress of the sync running in the current thread
+_state = threading.local()
+
+
+class Stage:
+    """Counters for a single stage of a sync"""
+
+    def __init__(self):
+        self.total = None
+        self.done = 0
+        self.errors = 0
+        self.started = None
+        self.last = None
+
+    def rate(self):
+        """Returns the number of items per second since the first item"""
+        if self.started is None or self.last is None or self.last <= self.started:
+            return None
+        return self.done / (self.last - self.started)
+
+    def eta(self):
+        """Returns the estimated seconds until all items are done, or None if the total or rate is unknown"""
+        rate = self.rate()
+        if self.total is None or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def snapshot(self):
+        """Returns the counters as a dictionary"""
+        rate = self.rate()
+        eta = self.eta()
+        return {
+            'done': self.done,
+            'total': self.total,
+            'errors': self.errors,
+            'rate': None if rate is None else round(rate, 1),
+            'eta': None if eta is None else round(eta)
+        }
+
+
+class Progress:
+    """Tracks the progress of a sync per stage.\n
+    In interactive mode the progress is rendered on a single refreshing terminal line,
+    otherwise it is logged as a structured event every PROGRESS_EVENT_INTERVAL seconds.\n
+    The display starts with the first counted item, so prompts before that are not overwritten."""
+
+    def __init__(self, label, interactive=None):
+        self.label = label
+        self.interactive = sys.stdout.isatty() if interactive is None else interactive
+        self.interval = c.PROGRESS_REFRESH if self.interactive else c.PROGRESS_EVENT_INTERVAL
+        self.stages = {stage: Stage() for stage in STAGES}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.display = None
+
+    def _update(self, stage, done=0, errors=0):
+        """Adds to the counters of a stage and starts the display if needed"""
+        now = time.monotonic()
+        with self.lock:
+            counters = self.stages[stage]
+            if counters.started is None:
+                counters.started = now
+            counters.done += done
+            counters.errors += errors
+            counters.last = now
+            if self.display is None and not self.stopped.is_set():
+                self.display = threading.Thread(target=self._display, name='autoipam-progress', daemon=True)
+                self.display.start()
+
+    def set_total(self, stage, total):
+        """Sets the number of items expected in a stage"""
+        with self.lock:
+            self.stages[stage].total = total
+
+    def add_total(self, stage, count):
+        """Adds to the number of items expected in a stage, for totals that are only known per page"""
+        with self.lock:
+            counters = self.stages[stage]
+            counters.total = (counters.total or 0) + count
+
+    def advance(self, stage, count=1):
+        """Marks items of a stage as done"""
+        self._update(stage, done=count)
+
+    def error(self, stage, count=1):
+        """Counts failed items of a stage"""
+        self._update(stage, errors=count)
+
+    def snapshot(self):
+        """Returns the progress of every started stage"""
+        with self.lock:
+            return {
+                'label': self.label,
+                'elapsed': round(time.monotonic() - self.started, 1),
+                'stages': {stage: counters.snapshot() for stage, counters in self.stages.items() if counters.started is not None}
+            }
+
+    def format(self, snapshot=None):
+        """Formats the progress as a single line, e.g.\n
+        update: devices fetched 120/450 12.3/s ETA 27s | IPAM lookups 300/800 50.0/s ETA 10s | errors 1"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        parts = []
+        errors = 0
+        for stage, counters in snapshot['stages'].items():
+            part = f"{STAGES[stage]} {counters['done']}"
+            if counters['total'] is not None:
+                part += f"/{counters['total']}"
+            if counters['rate'] is not None:
+                part += f" {counters['rate']}/s"
+            if counters['eta'] is not None:
+                part += f" ETA {counters['eta']}s"
+            parts.append(part)
+            errors += counters['errors']
+        if errors:
+            parts.append(f'errors {errors}')
+        return f"{self.label}: {' | '.join(parts)}"
+
+    def _render(self):
+        """Renders the progress once, on the terminal line or as a log event"""
+        snapshot = self.snapshot()
+        if self.interactive:
+            line = self.format(snapshot)
+            # Cut to the terminal width, so the line never wraps and can be overwritten
+            width = shutil.get_terminal_size().columns - 1
+            sys.stdout.write('\r\x1b[K'+line[:width])
+            sys.stdout.flush()
+        else:
+            log.info(self.format(snapshot), extra={'progress': snapshot})
+
+    def _display(self):
+        """Renders the progress every interval until stopped"""
+        while not self.stopped.wait(self.interval):
+            self._render()
+
+    def stop(self):
+        """Stops the display and shows the final progress, only once"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.display is None:
+            return
+        self.display.join()
+        self._render()
+        if self.interactive:
+            sys.stdout.write('\n\n')
+            sys.stdout.flush()
+
+
+def current():
+    """Returns the progress of the sync running in the current thread, or None"""
+    return getattr(_state, 'progress', None)
+
+
+@contextmanager
+def track(label, interactive=None):
+    """Tracks the progress of a sync in the current thread for the duration of a with-block"""
+    progress = Progress(label, interactive)
+    _state.progress = progress
+    with _active_lock:
+        _active[label] = progress
+    try:
+        yield progress
+    finally:
+        progress.stop()
+        _state.progress = None
+        with _active_lock:
+            _active.pop(label, None)
+
+
+def set_total(stage, total):
+    """Sets the number of items expected in a stage of the current sync, if it is tracked"""
+    progress = current()
+    if progress is not None:
+        progress.set_total(stage, total)
+
+
+def add_total(stage, count):
+    """Adds to the number of items expected in a stage of the current sync, if it is tracked"""
+    progress = current()
+    if progress is not None:
+        progress.add_total(stage, count)
+
+
+def advance(stage, count=1):
+    """Marks items of a stage of the current sync as done, if it is tracked"""
+    progress = current()
+    if progress is not None:
+        progress.advance(stage, count)
+
+
+def error(stage, count=1):
+    """Counts failed items of a stage of the current sync, if it is tracked"""
+    progress = current()
+    if progress is not None:
+        progress.error(stage, count)
+
+
+def finish():
+    """Stops the display of the current sync, so results can be printed below it"""
+    progress = current()
+    if progress is not None:
+        progress.stop()
+
+
+def snapshot_all():
+    """Returns the progress of every running sync, for the daemon status"""
+    with _active_lock:
+        return [progress.snapshot() for progress in _active.values()]
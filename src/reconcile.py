@@ -0,0 +1,121 @@
+from src import ipam_api, http_utils, log_utils, progress
+from src import constants as c
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = log_utils.get_logger('reconcile')
+
+AUTOIPAM_NOTE = 'Created by AutoIpam'
+
+RECONCILE_REPORT_FIELDS = [
+    'id',
+    'action',
+    'ip',
+    'subnet',
+    'hostname',
+    'description',
+    'owner',
+    'mac',
+    'note',
+    'editDate'
+]
+
+
+class ThresholdExceeded(Exception):
+    """Raised when more stale addresses are found than the safety threshold allows to delete"""
+    pass
+
+
+def get_snapshot():
+    """Returns all subnets and addresses in the IPAM section, requested with two calls"""
+    subnets = ipam_api.get_section_subnets(c.SECTION_ID)
+    subnet_ids = {str(subnet['id']) for subnet in subnets}
+    addresses = [address for address in ipam_api.get_all_addresses() if str(address['subnetId']) in subnet_ids]
+    return subnets, addresses
+
+
+def get_owned_addresses(subnets, addresses):
+    """Returns the addresses AutoIpam is responsible for.\n
+    These are all addresses in subnets created by AutoIpam, and addresses created by AutoIpam in any other subnet."""
+    owned_subnet_ids = {str(subnet['id']) for subnet in subnets if subnet.get('description') == AUTOIPAM_NOTE}
+    return [
+        address for address in addresses
+        if str(address['subnetId']) in owned_subnet_ids or address.get('note') == AUTOIPAM_NOTE
+    ]
+
+
+def get_reported_ips(devices):
+    """Returns the set of ip-addresses reported by the sources"""
+    return {interface['ipv4Address'] for device in devices for interface in device['interfaces']}
+
+
+def find_stale(devices, subnets, addresses):
+    """Returns the owned addresses no longer reported by any source, sorted by subnet and ip, and the number of owned addresses.\n
+    Calculated as a set difference between the owned and the reported ip-addresses, without any per-address requests."""
+    owned = get_owned_addresses(subnets, addresses)
+    subnet_names = {str(subnet['id']): f"{subnet['subnet']}/{subnet['mask']}" for subnet in subnets}
+    reported_ips = get_reported_ips(devices)
+    stale = []
+    for address in owned:
+        if address['ip'] in reported_ips:
+            continue
+        stale.append({
+            'id': address['id'],
+            'action': 'stale',
+            'ip': address['ip'],
+            'subnet': subnet_names.get(str(address['subnetId'])),
+            'hostname': address.get('hostname'),
+            'description': address.get('description'),
+            'owner': address.get('owner'),
+            'mac': address.get('mac'),
+            'note': address.get('note'),
+            'editDate': address.get('editDate')
+        })
+    stale.sort(key=lambda entry: (entry['subnet'] or '', tuple(int(part) for part in entry['ip'].split('.'))))
+    return stale, len(owned)
+
+
+def check_threshold(stale_count, owned_count):
+    """Raises ThresholdExceeded if deleting stale_count of owned_count addresses exceeds the safety threshold.\n
+    A large share of stale addresses usually means a source returned incomplete data, not that devices were removed."""
+    if stale_count > c.RECONCILE_MAX_DELETE:
+        raise ThresholdExceeded(f'{stale_count} stale addresses exceed RECONCILE_MAX_DELETE ({c.RECONCILE_MAX_DELETE})')
+    if owned_count > 0 and stale_count / owned_count > c.RECONCILE_MAX_DELETE_SHARE:
+        raise ThresholdExceeded(
+            f'{stale_count} of {owned_count} owned addresses are stale, which exceeds RECONCILE_MAX_DELETE_SHARE ({c.RECONCILE_MAX_DELETE_SHARE:.0%})'
+        )
+
+
+def delete_stale(stale, report):
+    """Deletes the stale addresses from the live IPAM database, RECONCILE_WORKERS at a time, and writes the outcome of each to report.\n
+    Returns the number of deleted addresses."""
+    deadline = http_utils.get_deadline()
+    progress.set_total('writes', len(stale))
+
+    def delete(entry):
+        http_utils.set_deadline(None if deadline is None else deadline - time.monotonic())
+        return ipam_api.delete_address(entry['id'])
+
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=c.RECONCILE_WORKERS, thread_name_prefix='autoipam-reconcile') as executor:
+        for entry, success in zip(stale, executor.map(delete, stale)):
+            entry = dict(entry)
+            if success:
+                entry['action'] = 'deleted'
+                deleted += 1
+                progress.advance('writes')
+            else:
+                entry['action'] = 'failed'
+                progress.error('writes')
+            report.write(entry)
+    return deleted
+
+
+def count_per_subnet(stale):
+    """Returns the number of stale addresses per subnet"""
+    counts = {}
+    for entry in stale:
+        counts[entry['subnet']] = counts.get(entry['subnet'], 0) + 1
+    return counts
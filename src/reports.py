@@ -0,0 +1,262 @@
+from src import utils
+from src import constants as c
+
+import io
+import os
+import csv
+import gzip
+import json
+import time
+from datetime import datetime
+
+
+SUBNET_REPORT_FIELDS = [
+    'id',
+    'change-type',
+    'old-network-address',
+    'new-network-address',
+    'old-cidr',
+    'new-cidr',
+    'old-subnet-mask',
+    'new-subnet-mask',
+    'old-subnet-name',
+    'new-subnet-name',
+    'old-subnet-description',
+    'new-subnet-description',
+    'old-vrf',
+    'new-vrf'
+]
+
+ADDRESS_REPORT_FIELDS = [
+    'id',
+    'change-type',
+    'device-type',
+    'ip',
+    'old-hostname',
+    'new-hostname',
+    'old-description',
+    'new-description',
+    'old-is_gateway',
+    'new-is_gateway',
+    'old-owner',
+    'new-owner',
+    'old-mac',
+    'new-mac',
+    'old-device-serial',
+    'new-device-serial'
+]
+
+DIFF_REPORT_FIELDS = ['change'] + [field for field in ADDRESS_REPORT_FIELDS if field != 'change-type'] + [
+    'ip-address',
+    'new-network-address',
+    'new-subnet-mask',
+    'new-cidr',
+    'new-subnet-name',
+    'new-subnet-description',
+    'new-vrf'
+]
+
+REJECTED_REPORT_FIELDS = [
+    'check',
+    'reason',
+    'hostname',
+    'interface',
+    'ip',
+    'mask',
+    'subnet'
+]
+
+
+class ReportFile:
+    """A report file that rows are appended to while a run is in progress.\n
+    Every flush leaves a complete file on disk: JSON Lines and CSV only ever end on a finished row,
+    and compressed files are written as a series of complete gzip members.
+    Rows are written every REPORT_FLUSH_ROWS rows or REPORT_FLUSH_INTERVAL seconds, and synced to disk
+    at most every REPORT_FSYNC_INTERVAL seconds and on close, so a crash loses at most the last few rows.\n
+    The file is created on the first row, so runs without changes leave no empty files."""
+
+    def __init__(self, file_name, file_format, fieldnames=None, compress=None):
+        self.file_name = file_name
+        self.file_format = file_format
+        self.fieldnames = fieldnames
+        self.compress = c.REPORT_COMPRESS if compress is None else compress
+        self.batch_size = c.REPORT_GZIP_BATCH if self.compress else c.REPORT_FLUSH_ROWS
+        self.path = None
+        self.file = None
+        self.buffer = []
+        self.rows = 0
+        self.flushed = time.monotonic()
+        self.synced = time.monotonic()
+
+    def _open(self):
+        """Creates the file with a unique, timestamped name"""
+        os.makedirs(os.path.dirname(self.file_name) or '.', exist_ok=True)
+        timestamp = f'_{datetime.now().strftime("%Y%m%d_%H%M")}'
+        file_extension = f'.{self.file_format}.gz' if self.compress else f'.{self.file_format}'
+        self.path = utils.check_duplicate_file(self.file_name+timestamp, file_extension)
+        self.file = open(self.path, 'wb')
+        if self.file_format == 'csv':
+            header = io.StringIO()
+            csv.DictWriter(header, fieldnames=self.fieldnames, delimiter=';', dialect='excel').writeheader()
+            # Byte order mark so Excel detects the encoding, as in utils.export_csv
+            self.buffer.append('\ufeff'+header.getvalue())
+
+    def _encode(self, row):
+        """Encodes a single row as a line of text"""
+        if self.file_format == 'csv':
+            line = io.StringIO()
+            csv.DictWriter(line, fieldnames=self.fieldnames, delimiter=';', dialect='excel', extrasaction='ignore').writerow(row)
+            return line.getvalue()
+        return json.dumps(row, ensure_ascii=False, default=str)+'\n'
+
+    def write(self, row):
+        """Appends a row to the report"""
+        if self.path is None:
+            self._open()
+        self.buffer.append(self._encode(row))
+        self.rows += 1
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.flushed >= c.REPORT_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self, sync=False):
+        """Writes buffered rows to the file, and syncs it to disk if sync is set or REPORT_FSYNC_INTERVAL has passed"""
+        self.flushed = time.monotonic()
+        if self.file is None:
+            return
+        if self.buffer:
+            data = ''.join(self.buffer).encode('utf-8')
+            if self.compress:
+                data = gzip.compress(data)
+            self.file.write(data)
+            self.file.flush()
+            self.buffer = []
+        if sync or self.flushed - self.synced >= c.REPORT_FSYNC_INTERVAL:
+            os.fsync(self.file.fileno())
+            self.synced = self.flushed
+
+    def close(self):
+        """Writes the remaining rows, syncs and closes the file, and returns its path, or None if no rows were written"""
+        if self.file is not None:
+            self.flush(sync=True)
+            self.file.close()
+            self.file = None
+        return self.path
+
+    def read(self):
+        """Returns the rows of a closed JSON Lines file, one at a time"""
+        if self.path is None:
+            return
+        with (gzip.open(self.path, 'rt', encoding='utf-8') if self.compress else open(self.path, 'r', encoding='utf-8')) as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class Report:
+    """A set of report files, one per configured format, that receive the same rows"""
+
+    def __init__(self, file_name, fieldnames, formats=None):
+        formats = c.REPORT_FORMATS if formats is None else formats
+        self.files = [ReportFile(file_name, file_format, fieldnames) for file_format in formats]
+        self.rows = 0
+
+    def write(self, row):
+        """Appends a row to all files"""
+        for report_file in self.files:
+            report_file.write(row)
+        self.rows += 1
+
+    def close(self):
+        """Closes all files and returns the paths of the files that were created"""
+        return [path for path in (report_file.close() for report_file in self.files) if path is not None]
+
+
+class UpdateReport:
+    """Streams the subnets and addresses changed by an update, and any conflicts, to report files while the update is running"""
+
+    def __init__(self, suffix=''):
+        self.subnets = Report(c.SUBNET_REPORT_PATH+c.SUBNET_REPORT_FILE_NAME+suffix, SUBNET_REPORT_FIELDS)
+        self.addresses = Report(c.ADDRESS_REPORT_PATH+c.ADDRESS_REPORT_FILE_NAME+suffix, ADDRESS_REPORT_FIELDS)
+        self.conflicts = ReportFile(c.CONFLICTS_PATH+c.CONFLICT_FILE_NAME+suffix, 'jsonl')
+
+    def subnet(self, updated_subnet):
+        """Records a created or updated subnet"""
+        self.subnets.write(updated_subnet)
+
+    def address(self, updated_address):
+        """Records a created or updated address"""
+        self.addresses.write(updated_address)
+
+    def conflict(self, conflict):
+        """Records a conflict"""
+        self.conflicts.write(conflict)
+
+    def counts(self):
+        """Returns the number of changes recorded per type"""
+        return {
+            'updated-subnets': self.subnets.rows,
+            'updated-addresses': self.addresses.rows,
+            'conflicts': self.conflicts.rows
+        }
+
+    def close(self):
+        """Closes all report files and returns their paths"""
+        paths = self.subnets.close() + self.addresses.close()
+        conflicts_path = self.conflicts.close()
+        if conflicts_path is not None:
+            paths.append(conflicts_path)
+        return paths
+
+
+class DiffReport:
+    """Streams the entries of a diff to report files while the diff is being calculated.\n
+    Only the number of entries is kept in memory, the entries are paged through from the JSON Lines file,
+    which is therefore always written."""
+
+    def __init__(self):
+        formats = c.REPORT_FORMATS if 'jsonl' in c.REPORT_FORMATS else c.REPORT_FORMATS + ['jsonl']
+        self.report = Report(c.DIFF_PATH+c.DIFF_EXPORT_FILE_NAME, DIFF_REPORT_FIELDS, formats)
+        self.counts = {'new-subnets': 0, 'new-addresses': 0, 'updated-addresses': 0}
+
+    def entry(self, change, entry):
+        """Records a pending change of a given type (new-subnets, new-addresses or updated-addresses)"""
+        row = {'change': change}
+        row.update(entry)
+        self.report.write(row)
+        self.counts[change] += 1
+
+    def entries(self, change):
+        """Returns the recorded entries of a type one at a time, once the report is closed"""
+        jsonl_file = next(report_file for report_file in self.report.files if report_file.file_format == 'jsonl')
+        for row in jsonl_file.read():
+            if row.pop('change') == change:
+                yield row
+
+    def close(self):
+        """Closes all report files and returns their paths"""
+        return self.report.close()
+
+
+class RejectedReport:
+    """Writes the interfaces rejected by the validation of an update, before the update starts"""
+
+    def __init__(self):
+        self.report = Report(c.REJECTED_PATH+c.REJECTED_FILE_NAME, REJECTED_REPORT_FIELDS)
+
+    def entry(self, rejected):
+        """Records a rejected interface"""
+        self.report.write(rejected)
+
+    def close(self):
+        """Closes all report files and returns their paths"""
+        return self.report.close()
+
+
+def show_report_paths(paths):
+    """Displays the files a report was written to"""
+    if not paths:
+        print('No changes to export.')
+        return
+    print('Report written to:')
+    for path in paths:
+        print(f'    {path}')
+    print()
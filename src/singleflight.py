@@ -0,0 +1,131 @@
+from src import http_utils
+from src.errors import DeadlineExceeded
+
+import os
+import functools
+import threading
+from contextlib import contextmanager
+
+
+class Call:
+    """A request in flight, shared by the caller that started it and everyone waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """Coalesces identical concurrent requests, so only one request per key is in flight.\n
+    Callers arriving while a request for their key is running wait for it and share its result or exception."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """Runs function for key, or waits for the request already in flight for key"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = Call()
+                self.calls[key] = call
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            # Waiters give up at their own deadline, the request itself continues for the others
+            if not call.done.wait(http_utils.remaining_time()):
+                raise DeadlineExceeded(f'Deadline exceeded waiting for {key}')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+class KeyedLock:
+    """A lock per key, created on first use and removed once nobody holds or waits for it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @contextmanager
+    def hold(self, key):
+        """Holds the lock for key for the duration of a with-block.\n
+        Yields True if another holder had to be waited for, so the caller knows to re-check what it is about to do."""
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        waited = not entry[0].acquire(blocking=False)
+        if waited:
+            entry[0].acquire()
+        try:
+            yield waited
+        finally:
+            entry[0].release()
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+
+_group = Group()
+_exclusive = KeyedLock()
+
+
+def _reset_after_fork():
+    """Requests in flight in the parent process are never finished in a forked worker, so it starts without them"""
+    global _group, _exclusive
+    _group = Group()
+    _exclusive = KeyedLock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def freeze(value):
+    """Converts lists and sets in arguments to tuples, so they can be part of a key.\n
+    Sets are sorted, so equal sets give the same key whatever their iteration order."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((freeze(item) for item in value), key=repr))
+    return value
+
+
+def coalesce(endpoint):
+    """Decorator that coalesces concurrent calls with the same arguments into a single request per (endpoint, arguments).\n
+    The undecorated function is available as __wrapped__, for lookups that must not share a request started earlier."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (endpoint, freeze(args), freeze(tuple(sorted(kwargs.items()))))
+            return _group.do(key, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def exclusive(key):
+    """Holds the process wide lock for key, e.g. while creating a subnet"""
+    return _exclusive.hold(key)
+
+
+def coalesced_count():
+    """Returns the number of requests that were served by a request already in flight"""
+    return _group.coalesced
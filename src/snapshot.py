@@ -0,0 +1,345 @@
+from src import ipam_api
+from src import constants as c
+from src import log_utils
+
+import os
+import sys
+import json
+import mmap
+import time
+import bisect
+import struct
+import tempfile
+import threading
+import ipaddress
+from array import array
+
+
+log = log_utils.get_logger('snapshot')
+
+
+MAGIC = b'AIPSNAP\x00'
+VERSION = 1
+
+# Address fields compared or reported by an update, each stored as a reference into the value pool
+ADDRESS_FIELDS = ('hostname', 'description', 'is_gateway', 'owner', 'mac', 'custom_Device_Serial', 'note')
+
+# Sections in file order, every section starts on an 8 byte boundary
+SECTIONS = (
+    'address_ips',          # uint32 ip per address, sorted
+    'address_ids',          # uint32 address id, same order
+    'address_subnet_ids',   # uint32 subnet id, same order
+    'address_values',       # uint32 value index per address and field in ADDRESS_FIELDS
+    'prefix_table',         # uint32 first and last+1 subnet index per prefix length 0-32
+    'subnet_networks',      # uint32 network address per subnet, sorted by prefix length and network
+    'subnet_ids',           # uint32 subnet id, same order
+    'value_offsets',        # uint32 offset of every value in the pool, plus the end of the pool
+    'value_pool',           # distinct values, utf-8 strings tagged s and anything else as json tagged j
+    'meta'                  # json encoded VRFs and custom fields
+)
+
+# magic, byte order, version, creation time, address count, subnet count, then offset and length per section
+HEADER = struct.Struct('=8sIId2I' + 'QQ' * len(SECTIONS))
+
+BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+
+
+def ip_to_int(ip_address):
+    """Converts an ip-address string to its integer representation"""
+    return int(ipaddress.IPv4Address(ip_address))
+
+
+def get_path():
+    """Returns the path of the snapshot file"""
+    return c.MIRROR_PATH+c.SNAPSHOT_FILE_NAME
+
+
+def uint32_array(values):
+    """Returns a native uint32 array, the item size of 'I' is checked since it is platform dependent"""
+    values = array('I', values)
+    assert values.itemsize == 4
+    return values
+
+
+def encode(subnets, addresses, vrfs, custom_fields, created=None):
+    """Encodes the IPAM section as a snapshot and returns the file content"""
+    # Distinct values are stored once, hostnames and owners repeat for every interface of a device
+    value_index = {}
+    value_offsets = uint32_array([])
+    pool = bytearray()
+
+    def add_value(value):
+        # Strings are keyed by themselves and everything else by its encoding, so '0' and 0 stay apart
+        if isinstance(value, str):
+            key = value
+            encoded = b's' + value.encode('utf-8')
+        else:
+            key = encoded = b'j' + json.dumps(value).encode('utf-8')
+        index = value_index.get(key)
+        if index is None:
+            index = value_index[key] = len(value_offsets)
+            value_offsets.append(len(pool))
+            pool.extend(encoded)
+        return index
+
+    addresses = sorted(((ip_to_int(address['ip']), int(address['id'])), address) for address in addresses)
+    address_values = uint32_array(add_value(address.get(field)) for _, address in addresses for field in ADDRESS_FIELDS)
+    value_offsets.append(len(pool))
+
+    subnets = sorted(subnets, key=lambda subnet: (int(subnet['mask']), ip_to_int(subnet['subnet'])))
+    prefix_table = uint32_array([0] * 66)
+    for index, subnet in enumerate(subnets):
+        prefix = int(subnet['mask'])
+        if prefix_table[2*prefix+1] == 0:
+            prefix_table[2*prefix] = index
+        prefix_table[2*prefix+1] = index + 1
+
+    sections = {
+        'address_ips': uint32_array(ip for (ip, _), _ in addresses).tobytes(),
+        'address_ids': uint32_array(address_id for (_, address_id), _ in addresses).tobytes(),
+        'address_subnet_ids': uint32_array(int(address['subnetId']) for _, address in addresses).tobytes(),
+        'address_values': address_values.tobytes(),
+        'prefix_table': prefix_table.tobytes(),
+        'subnet_networks': uint32_array(ip_to_int(subnet['subnet']) for subnet in subnets).tobytes(),
+        'subnet_ids': uint32_array(int(subnet['id']) for subnet in subnets).tobytes(),
+        'value_offsets': value_offsets.tobytes(),
+        'value_pool': bytes(pool),
+        'meta': json.dumps({'vrfs': vrfs, 'custom_fields': custom_fields}).encode('utf-8')
+    }
+
+    layout = []
+    body = bytearray()
+    offset = HEADER.size
+    for name in SECTIONS:
+        padding = -offset % 8
+        body.extend(b'\x00' * padding)
+        offset += padding
+        layout += [offset, len(sections[name])]
+        body.extend(sections[name])
+        offset += len(sections[name])
+
+    header = HEADER.pack(MAGIC, BYTE_ORDER, VERSION, time.time() if created is None else created, len(addresses), len(subnets), *layout)
+    return header + bytes(body)
+
+
+def write(path, subnets, addresses, vrfs, custom_fields):
+    """Writes a snapshot atomically, processes that mapped the previous file keep reading it until they close it"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = encode(subnets, addresses, vrfs, custom_fields)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception as e:
+        os.unlink(temp_path)
+        raise e
+
+
+def build(path=None):
+    """Requests the IPAM section and writes it as a snapshot"""
+    path = get_path() if path is None else path
+    log.info('Building IPAM snapshot...')
+    subnets = ipam_api.get_section_subnets(c.SECTION_ID)
+    subnet_ids = {str(subnet['id']) for subnet in subnets}
+    addresses = [address for address in ipam_api.get_all_addresses() if str(address['subnetId']) in subnet_ids]
+    vrfs = ipam_api.get_vrfs()
+    custom_fields = ipam_api.get_custom_fields().json().get('data') or {}
+    write(path, subnets, addresses, vrfs, custom_fields)
+    log.info(f'IPAM snapshot written: {len(subnets)} subnets and {len(addresses)} addresses')
+
+
+def read_created(path):
+    """Returns the creation time of a snapshot, or None if there is no valid snapshot at path"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, byte_order, version, created = HEADER.unpack(header)[:4]
+    if magic != MAGIC or byte_order != BYTE_ORDER or version != VERSION:
+        return None
+    return created
+
+
+class IpamSnapshot:
+    """Read-only, memory-mapped snapshot of the IPAM section.\n
+    The arrays are used in place, so opening a snapshot costs a single mmap and every worker process
+    shares the same pages. Exposes the same lookup and write functions as ipam_api, so it can be used
+    in its place. Writes are sent to the live API and kept in an overlay of the current process."""
+
+    def __init__(self, path=None):
+        self.path = get_path() if path is None else path
+        with open(self.path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.mmap)
+        magic, byte_order, version, self.created = fields[:4]
+        if magic != MAGIC or byte_order != BYTE_ORDER or version != VERSION:
+            self.mmap.close()
+            raise ValueError(f'{self.path} is not a snapshot of this version and platform')
+        layout = fields[6:]
+        buffer = memoryview(self.mmap)
+        self.views = {}
+        for index, name in enumerate(SECTIONS):
+            offset, length = layout[2*index], layout[2*index+1]
+            view = buffer[offset:offset+length]
+            self.views[name] = view if name in ('value_pool', 'meta') else view.cast('I')
+        buffer.release()
+        meta = json.loads(bytes(self.views['meta']))
+        self.vrfs = meta['vrfs']
+        self.custom_fields = meta['custom_fields']
+        # Subnets and addresses written in this process, looked up before the snapshot
+        self.lock = threading.Lock()
+        self.created_subnets = {}
+        self.written_addresses = {}
+
+    def close(self):
+        """Releases the arrays and unmaps the file"""
+        for view in self.views.values():
+            view.release()
+        self.views = {}
+        self.mmap.close()
+
+    def age(self):
+        """Returns the age of the snapshot in seconds"""
+        return time.time() - self.created
+
+    def value(self, index):
+        """Returns a value from the value pool"""
+        offsets = self.views['value_offsets']
+        data = self.views['value_pool'][offsets[index]:offsets[index+1]]
+        if data[0] == ord('s'):
+            return str(data[1:], 'utf-8')
+        return json.loads(bytes(data[1:]))
+
+    def find_subnet(self, network_int, prefix):
+        """Returns the id of the subnet with the given network and prefix length, or None"""
+        prefix_table = self.views['prefix_table']
+        start, end = prefix_table[2*prefix], prefix_table[2*prefix+1]
+        networks = self.views['subnet_networks']
+        index = bisect.bisect_left(networks, network_int, start, end)
+        if index < end and networks[index] == network_int:
+            return self.views['subnet_ids'][index]
+        return None
+
+    #---------- Lookups ----------
+
+    def get_custom_fields(self):
+        """Returns the custom fields at the time of the snapshot"""
+        return self.custom_fields
+
+    def get_vrf_id(self, vrf_name):
+        """Returns the vrfId for a specified VRF-name"""
+        for vrf in self.vrfs:
+            if vrf['name'] == vrf_name:
+                return vrf['vrfId']
+        return None
+
+    def get_subnet(self, network_address):
+        """Returns subnet information for a given network address in CIDR format"""
+        subnet, _, mask = network_address.partition('/')
+        subnet_id = self.created_subnets.get(network_address)
+        if subnet_id is None:
+            subnet_id = self.find_subnet(ip_to_int(subnet), int(mask))
+        if subnet_id is None:
+            return None
+        return {'network_address': subnet, 'cidr': mask, 'id': subnet_id}
+
+    def get_subnet_id(self, network_address):
+        """Returns the subnet id for a given network address in CIDR format"""
+        subnet = self.get_subnet(network_address)
+        if subnet is None:
+            return None
+        return subnet['id']
+
+    def get_master_subnet(self, possible_master_subnets):
+        """Returns the most specific existing subnet out of a list of possible master subnets"""
+        existing_possible_master_subnets = [subnet for subnet in possible_master_subnets if self.get_subnet(subnet) is not None]
+        if len(existing_possible_master_subnets) == 0:
+            return None
+        return max(existing_possible_master_subnets, key=lambda x: int(x.split('/')[1]))
+
+    def get_address(self, network_address):
+        """Returns address data for a given ip-address in the same format as the IPAM search endpoint"""
+        written = self.written_addresses.get(network_address)
+        if written is not None:
+            return {'success': True, 'data': [dict(written)]}
+        ips = self.views['address_ips']
+        ip = ip_to_int(network_address)
+        start = bisect.bisect_left(ips, ip)
+        end = bisect.bisect_right(ips, ip, start)
+        if start == end:
+            return False
+        values = self.views['address_values']
+        data = []
+        for index in range(start, end):
+            address = {'id': self.views['address_ids'][index], 'subnetId': self.views['address_subnet_ids'][index], 'ip': network_address}
+            for position, field in enumerate(ADDRESS_FIELDS):
+                address[field] = self.value(values[index*len(ADDRESS_FIELDS)+position])
+            data.append(address)
+        return {'success': True, 'data': data}
+
+    #---------- Writes ----------
+
+    def create_subnet(self, network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id=None):
+        """Creates a new subnet in the IPAM database and adds it to the overlay"""
+        data = ipam_api.create_subnet(network_address, subnet_mask, cidr, subnet_name, subnet_description, vrf_id, section_id, master_subnet_id)
+        if data['id'] is not None and section_id == c.SECTION_ID:
+            with self.lock:
+                self.created_subnets[f'{network_address}/{cidr}'] = data['id']
+        return data
+
+    def create_address(self, interface, device, subnet_id):
+        """Creates a new address in the IPAM database and adds it to the overlay, returns None if it could not be created"""
+        address_id = ipam_api.create_address(interface, device, subnet_id)
+        if address_id is None:
+            return None
+        address = {
+            'id': address_id,
+            'subnetId': subnet_id,
+            'ip': interface['ipv4Address'],
+            'hostname': device['hostname'],
+            'description': interface['description'],
+            'is_gateway': interface['is-gateway'],
+            'owner': device['owner'],
+            'mac': interface['mac'],
+            'custom_Device_Serial': device['serial'],
+            'note': 'Created by AutoIpam'
+        }
+        with self.lock:
+            self.written_addresses[interface['ipv4Address']] = address
+        return address_id
+
+    def update_address(self, updated_address):
+        """Updates an existing address in the IPAM database and records the change in the overlay, returns True if it was updated"""
+        if not ipam_api.update_address(updated_address):
+            return False
+        response = self.get_address(updated_address['ip'])
+        if response is False:
+            return True
+        address = next((address for address in response['data'] if str(address['id']) == str(updated_address['id'])), response['data'][0])
+        fields = {
+            'new-hostname': 'hostname',
+            'new-description': 'description',
+            'new-is_gateway': 'is_gateway',
+            'new-owner': 'owner',
+            'new-mac': 'mac',
+            'new-device-serial': 'custom_Device_Serial'
+        }
+        for key, field in fields.items():
+            if key in updated_address:
+                address[field] = updated_address[key]
+        with self.lock:
+            self.written_addresses[updated_address['ip']] = address
+        return True
+
+
+def open_snapshot(max_age):
+    """Opens the IPAM snapshot and rebuilds it first if it is older than max_age seconds"""
+    path = get_path()
+    created = read_created(path)
+    if created is None or time.time() - created > max_age:
+        build(path)
+    return IpamSnapshot(path)
@@ -0,0 +1,43 @@
+import importlib
+
+
+# API modules per backend, imported on first use so commands that never reach a backend do not load requests
+BACKENDS = {
+    'ipam': 'src.ipam_api',
+    'dnac': 'src.dnac_api',
+    'checkpoint': 'src.checkpoint_api',
+    'vmanage': 'src.vmanage_api'
+}
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes not set in __init__, i.e. everything the module provides
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f'<lazy module {self._name}{"" if self._module is None else " (loaded)"}>'
+
+
+def get(backend):
+    """Imports and returns the API module of a backend"""
+    return importlib.import_module(BACKENDS[backend])
+
+
+def backend(backend):
+    """Returns the API module of a backend, imported when it is first used"""
+    return LazyModule(BACKENDS[backend])
+
+
+def lazy(name):
+    """Returns a module imported when it is first used, for modules only some commands need"""
+    return LazyModule(name)
+
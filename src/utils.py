@@ -1,12 +1,17 @@
 from src import constants as c
+from src import log_utils
 
 import os
 import json
 import csv
 import ipaddress
+import functools
 from datetime import datetime
 
 
+log = log_utils.get_logger('utils')
+
+
 def show_version():
     """Displays the current script version"""
     print(f"Version: {c.RELEASE['version']}")
@@ -30,7 +35,7 @@ def calc_owner(hostname):
 
 def calc_subnet(ip_address, subnet_mask):
     """Calculates subnet information from ip-address and subnet mask"""
-    print(f"\nCalculating subnet for ip {ip_address} with mask {subnet_mask}")
+    log.debug(f"Calculating subnet for ip {ip_address} with mask {subnet_mask}")
     ip = ipaddress.IPv4Address(ip_address)
     subnet_mask = ipaddress.IPv4Address(subnet_mask)
 
@@ -46,7 +51,7 @@ def calc_subnet(ip_address, subnet_mask):
 
 def calc_master_subnets(subnet):
     """Calculates all the possible master subnets for a given subnet"""
-    print(f'Calculating master subnets for {subnet}')
+    log.debug(f'Calculating master subnets for {subnet}')
     master_subnets = set()
     subnet_obj = ipaddress.ip_network(str(subnet))
 
@@ -67,11 +72,18 @@ def check_ip_in_subnet(ip_address, subnet):
     return ip in network
 
 
+@functools.lru_cache(maxsize=None)
+def compile_networks(ranges):
+    """Returns the networks of a tuple of address ranges from constants.py, compiled once on first use"""
+    return tuple(ipaddress.ip_network(subnet, strict=False) for subnet in ranges)
+
+
 def check_ip_in_ignored(ip_address):
     """Checks if a given ip address is part of the ignored address ranges configured in constants.py"""
-    for subnet in c.IGNORED_IP_RANGES:
-        if check_ip_in_subnet(ip_address, subnet):
-            print(f'{ip_address:<16} in list of ignored IP-ranges, skipping')
+    ip = ipaddress.ip_address(ip_address)
+    for network in compile_networks(tuple(c.IGNORED_IP_RANGES)):
+        if ip in network:
+            log.debug(f'{ip_address:<16} in list of ignored IP-ranges, skipping')
             return True
     return False
 
@@ -80,31 +92,31 @@ def calc_vrf(subnet):
     """Calculates associated VRF for a specified subnet"""
     subnet_network = ipaddress.ip_network(subnet)
 
-    for network in c.SCA_PROCESS_VRF:
+    for network in compile_networks(tuple(c.SCA_PROCESS_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_PROCESS'
         
-    for network in c.SCA_FACILITY_VRF:
+    for network in compile_networks(tuple(c.SCA_FACILITY_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_FACILITY'
     
-    for network in c.SCA_MGMT_VRF:
+    for network in compile_networks(tuple(c.SCA_MGMT_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_MGMT'
         
-    for network in c.SCA_PRINT_VRF:
+    for network in compile_networks(tuple(c.SCA_PRINT_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_PRINT'
     
-    for network in c.SCA_COMMON_VRF:
+    for network in compile_networks(tuple(c.SCA_COMMON_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_COMMON'
     
-    for network in c.SCA_DC_VRF:
+    for network in compile_networks(tuple(c.SCA_DC_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_DC'
         
-    for network in c.SCA_DMZ_VRF:
+    for network in compile_networks(tuple(c.SCA_DMZ_VRF)):
         if subnet_network.subnet_of(network):
             return 'SCA_DMZ'
         
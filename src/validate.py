@@ -0,0 +1,187 @@
+from src import utils, log_utils
+from src import constants as c
+
+import bisect
+import functools
+import ipaddress
+
+
+log = log_utils.get_logger('validate')
+
+
+@functools.lru_cache(maxsize=None)
+def get_prefix_length(mask):
+    """Returns the prefix length of a subnet mask, raises ValueError for an invalid mask"""
+    return ipaddress.IPv4Network(f'0.0.0.0/{mask}').prefixlen
+
+
+@functools.lru_cache(maxsize=None)
+def get_network(network_int, prefix_length):
+    """Returns the network of a first address and prefix length, shared by all interfaces in it"""
+    return ipaddress.IPv4Network((network_int, prefix_length))
+
+
+def get_field_values(device, interface):
+    """Returns the values an interface is written to IPAM with, by IPAM field name"""
+    return {
+        'hostname': device.get('hostname'),
+        'description': interface.get('description'),
+        'owner': device.get('owner'),
+        'mac': interface.get('mac'),
+        'custom_Device_Serial': device.get('serial'),
+        'custom_Subnet_Name': interface.get('subnet-name')
+    }
+
+
+def rejection(device, interface, check, reason, network=None):
+    """Returns the report row of a rejected interface"""
+    return {
+        'check': check,
+        'reason': reason,
+        'hostname': device.get('hostname'),
+        'interface': interface.get('interface-name', interface.get('description')),
+        'ip': interface.get('ipv4Address'),
+        'mask': interface.get('ipv4Mask'),
+        'subnet': None if network is None else str(network)
+    }
+
+
+def check_interface(device, interface, get_network_vrf):
+    """Checks a single interface on its own, get_network_vrf returns the VRF name and vrfId of a network.\n
+    Returns (network, None) if it can be applied, or (network, rejection) where network is None if it could not be computed."""
+    try:
+        ip = int(ipaddress.IPv4Address(interface['ipv4Address']))
+        host_bits = 32 - get_prefix_length(interface['ipv4Mask'])
+    except (KeyError, TypeError, ValueError) as e:
+        return None, rejection(device, interface, 'invalid-address', f'Invalid address or mask: {e}')
+
+    network_int = ip >> host_bits << host_bits
+    network = get_network(network_int, 32 - host_bits)
+
+    # Master subnets are searched from /8, and shorter subnets would lock too many networks, see locks.subnet_lock_keys
+    if network.prefixlen < c.VALIDATION_MIN_PREFIX:
+        return network, rejection(device, interface, 'short-prefix', f'/{network.prefixlen} is shorter than /{c.VALIDATION_MIN_PREFIX}', network)
+
+    # Check Point reports the mask length next to the mask, a mismatch leaves the address outside one of the two subnets
+    cidr = interface.get('cidr')
+    if cidr not in (None, '') and str(cidr) != str(network.prefixlen):
+        return network, rejection(device, interface, 'outside-subnet', f'Mask {interface["ipv4Mask"]} does not match mask length /{cidr}', network)
+
+    # /31 and /32 subnets have no network or broadcast address
+    if host_bits > 1:
+        if ip == network_int:
+            return network, rejection(device, interface, 'network-address', f"{interface['ipv4Address']} is the network address of {network}", network)
+        if ip == network_int | (1 << host_bits) - 1:
+            return network, rejection(device, interface, 'broadcast-address', f"{interface['ipv4Address']} is the broadcast address of {network}", network)
+
+    for field, value in get_field_values(device, interface).items():
+        max_length = c.VALIDATION_MAX_LENGTHS.get(field)
+        if value is not None and max_length is not None and len(str(value)) > max_length:
+            return network, rejection(device, interface, 'field-length', f'{field} is {len(str(value))} characters, IPAM allows {max_length}', network)
+
+    vrf_name, vrf_id = get_network_vrf(network)
+    if vrf_name is not None and vrf_id is None:
+        return network, rejection(device, interface, 'missing-vrf', f'VRF {vrf_name} of {network} does not exist in IPAM', network)
+
+    return network, None
+
+
+def find_overlapping(network_counts):
+    """Returns the networks that overlap another network of the plan and are not applied, with the network they overlap.\n
+    Networks are accepted in order of the number of interfaces reporting them, ties go to the more specific network,
+    and every network overlapping an accepted one is rejected. A misconfigured mask on a single device therefore does
+    not reject the subnet reported by all its neighbours.\n
+    /32 host subnets, e.g. loopbacks, are created below the subnet they are part of and never overlap."""
+    accepted = set()
+    starts = []
+    overlapping = {}
+    for network in sorted(network_counts, key=lambda network: (-network_counts[network], -network.prefixlen, network)):
+        if network.prefixlen == 32:
+            continue
+        # Accepted supernets are found by prefix, accepted subnets by their first address
+        overlap = next((supernet for supernet in (network.supernet(new_prefix=prefix) for prefix in range(network.prefixlen+1)) if supernet in accepted), None)
+        if overlap is None:
+            first, last = int(network.network_address), int(network.broadcast_address)
+            index = bisect.bisect_left(starts, (first,))
+            if index < len(starts) and starts[index][0] <= last:
+                overlap = starts[index][1]
+        if overlap is not None:
+            overlapping[network] = overlap
+            continue
+        accepted.add(network)
+        bisect.insort(starts, (int(network.network_address), network))
+    return overlapping
+
+
+def find_new_overlapping(network_counts, get_subnet_id):
+    """Returns the networks of find_overlapping, leaving out subnets that already exist in IPAM.\n
+    Existing subnets are not created, so they are only looked up if they overlap another network of the plan."""
+    overlapping = find_overlapping(network_counts)
+    if not overlapping:
+        return overlapping
+    involved = set(overlapping) | set(overlapping.values())
+    existing = {network for network in involved if get_subnet_id(str(network)) is not None}
+    if not existing:
+        return overlapping
+    return find_overlapping({network: count for network, count in network_counts.items() if network not in existing})
+
+
+def validate_plan(devices, get_vrf_id, get_subnet_id):
+    """Checks the complete list of devices and interfaces before anything is written to IPAM.\n
+    Interfaces are rejected for invalid addresses or masks, network and broadcast addresses, addresses outside their
+    computed subnet, field values longer than IPAM allows, VRFs missing in IPAM, addresses already reported by another
+    device and new subnets overlapping another new subnet of the plan.\n
+    get_vrf_id resolves a VRF name to its vrfId, e.g. ipam.get_vrf_id, and is called once per VRF.
+    get_subnet_id returns the id of an existing subnet in CIDR format, e.g. ipam.get_subnet_id, and is only called for overlapping networks.
+    Returns (applicable, rejected): the devices with only the interfaces that can be applied, and the report rows of the rejected interfaces."""
+    get_vrf_id = functools.lru_cache(maxsize=None)(get_vrf_id)
+
+    @functools.lru_cache(maxsize=None)
+    def get_network_vrf(network):
+        # Interfaces share few networks, so every network is matched against the VRF ranges once
+        vrf_name = utils.calc_vrf(str(network))
+        return vrf_name, None if vrf_name is None else get_vrf_id(vrf_name)
+
+    rejected = []
+    checked = []
+    seen_ips = {}
+    network_counts = {}
+    for device in devices:
+        interfaces = []
+        for interface in device['interfaces']:
+            network, rejected_interface = check_interface(device, interface, get_network_vrf)
+            if rejected_interface is None and interface['ipv4Address'] in seen_ips:
+                ip = interface['ipv4Address']
+                if seen_ips[ip] == device.get('hostname'):
+                    # Reported twice by the same device, e.g. by a listing that overlaps a retried page
+                    log.debug(f'{ip} reported twice by {seen_ips[ip]}, applied once')
+                    continue
+                rejected_interface = rejection(device, interface, 'duplicate-ip', f'{ip} is already reported by {seen_ips[ip]}', network)
+            if rejected_interface is not None:
+                rejected.append(rejected_interface)
+                continue
+            seen_ips[interface['ipv4Address']] = device.get('hostname')
+            interfaces.append((interface, network))
+            network_counts[network] = network_counts.get(network, 0) + 1
+        checked.append((device, interfaces))
+
+    overlapping = find_new_overlapping(network_counts, get_subnet_id)
+    applicable = []
+    for device, interfaces in checked:
+        applicable_interfaces = []
+        for interface, network in interfaces:
+            if network in overlapping:
+                rejected.append(rejection(device, interface, 'overlapping-subnet', f'{network} overlaps {overlapping[network]}', network))
+                continue
+            applicable_interfaces.append(interface)
+        applicable.append(dict(device, interfaces=applicable_interfaces))
+
+    return applicable, rejected
+
+
+def count_per_check(rejected):
+    """Returns the number of rejected interfaces per check"""
+    counts = {}
+    for entry in rejected:
+        counts[entry['check']] = counts.get(entry['check'], 0) + 1
+    return counts
@@ -0,0 +1,144 @@
+from src import constants as c
+from src import http_utils
+from src import log_utils
+from src.errors import AuthError
+
+import requests
+
+##  DISABLE SSL WARNINGS
+from urllib3.exceptions import InsecureRequestWarning
+requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+
+log = log_utils.get_logger('vmanage_api')
+
+
+def login():
+    """Logs in to vManage and returns the session cookie and the XSRF token needed for the API"""
+    log.info('Requesting vManage session...')
+    payload = {'j_username': c.VMANAGE_USERNAME, 'j_password': c.VMANAGE_PASSWORD}
+    try:
+        response = http_utils.request(
+            'vmanage', 'POST',
+            c.VMANAGE_URL+c.VMANAGE_AUTH,
+            data=payload,
+            verify=False,
+            allow_redirects=False
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+
+    # vManage answers a failed login with the login page instead of an error status
+    session_id = response.cookies.get('JSESSIONID')
+    if response.status_code != 200 or session_id is None or b'<html' in response.content.lower():
+        raise AuthError('vManage login failed, check VMANAGE_USERNAME and AUTOIPAM_VMANAGE_PASSWORD')
+
+    headers = {'Cookie': f'JSESSIONID={session_id}'}
+    try:
+        response = http_utils.request('vmanage', 'GET', c.VMANAGE_URL+c.VMANAGE_TOKEN, headers=headers, verify=False)
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    if response.status_code != 200:
+        raise AuthError(f'vManage token request failed: {response.status_code}')
+
+    return {'session': session_id, 'token': response.text}
+
+
+def logout(credential):
+    """Ends a vManage session, freeing the session on the server"""
+    try:
+        http_utils.request('vmanage', 'GET', c.VMANAGE_URL+c.VMANAGE_LOGOUT, headers=get_headers(credential), verify=False, allow_redirects=False)
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+
+
+def get_headers(credential):
+    """Returns the headers that authenticate a request with a vManage session"""
+    return {
+        'Cookie': f"JSESSIONID={credential['session']}",
+        'X-XSRF-TOKEN': credential['token'],
+        'Content-Type': 'application/json'
+    }
+
+
+def check_session(response):
+    """Raises AuthError if the session was rejected.\n
+    An expired session is answered with the login page and status 200, so the content type is checked as well."""
+    if response.status_code in (401, 403) or response.headers.get('Content-Type', '').startswith('text/html'):
+        raise AuthError(f'vManage session rejected: {response.status_code}')
+
+
+def get_device_list(credential):
+    """Requests the device inventory, one page of VMANAGE_PAGE_SIZE devices at a time.\n
+    Pages are requested while vManage reports more entries, starting after the last id of the previous page."""
+    devices = []
+    params = {'count': c.VMANAGE_PAGE_SIZE}
+    while True:
+        try:
+            response = http_utils.request(
+                'vmanage', 'GET',
+                c.VMANAGE_URL+c.VMANAGE_DEVICES,
+                headers=get_headers(credential),
+                params=params,
+                verify=False
+            )
+        except ConnectionError as e:
+            raise e
+        except TimeoutError as e:
+            raise e
+        check_session(response)
+        body = response.json()
+        devices += body['data']
+
+        page_info = body.get('pageInfo')
+        if not page_info or not page_info.get('moreEntries') or not body['data']:
+            break
+        params['startId'] = page_info['endId']
+        log.debug(f"Requested {len(devices)} devices, continuing after {page_info['endId']}")
+    return devices
+
+
+def is_edge(device):
+    """Checks if an inventory entry is a reachable WAN edge, controllers and unreachable edges are skipped"""
+    return device.get('device-type') == 'vedge' and device.get('reachability') == 'reachable'
+
+
+def get_interfaces(credential, system_ip):
+    """Get interface information for an edge, identified by its system ip"""
+    log.debug(f'Requesting interface data for {system_ip}')
+    try:
+        response = http_utils.request(
+            'vmanage', 'GET',
+            c.VMANAGE_URL+c.VMANAGE_INTERFACES,
+            headers=get_headers(credential),
+            params={'deviceId': system_ip},
+            verify=False
+        )
+    except ConnectionError as e:
+        raise e
+    except TimeoutError as e:
+        raise e
+    check_session(response)
+    return response.json()['data']
+
+
+def main():
+    """Main function, should only be used for developement, testing and debugging.\n
+    Run against the local mock by setting VMANAGE_URL to the address printed by python -m src.vmanage_mock"""
+    credential = login()
+    devices = [device for device in get_device_list(credential) if is_edge(device)]
+    print(f'Number of edges: {len(devices)}')
+    if devices:
+        print(get_interfaces(credential, devices[0]['system-ip']))
+    logout(credential)
+
+
+if __name__ == "__main__":
+    print()
+    main()
+    print()
@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import uuid
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MOCK_PORT = 8473
+MOCK_TOKEN = 'mock-xsrf-token'
+
+
+def generate_inventory(edges):
+    """Generates an inventory of vEdge and IOS-XE edges plus the controllers vManage always lists"""
+    devices = [
+        {'deviceId': '1.1.1.1', 'system-ip': '1.1.1.1', 'host-name': 'vmanage01', 'device-type': 'vmanage', 'reachability': 'reachable', 'site-id': '1'},
+        {'deviceId': '1.1.1.2', 'system-ip': '1.1.1.2', 'host-name': 'vsmart01', 'device-type': 'vsmart', 'reachability': 'reachable', 'site-id': '1'}
+    ]
+    for index in range(edges):
+        system_ip = f'10.255.{index // 250}.{index % 250 + 1}'
+        devices.append({
+            'deviceId': system_ip,
+            'system-ip': system_ip,
+            'host-name': f'SE-MCK-{index // 10:03}-RT{index % 10 + 1:02}',
+            'device-type': 'vedge',
+            'device-model': 'vedge-cloud' if index % 2 == 0 else 'vedge-C8000V',
+            'personality': 'vedge',
+            'board-serial': f'MOCK{index:06}',
+            'site-id': str(1000 + index // 10),
+            'reachability': 'unreachable' if index % 50 == 49 else 'reachable'
+        })
+    return devices
+
+
+def generate_interfaces(system_ip):
+    """Generates the interfaces of an edge, in vEdge format for even and IOS-XE format for odd edges"""
+    index = int(system_ip.split('.')[2]) * 250 + int(system_ip.split('.')[3]) - 1
+    lan = f'10.{100 + index // 256 % 100}.{index % 256}.1'
+    if index % 2 == 0:
+        return [
+            {'ifname': 'ge0/0', 'af-type': 'ipv4', 'ip-address': f'192.0.2.{index % 250 + 1}/30', 'if-admin-status': 'Up', 'hwaddr': f'52:54:00:00:{index // 256 % 256:02x}:{index % 256:02x}', 'vpn-id': '0'},
+            {'ifname': 'ge0/1', 'af-type': 'ipv4', 'ip-address': f'{lan}/24', 'if-admin-status': 'Up', 'hwaddr': '-', 'vpn-id': '10'},
+            {'ifname': 'ge0/2', 'af-type': 'ipv4', 'ip-address': '-', 'if-admin-status': 'Down', 'hwaddr': '-', 'vpn-id': '10'},
+            {'ifname': 'ge0/3', 'af-type': 'ipv4', 'ip-address': '172.16.0.1/24', 'if-admin-status': 'Up', 'hwaddr': '-', 'vpn-id': '512'},
+            {'ifname': 'ge0/1', 'af-type': 'ipv6', 'ipv6-address': 'fe80::1/64', 'if-admin-status': 'Up', 'vpn-id': '10'}
+        ]
+    return [
+        {'ifname': 'GigabitEthernet1', 'af-type': 'ipv4', 'ip-address': f'198.51.100.{index % 250 + 1}', 'ipv4-subnet-mask': '255.255.255.252', 'if-admin-status': 'if-state-up', 'hwaddr': f'52:54:00:01:{index // 256 % 256:02x}:{index % 256:02x}', 'vpn-id': '0'},
+        {'ifname': 'GigabitEthernet2', 'af-type': 'ipv4', 'ip-address': lan, 'ipv4-subnet-mask': '255.255.255.0', 'if-admin-status': 'if-state-up', 'hwaddr': '-', 'vpn-id': '10'},
+        {'ifname': 'GigabitEthernet3', 'af-type': 'ipv4', 'ip-address': '10.99.0.1', 'ipv4-subnet-mask': '255.255.255.0', 'if-admin-status': 'if-state-down', 'hwaddr': '-', 'vpn-id': '10'}
+    ]
+
+
+def make_handler(devices, latency=0.0, page_size_limit=1000):
+    """Returns a request handler class serving the inventory, with an optional latency per request"""
+    sessions = set()
+    sessions_lock = threading.Lock()
+
+    class MockHandler(BaseHTTPRequestHandler):
+        def send_json(self, body, status=200):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_login_page(self):
+            # An expired session is answered with the login page, like vManage does
+            data = b'<html><body>Login</body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def session(self):
+            cookies = dict(item.strip().split('=', 1) for item in self.headers.get('Cookie', '').split(';') if '=' in item)
+            with sessions_lock:
+                return cookies.get('JSESSIONID') in sessions
+
+        def do_POST(self):
+            time.sleep(latency)
+            if self.path != '/j_security_check':
+                self.send_json({'error': 'not found'}, 404)
+                return
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            session_id = uuid.uuid4().hex
+            with sessions_lock:
+                sessions.add(session_id)
+            self.send_response(200)
+            self.send_header('Set-Cookie', f'JSESSIONID={session_id}; Path=/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            time.sleep(latency)
+            url = urllib.parse.urlparse(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            if url.path == '/logout':
+                self.send_response(302)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if not self.session():
+                self.send_login_page()
+                return
+            if url.path == '/dataservice/client/token':
+                data = MOCK_TOKEN.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.headers.get('X-XSRF-TOKEN') != MOCK_TOKEN:
+                self.send_json({'error': 'missing XSRF token'}, 403)
+            elif url.path == '/dataservice/device':
+                count = min(int(query.get('count', page_size_limit)), page_size_limit)
+                ids = [device['deviceId'] for device in devices]
+                start = ids.index(query['startId']) + 1 if 'startId' in query else 0
+                page = devices[start:start+count]
+                more = start + count < len(devices)
+                self.send_json({'data': page, 'pageInfo': {'startId': page[0]['deviceId'] if page else None, 'endId': page[-1]['deviceId'] if page else None, 'count': len(page), 'moreEntries': more}})
+            elif url.path == '/dataservice/device/interface':
+                self.send_json({'data': generate_interfaces(query['deviceId'])})
+            else:
+                self.send_json({'error': 'not found'}, 404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+
+def start(edges=1000, latency=0.0, host='127.0.0.1', port=MOCK_PORT):
+    """Starts the mock in a background thread and returns the server, port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), make_handler(generate_inventory(edges), latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='autoipam-vmanage-mock', daemon=True).start()
+    return server
+
+
+def main():
+    """Main function, should only be used for developement, testing and debugging.\n
+    Runs the mock until interrupted: python -m src.vmanage_mock [edges] [latency], then set VMANAGE_URL to http://127.0.0.1:8473"""
+    edges = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server = start(edges, latency)
+    print(f'Mock vManage with {edges} edges on http://127.0.0.1:{server.server_address[1]}, {latency}s latency per request')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import main
+from src import dnac_api
+from src import constants as c
+
+import types
+
+
+CAP = 100   # Page size of a DNA-center release that caps pages below DNAC_PAGE_SIZE
+
+
+def make_devices(count):
+    return [
+        {'id': f'id-{i}', 'hostname': f'SE-MUN-SW{i:04}', 'description': '', 'role': 'ACCESS', 'serialNumber': f'FOC{i:08}', 'family': 'Routers'}
+        for i in range(count)
+    ]
+
+
+def fake_dnac(monkeypatch, devices, count):
+    """Serves the device list in pages of at most CAP devices, and the count of the family or None"""
+    requested = []
+
+    def get_device_list(token, family, offset=0, filter_params=None, limit=None):
+        requested.append(offset)
+        return devices[offset - 1:offset - 1 + min(CAP, c.DNAC_PAGE_SIZE)]
+
+    monkeypatch.setattr(main, 'credentials', types.SimpleNamespace(call=lambda backend, function, *args: function(None, *args)))
+    monkeypatch.setattr(dnac_api, 'get_device_list', get_device_list)
+    monkeypatch.setattr(dnac_api, 'get_device_count', lambda token, family: count)
+    monkeypatch.setattr(dnac_api, 'get_interfaces', lambda token, device: [])
+    monkeypatch.setattr(c, 'DNAC_INTERFACE_STRATEGY', 'device')
+    return requested
+
+
+def test_page_offsets():
+    assert main.get_dnac_page_offsets(1200, 500) == [501, 1001]
+    # A first page capped below DNAC_PAGE_SIZE is paged by its own size
+    assert main.get_dnac_page_offsets(300, CAP) == [101, 201]
+    assert main.get_dnac_page_offsets(80, 80) == []
+    # Without a count the next page is always requested, the first page may be capped
+    assert main.get_dnac_page_offsets(None, CAP) == [101]
+    assert main.get_dnac_page_offsets(None, 0) == []
+
+
+def test_capped_pages_with_count(monkeypatch):
+    devices = make_devices(300)
+    requested = fake_dnac(monkeypatch, devices, 300)
+    result = main.get_from_dnac({'family': ['Routers']})
+    assert [device['hostname'] for device in result] == [device['hostname'] for device in devices]
+    assert sorted(requested) == [1, 101, 201]
+
+
+def test_capped_pages_without_count(monkeypatch):
+    # Filtered queries are not counted, so the pages are requested one after another until a short page
+    devices = make_devices(250)
+    requested = fake_dnac(monkeypatch, devices, None)
+    result = main.get_from_dnac({'family': ['Routers'], 'site': 'Global/SE/MUN'})
+    assert [device['hostname'] for device in result] == [device['hostname'] for device in devices]
+    assert requested == [1, 101, 201]
+
+
+def test_exact_pages_without_count(monkeypatch):
+    # A page as long as the first may be followed by more, the empty page ends the listing
+    devices = make_devices(200)
+    requested = fake_dnac(monkeypatch, devices, None)
+    result = main.get_from_dnac({'family': ['Routers'], 'site': 'Global/SE/MUN'})
+    assert len(result) == 200
+    assert requested == [1, 101, 201]
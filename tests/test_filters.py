@@ -0,0 +1,20 @@
+from src import filters
+
+import pytest
+
+
+def test_filters_per_source():
+    assert filters.parse_filters('site=Munksund hostname=SE-MUN-*', 'dnac') == {'site': ['Munksund'], 'hostname': ['SE-MUN-*']}
+    # Check Point has no sites, the filter would be ignored and every device synced
+    with pytest.raises(ValueError, match='not supported by checkpoint'):
+        filters.parse_filters('site=Munksund', 'checkpoint')
+    with pytest.raises(ValueError, match='not supported by dnac'):
+        filters.parse_filters('type=cluster-member', 'dnac')
+    with pytest.raises(ValueError, match='Unknown filter'):
+        filters.parse_filters('vlan=10', 'vmanage')
+
+
+def test_family_spelling():
+    assert filters.parse_filters('family="switches and hubs,ROUTERS"', 'dnac') == {'family': ['Switches and Hubs', 'Routers']}
+    with pytest.raises(ValueError, match='Unknown family'):
+        filters.parse_filters('family=Switches', 'dnac')
@@ -0,0 +1,63 @@
+from src import ipam_api, ipam_mirror
+from src import constants as c
+
+import types
+
+
+def fake_ipam(monkeypatch, subnets, addresses):
+    """Serves the section subnets and the addresses per subnet id, and records the requests"""
+    requested = []
+
+    def get_section_subnets(section_id):
+        requested.append('subnets')
+        return subnets
+
+    def get_all_addresses():
+        requested.append('all')
+        return [address for subnet_addresses in addresses.values() for address in subnet_addresses]
+
+    def get_subnet_addresses(subnet_id):
+        requested.append(subnet_id)
+        return addresses[subnet_id]
+
+    monkeypatch.setattr(ipam_api, 'get_section_subnets', get_section_subnets)
+    monkeypatch.setattr(ipam_api, 'get_all_addresses', get_all_addresses)
+    monkeypatch.setattr(ipam_api, 'get_subnet_addresses', get_subnet_addresses)
+    monkeypatch.setattr(ipam_api, 'get_vrfs', lambda: [])
+    monkeypatch.setattr(ipam_api, 'get_custom_fields', lambda: types.SimpleNamespace(json=lambda: {'data': {}}))
+    return requested
+
+
+def test_touched_refresh_keeps_mirror_stale(monkeypatch, tmp_path):
+    subnets = [
+        {'id': '1', 'subnet': '10.1.1.0', 'mask': '24', 'editDate': 'a'},
+        {'id': '2', 'subnet': '10.2.2.0', 'mask': '24', 'editDate': 'a'}
+    ]
+    addresses = {
+        1: [{'id': '11', 'subnetId': '1', 'ip': '10.1.1.5', 'editDate': 'a'}],
+        2: [{'id': '12', 'subnetId': '2', 'ip': '10.2.2.5', 'editDate': 'a'}]
+    }
+    requested = fake_ipam(monkeypatch, subnets, addresses)
+    mirror = ipam_mirror.IpamMirror(str(tmp_path / 'mirror.db'))
+
+    mirror.refresh(['10.1.1.7'])
+    assert requested == ['subnets', 'all']
+    assert not mirror.is_stale(c.IPAM_MIRROR_MAX_AGE)
+
+    # A refresh limited to the subnets of a run leaves the rest of the mirror as old as before
+    mirror.db.execute("UPDATE meta SET value = '0' WHERE key = 'last_refresh'")
+    requested.clear()
+    addresses[2] = [{'id': '13', 'subnetId': '2', 'ip': '10.2.2.6', 'editDate': 'b'}]
+    monkeypatch.setattr(c, 'MIRROR_FULL_REFRESH_MAX_AGE', float('inf'))
+    mirror.refresh(['10.1.1.7'])
+    assert requested == ['subnets', 1]
+    assert mirror.is_stale(c.IPAM_MIRROR_MAX_AGE)
+    assert mirror.get_address('10.2.2.6') is False
+
+    # The next run with other devices refreshes their subnets before looking them up
+    requested.clear()
+    mirror.refresh(['10.2.2.6'])
+    assert requested == ['subnets', 2]
+    assert mirror.get_address('10.2.2.6')['data'][0]['id'] == '13'
+    assert mirror.get_address('10.2.2.5') is False
+    mirror.close()
@@ -0,0 +1,121 @@
+from src import normalise
+
+import pytest
+
+
+# One raw object per (source, object type) and the interfaces the replaced select_*_data functions produced for it.
+# Every object has an interface in an ignored range (192.168.0.0/16), DNA-center and vManage one administratively down.
+# The only intended difference is the vManage hwaddr -, which select_vmanage_data passed on as mac address.
+CASES = {
+    ('checkpoint', 'simple-cluster'): (
+        {'type': 'simple-cluster', 'comments': 'Cluster', 'interfaces': {'objects': [
+            {'name': 'eth1', 'comments': 'Office LAN', 'ipv4-address': '10.192.1.1', 'ipv4-network-mask': '255.255.255.0', 'ipv4-mask-length': 24},
+            {'name': 'eth2', 'comments': 'Sync', 'ipv4-address': '', 'ipv4-network-mask': '', 'ipv4-mask-length': ''},
+            {'name': 'eth3', 'comments': 'NAT', 'ipv4-address': '192.168.1.1', 'ipv4-network-mask': '255.255.255.0', 'ipv4-mask-length': 24}
+        ]}},
+        [{
+            'interface-name': 'eth1', 'description': 'Office LAN', 'ipv4Address': '10.192.1.1', 'ipv4Mask': '255.255.255.0', 'cidr': 24,
+            'subnet-name': 'Office LAN', 'subnet-description': '', 'is-gateway': 1, 'mac': None, 'vlan-id': None
+        }]
+    ),
+    ('checkpoint', 'checkpoint-host'): (
+        {'type': 'checkpoint-host', 'comments': '', 'interfaces': [
+            {'name': 'Mgmt', 'subnet4': '10.192.2.10', 'subnet-mask': '255.255.255.0', 'mask-length4': 24},
+            {'name': 'eth1', 'subnet4': '192.168.2.10', 'subnet-mask': '255.255.255.0', 'mask-length4': 24}
+        ]},
+        [{
+            'interface-name': 'Mgmt', 'description': None, 'ipv4Address': '10.192.2.10', 'ipv4Mask': '255.255.255.0', 'cidr': 24,
+            'subnet-name': '', 'subnet-description': '', 'is-gateway': 0, 'mac': None, 'vlan-id': None
+        }]
+    ),
+    ('checkpoint', 'cluster-member'): (
+        {'type': 'cluster-member', 'comments': 'Member 1', 'interfaces': [
+            {'name': 'eth1', 'ipv4-address': '10.192.1.2', 'ipv4-network-mask': '255.255.255.0', 'ipv4-mask-length': 24},
+            {'name': 'eth2', 'ipv4-address': '192.168.1.2', 'ipv4-network-mask': '255.255.255.0', 'ipv4-mask-length': 24}
+        ]},
+        [{
+            'interface-name': 'eth1', 'description': 'Member 1', 'ipv4Address': '10.192.1.2', 'ipv4Mask': '255.255.255.0', 'cidr': 24,
+            'subnet-name': '', 'subnet-description': '', 'is-gateway': 0, 'mac': None, 'vlan-id': None
+        }]
+    ),
+    ('checkpoint', 'simple-gateway'): (
+        {'type': 'simple-gateway', 'comments': 'Gateway', 'interfaces': [
+            {'name': 'eth1', 'ipv4-address': '10.192.3.1', 'ipv4-network-mask': '255.255.255.128', 'ipv4-mask-length': 25},
+            {'name': 'eth2', 'ipv4-address': '', 'ipv4-network-mask': '', 'ipv4-mask-length': ''},
+            {'name': 'eth3', 'ipv4-address': '192.168.3.1', 'ipv4-network-mask': '255.255.255.0', 'ipv4-mask-length': 24}
+        ]},
+        [{
+            'interface-name': 'eth1', 'description': 'Gateway', 'ipv4Address': '10.192.3.1', 'ipv4Mask': '255.255.255.128', 'cidr': 25,
+            'subnet-name': '', 'subnet-description': '', 'is-gateway': 0, 'mac': None, 'vlan-id': None
+        }]
+    ),
+    ('checkpoint', 'EthernetInterface'): (
+        {'type': 'EthernetInterface', 'name': 'eth5', 'comments': 'Standalone', 'ipv4-address': '10.192.4.1', 'ipv4SubnetMask': '255.255.255.0',
+         'interfaces': [{'mask-length4': 24}]},
+        [{
+            'interface-name': 'eth5', 'description': 'Standalone', 'ipv4Address': '10.192.4.1', 'ipv4Mask': '255.255.255.0', 'cidr': 24,
+            'subnet-name': '', 'subnet-description': '', 'is-gateway': 0, 'mac': None, 'vlan-id': None
+        }]
+    ),
+    ('dnac', 'device'): (
+        [
+            {'portName': 'Vlan10', 'ipv4Address': '10.192.5.1', 'ipv4Mask': '255.255.255.0', 'macAddress': '00:11:22:33:44:55', 'vlanId': '10', 'adminStatus': 'UP'},
+            {'portName': 'Vlan20', 'ipv4Address': '10.192.6.1', 'ipv4Mask': '255.255.255.0', 'macAddress': '00:11:22:33:44:56', 'vlanId': '20', 'adminStatus': 'DOWN'},
+            {'portName': 'Vlan30', 'ipv4Address': '192.168.5.1', 'ipv4Mask': '255.255.255.0', 'macAddress': '00:11:22:33:44:57', 'vlanId': '30', 'adminStatus': 'UP'},
+            {'portName': 'Gi1/0/1', 'ipv4Address': None, 'ipv4Mask': None, 'macAddress': '00:11:22:33:44:58', 'vlanId': None, 'adminStatus': 'UP'}
+        ],
+        [{
+            'description': 'Vlan10', 'ipv4Address': '10.192.5.1', 'ipv4Mask': '255.255.255.0', 'mac': '00:11:22:33:44:55', 'vlan-id': '10',
+            'subnet-name': '', 'subnet-description': '', 'is-gateway': None
+        }]
+    ),
+    ('vmanage', 'edge'): (
+        [
+            {'ifname': 'ge0/0', 'af-type': 'ipv4', 'ip-address': '10.192.7.1/30', 'if-admin-status': 'Up', 'hwaddr': '52:54:00:00:00:01'},
+            {'ifname': 'GigabitEthernet2', 'af-type': 'ipv4', 'ip-address': '10.192.8.1', 'ipv4-subnet-mask': '255.255.255.0', 'if-admin-status': 'if-state-up', 'hwaddr': '-'},
+            {'ifname': 'ge0/2', 'af-type': 'ipv4', 'ip-address': '10.192.9.1/24', 'if-admin-status': 'Down', 'hwaddr': '52:54:00:00:00:02'},
+            {'ifname': 'GigabitEthernet3', 'af-type': 'ipv4', 'ip-address': '10.192.10.1', 'ipv4-subnet-mask': '255.255.255.0', 'if-admin-status': 'if-state-down', 'hwaddr': '-'},
+            {'ifname': 'ge0/3', 'af-type': 'ipv4', 'ip-address': '192.168.7.1/24', 'if-admin-status': 'Up', 'hwaddr': '-'},
+            {'ifname': 'ge0/4', 'af-type': 'ipv4', 'ip-address': '-', 'if-admin-status': 'Up', 'hwaddr': '-'},
+            {'ifname': 'ge0/0', 'af-type': 'ipv6', 'ipv6-address': 'fe80::1/64', 'if-admin-status': 'Up'}
+        ],
+        [
+            {
+                'description': 'ge0/0', 'ipv4Address': '10.192.7.1', 'ipv4Mask': '255.255.255.252', 'mac': '52:54:00:00:00:01', 'vlan-id': None,
+                'subnet-name': '', 'subnet-description': '', 'is-gateway': None
+            },
+            {
+                'description': 'GigabitEthernet2', 'ipv4Address': '10.192.8.1', 'ipv4Mask': '255.255.255.0', 'mac': None, 'vlan-id': None,
+                'subnet-name': '', 'subnet-description': '', 'is-gateway': None
+            }
+        ]
+    )
+}
+
+
+def test_every_normaliser_has_a_case():
+    assert set(CASES) == set(normalise.NORMALISERS)
+
+
+@pytest.mark.parametrize('key', list(CASES), ids=['/'.join(key) for key in CASES])
+def test_normalise(key):
+    raw, expected = CASES[key]
+    source, object_type = key
+    if normalise.NORMALISERS[key]['interfaces'] is None:
+        # DNA-center and vManage interfaces are requested separately from the device
+        assert normalise.normalise(source, object_type, {'hostname': 'SE-MUN-SW01'}, raw) == expected
+    else:
+        assert normalise.normalise(source, object_type, raw) == expected
+        assert normalise.normalise_batch(source, [(object_type, raw)]) == [(expected, None)]
+
+
+def test_ignored_standalone_interface():
+    raw = dict(CASES[('checkpoint', 'EthernetInterface')][0], **{'ipv4-address': '192.168.4.1'})
+    assert normalise.normalise('checkpoint', 'EthernetInterface', raw) == []
+
+
+def test_incomplete_object():
+    raw = {'type': 'cluster-member', 'comments': '', 'interfaces': [{'name': 'eth1', 'ipv4-address': '10.192.1.2'}]}
+    (interfaces, error), = normalise.normalise_batch('checkpoint', [('cluster-member', raw)])
+    assert interfaces is None
+    assert error.startswith('KeyError')
@@ -0,0 +1,11 @@
+from src import planner, prefetch
+
+import time
+
+
+def test_prefetch_bulk_cost_respects_max_age(monkeypatch):
+    loaded = {'timestamp': time.time() - 10, 'value': {}}
+    monkeypatch.setattr(prefetch, '_entries', {name: loaded for name in prefetch.IPAM_ITEMS})
+    # Fresh prefetched data is free for diff, update needs it reloaded
+    assert planner.get_bulk_endpoints('prefetch', 900) == []
+    assert planner.get_bulk_endpoints('prefetch', 0) == ['ipam vrf', 'ipam sections/subnets']
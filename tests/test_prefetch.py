@@ -0,0 +1,24 @@
+from src import ipam_api, prefetch
+
+
+def test_update_reloads_prefetched_ipam(monkeypatch):
+    loads = []
+    subnets = [{'id': 1, 'subnet': '10.1.1.0', 'mask': '24'}]
+    monkeypatch.setattr(prefetch, '_entries', {})
+    monkeypatch.setattr(ipam_api, 'get_vrfs', lambda: loads.append('vrfs') or [{'name': 'SCA', 'vrfId': 3}])
+    monkeypatch.setattr(ipam_api, 'get_section_subnets', lambda section_id: loads.append('subnets') or subnets)
+
+    ipam = prefetch.PrefetchedIpam(ipam_api)
+    assert ipam.get_subnet_id('10.1.1.0/24') == 1
+    assert loads == ['vrfs', 'subnets']
+
+    # Within PREFETCH_MAX_AGE the data is reused, unless the caller needs it fresher
+    assert prefetch.PrefetchedIpam(ipam_api, float('inf')).get_vrf_id('SCA') == 3
+    assert loads == ['vrfs', 'subnets']
+    subnets = [{'id': 2, 'subnet': '10.1.1.0', 'mask': '24'}]
+    ipam = prefetch.PrefetchedIpam(ipam_api, 0)
+    assert loads == ['vrfs', 'subnets', 'vrfs', 'subnets']
+    # Lookups of the view do not reload the data again
+    assert ipam.get_subnet_id('10.1.1.0/24') == 2
+    assert ipam.get_vrf_id('SCA') == 3
+    assert len(loads) == 4
@@ -0,0 +1,14 @@
+from src import ipam_api, singleflight, utils
+
+
+def test_freeze_sets():
+    # Equal sets give the same hashable key, whatever their iteration order
+    key = singleflight.freeze({'10.192.0.0/16', '10.0.0.0/8', '10.192.0.0/20'})
+    assert key == singleflight.freeze(frozenset(['10.192.0.0/20', '10.192.0.0/16', '10.0.0.0/8']))
+    hash(key)
+
+
+def test_get_master_subnet_with_calc_master_subnets(monkeypatch):
+    existing = {'10.192.0.0/16': {'network_address': '10.192.0.0', 'cidr': '16', 'id': 1}}
+    monkeypatch.setattr(ipam_api, 'get_subnet', lambda network_address: existing.get(network_address))
+    assert ipam_api.get_master_subnet(utils.calc_master_subnets('10.192.1.0/24')) == '10.192.0.0/16'
@@ -0,0 +1,27 @@
+from src import validate
+
+
+def interface(ip_address, mask):
+    return {'interface-name': 'eth0', 'description': '', 'ipv4Address': ip_address, 'ipv4Mask': mask, 'mac': ''}
+
+
+def test_overlap_skips_existing_subnets():
+    # 10.1.0.0/16 already exists in IPAM, so the new /24 inside it is created below it instead of overlapping it
+    devices = [
+        {'hostname': 'SW1', 'interfaces': [interface('10.1.0.1', '255.255.0.0'), interface('10.1.0.2', '255.255.0.0')]},
+        {'hostname': 'SW2', 'interfaces': [interface('10.1.1.1', '255.255.255.0'), interface('10.2.0.1', '255.255.255.0')]},
+        {'hostname': 'SW3', 'interfaces': [interface('10.2.0.2', '255.255.255.128')]}
+    ]
+    existing = {'10.1.0.0/16': 1}
+    lookups = []
+
+    def get_subnet_id(network_address):
+        lookups.append(network_address)
+        return existing.get(network_address)
+
+    applicable, rejected = validate.validate_plan(devices, lambda vrf_name: 1, get_subnet_id)
+    # New subnets still overlap each other, the more specific one is kept on a tie
+    assert [entry['subnet'] for entry in rejected] == ['10.2.0.0/24']
+    assert sum(len(device['interfaces']) for device in applicable) == 4
+    # Only networks overlapping another network of the plan are looked up
+    assert sorted(lookups) == ['10.1.0.0/16', '10.1.1.0/24', '10.2.0.0/24', '10.2.0.0/25']
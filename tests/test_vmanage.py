@@ -0,0 +1,28 @@
+import main
+from src import vmanage_mock, credentials
+from src import constants as c
+
+import pytest
+
+
+@pytest.fixture
+def mock_vmanage(monkeypatch):
+    server = vmanage_mock.start(edges=4, port=0)
+    monkeypatch.setattr(c, 'VMANAGE_URL', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setattr(c, 'VMANAGE_PASSWORD', 'mock')
+    monkeypatch.setattr(c, 'CREDENTIAL_DISK_CACHE', False)
+    monkeypatch.setattr(c, 'HTTP_CACHE_ENABLED', False)
+    yield server
+    # Logged out while the mock is still configured, instead of at exit against VMANAGE_URL
+    credentials.logout_all()
+    server.shutdown()
+
+
+def test_missing_hwaddr_is_no_mac(mock_vmanage):
+    # The mock reports hwaddr - for every LAN interface, which must not be written to IPAM as a mac address
+    devices = main.get_from_vmanage()
+    interfaces = [interface for device in devices for interface in device['interfaces']]
+    assert len(devices) == 4
+    assert {interface['description']: interface['mac'] for interface in interfaces if interface['description'] in ('ge0/1', 'GigabitEthernet2')} == {'ge0/1': None, 'GigabitEthernet2': None}
+    assert all(interface['mac'] not in ('-', '') for interface in interfaces)
+    assert devices[0]['interfaces'][0]['mac'] == '52:54:00:00:00:00'